@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+
+import functools
+
+import sympy
+from sympy.parsing.sympy_parser import parse_expr
+
+import numpy as np
+
+from .substitutions import all_subs
+from . import evaluation
+from . import instrumentation
+from . import model_cache
+
+# Number of distinct formulas kept compiled at any one time.
+CACHE_SIZE = 256
+
+# Relative step of the central differences used for formulas that cannot be differentiated.
+FINITE_DIFFERENCE_STEP = 1e-6
+
+
+class CompiledFormula:
+    """
+    Everything derived from a single expanded sympy expression.
+
+    The parameter ordering is fixed on construction.
+    The numpy functions and the LaTeX string are generated
+    the first time that they are requested, then reused.
+    Generated functions are also stored in the on-disk model_cache,
+    so that other processes can load them without regenerating them.
+    The functions are generated by the given evaluation backend,
+    or by the default backend if None.
+
+    Instances are shared between all users of the same expression,
+    and should be treated as immutable.
+
+    Parameters named in constants are passed after the free parameters,
+    but are not differentiated with respect to,
+    and are not included in free_params.
+    """
+    def __init__(self, expr, independent_var='x', backend=None, constants=()):
+        self.expr = expr
+        self.independent_var = independent_var
+        self.backend = evaluation.get_backend(backend)
+        self.constants = tuple(constants)
+
+        self.free_params = sorted(sym.name for sym in expr.free_symbols
+                                  if sym.name != independent_var and sym.name not in self.constants)
+        self.all_params = [independent_var] + self.free_params + list(self.constants)
+
+        self._fit_function = None
+        self._jacobian_function = None
+        self._hessian_function = None
+        self._real_expr = None
+        self._latex = None
+
+    @property
+    def fit_function(self):
+        if self._fit_function is None:
+            self._fit_function = self._load_function(
+                'value', lambda: [self.expr], tuple_result=False)
+        return self._fit_function
+
+    @property
+    def jacobian_function(self):
+        """
+        A single function returning the value of the formula,
+        followed by the partial derivative with respect to each free parameter.
+        Subexpressions shared between the formula and its derivatives
+        are evaluated only once.
+
+        None if the derivatives cannot be generated,
+        such as the DiracDelta from differentiating Heaviside,
+        in which case value_and_jacobian uses finite differences.
+        """
+        if self._jacobian_function is None:
+            self._jacobian_function = self._load_derivatives(
+                'jacobian', lambda: [self.real_expr] + self._derivatives())
+        return self._jacobian_function or None
+
+    @property
+    def hessian_function(self):
+        """
+        As jacobian_function, followed by the second partial derivatives
+        for each pair of free parameters (i,j) with i <= j, in row-major order.
+
+        None if the second derivatives cannot be generated,
+        in which case value_jacobian_and_hessian uses finite differences of the jacobian.
+        """
+        if self._hessian_function is None:
+            def exprs():
+                params = self._real_params()
+                derivatives = self._derivatives()
+                second_derivatives = [derivatives[i].diff(params[j])
+                                      for i in range(len(params))
+                                      for j in range(i, len(params))]
+                return [self.real_expr] + derivatives + second_derivatives
+            self._hessian_function = self._load_derivatives('hessian', exprs)
+        return self._hessian_function or None
+
+    def prepare_derivatives(self, hessian=False):
+        """
+        Generates the jacobian function, and the hessian function if hessian is true,
+          so that later fits sharing this formula do not each generate them.
+        """
+        self.jacobian_function
+        if hessian:
+            self.hessian_function
+
+    @property
+    def real_expr(self):
+        """
+        The expression, with every symbol declared real.
+        Parsed symbols may be complex, so that derivatives of functions such as Abs
+        would otherwise contain re() and im() terms that cannot be evaluated.
+        """
+        if self._real_expr is None:
+            self._real_expr = self.expr.xreplace(
+                {sym:sympy.Symbol(sym.name, real=True) for sym in self.expr.free_symbols})
+        return self._real_expr
+
+    def _real_params(self):
+        return [sympy.Symbol(name, real=True) for name in self.free_params]
+
+    def _derivatives(self):
+        return [self.real_expr.diff(param) for param in self._real_params()]
+
+    def _load_derivatives(self, kind, exprs):
+        # False, rather than None, marks derivatives that cannot be printed,
+        #   so that generating them is not attempted again.
+        try:
+            return self._load_function(kind, exprs)
+        except NotImplementedError:
+            instrumentation.count('compile.no_' + kind)
+            return False
+
+    def _load_function(self, kind, exprs, tuple_result=True):
+        # Use the cached source if available,
+        #   only building the expressions if it must be generated.
+        name = '_' + kind
+        cache = model_cache.default_cache()
+        source = None
+        if cache is not None:
+            with instrumentation.timer('compile.cache_lookup'):
+                key = cache.key(self.expr, self.all_params, '{}.{}.{}'.format(
+                    kind, self.backend.name, self.backend.version))
+                source = cache.get(key)
+
+        if source is None:
+            with instrumentation.timer('compile.generate_' + kind):
+                source = generate_source(name, self.all_params, exprs(), tuple_result, self.backend)
+            if cache is not None:
+                cache.put(key, source)
+
+        with instrumentation.timer('compile.load'):
+            return load_function(name, source, self.backend)
+
+    def evaluate(self, x, params, out=None):
+        """
+        Evaluate the formula at x, with params the values of free_params in order.
+
+        If out is given, the result is written into it and out is returned.
+        It must have the broadcast shape of x and the parameters.
+        """
+        blocks = self._blocks(x, params)
+        if blocks is None:
+            return self.fit_function(x, *params, _out=out)
+
+        out = _output(out, np.shape(x))
+        for block in blocks:
+            self.fit_function(x[block], *params, _out=out[block])
+        return out
+
+    def value_and_jacobian(self, x, *params, jacobian_out=None):
+        """
+        Evaluate the formula and its jacobian.
+
+        Arguments are passed in the same order as to fit_function.
+        Returns a tuple of (value, jacobian).
+        The value has the broadcast shape of x and the parameters,
+        and the jacobian has one additional trailing axis,
+        indexed by free parameter.
+        If jacobian_out is given, the jacobian is written into it rather than a new array.
+        """
+        n = len(self.free_params)
+        if self.jacobian_function is None:
+            value = self.evaluate(x, params)
+            jacobian = _output(jacobian_out, np.shape(value) + (n,))
+            for i, (up, down, step) in enumerate(_steps(params, n)):
+                jacobian[..., i] = (self.evaluate(x, up) - self.evaluate(x, down))/(2*step)
+            return value, jacobian
+
+        blocks = self._blocks(x, params)
+        if blocks is None:
+            results = self.jacobian_function(x, *params)
+            shape = np.broadcast(x, *params).shape
+            value = np.broadcast_to(results[0], shape)
+            jacobian = _output(jacobian_out, shape + (n,))
+            _fill_derivatives(results, n, jacobian, Ellipsis)
+            return value, jacobian
+
+        value = np.empty(np.shape(x))
+        jacobian = _output(jacobian_out, value.shape + (n,))
+        for block in blocks:
+            results = self.jacobian_function(x[block], *params)
+            value[block] = results[0]
+            _fill_derivatives(results, n, jacobian, block)
+        return value, jacobian
+
+    def value_jacobian_and_hessian(self, x, *params, jacobian_out=None, hessian_out=None):
+        """
+        Evaluate the formula, its jacobian, and its hessian.
+
+        As value_and_jacobian, with the hessian having two additional
+        trailing axes, each indexed by free parameter.
+        """
+        n = len(self.free_params)
+        if self.hessian_function is None:
+            value, jacobian = self.value_and_jacobian(x, *params, jacobian_out=jacobian_out)
+            hessian = _output(hessian_out, jacobian.shape + (n,))
+            for i, (up, down, step) in enumerate(_steps(params, n)):
+                hessian[..., i, :] = (self.value_and_jacobian(x, *up)[1] -
+                                      self.value_and_jacobian(x, *down)[1])/(2*step[..., np.newaxis])
+            hessian[...] = 0.5*(hessian + np.swapaxes(hessian, -1, -2))
+            return value, jacobian, hessian
+
+        blocks = self._blocks(x, params)
+        if blocks is None:
+            results = self.hessian_function(x, *params)
+            shape = np.broadcast(x, *params).shape
+            value = np.broadcast_to(results[0], shape)
+            jacobian = _output(jacobian_out, shape + (n,))
+            hessian = _output(hessian_out, shape + (n,n))
+            _fill_derivatives(results, n, jacobian, Ellipsis, hessian)
+            return value, jacobian, hessian
+
+        value = np.empty(np.shape(x))
+        jacobian = _output(jacobian_out, value.shape + (n,))
+        hessian = _output(hessian_out, value.shape + (n,n))
+        for block in blocks:
+            results = self.hessian_function(x[block], *params)
+            value[block] = results[0]
+            _fill_derivatives(results, n, jacobian, block, hessian)
+        return value, jacobian, hessian
+
+    def _blocks(self, x, params):
+        # Slices of x to evaluate one at a time, so that the temporaries of each operation
+        #   stay in cache, or None to evaluate all of x at once.
+        block_size = self.backend.block_size
+        if block_size is None or np.ndim(x) != 1 or len(x) <= block_size:
+            return None
+        if any(np.ndim(param) != 0 for param in params):
+            return None
+        return [slice(start, start + block_size) for start in range(0, len(x), block_size)]
+
+    def curve_fit_functions(self):
+        """
+        Returns a (function, jacobian) pair for use with scipy.optimize.curve_fit.
+
+        The function evaluates only the value of the formula,
+        so that trial steps that the optimizer rejects do not compute the jacobian.
+        The jacobian is written into the same array at each iteration.
+        jacobian is None if the derivatives cannot be generated,
+        so that curve_fit estimates them by finite differences.
+        """
+        def function(x, *params):
+            return self.evaluate(x, params)
+
+        if not self.has_derivatives:
+            return function, None
+
+        last = {'jacobian':None}
+        def jacobian(x, *params):
+            last['jacobian'] = self.value_and_jacobian(x, *params, jacobian_out=last['jacobian'])[1]
+            return last['jacobian']
+
+        return function, jacobian
+
+    @property
+    def has_derivatives(self):
+        return self.jacobian_function is not None
+
+    def with_fixed(self, fixed_values):
+        """
+        Returns a PartialFormula with the parameters of fixed_values,
+          a dict mapping parameter name to value, held at those values.
+        Returns self if fixed_values is empty.
+
+        The kernels of the partial formula are compiled once for each set of names,
+          so refitting with other fixed values does not recompile.
+        """
+        constants = tuple(name for name in self.free_params if name in fixed_values)
+        if not constants:
+            return self
+        reduced = _compile_expression(self.expr, self.independent_var, self.backend.name, constants)
+        return PartialFormula(reduced, [fixed_values[name] for name in constants])
+
+    @property
+    def latex(self):
+        if self._latex is None:
+            with instrumentation.timer('compile.latex'):
+                self._latex = '${}$'.format(sympy.latex(self.expr))
+        return self._latex
+
+
+class PartialFormula:
+    """
+    A formula with some of its parameters held at fixed values.
+
+    Provides the evaluation methods of CompiledFormula,
+      in terms of the remaining free parameters only,
+      so that it can be fit in place of a CompiledFormula.
+    """
+    def __init__(self, compiled, values):
+        self.compiled = compiled
+        self.values = tuple(float(val) for val in values)
+        self.independent_var = compiled.independent_var
+        self.backend = compiled.backend
+        self.free_params = compiled.free_params
+        self.all_params = [self.independent_var] + self.free_params
+
+    def fit_function(self, x, *params, _out=None):
+        return self.compiled.fit_function(x, *(params + self.values), _out=_out)
+
+    def evaluate(self, x, params, out=None):
+        return self.compiled.evaluate(x, tuple(params) + self.values, out=out)
+
+    def value_and_jacobian(self, x, *params, **outputs):
+        return self.compiled.value_and_jacobian(x, *(params + self.values), **outputs)
+
+    def value_jacobian_and_hessian(self, x, *params, **outputs):
+        return self.compiled.value_jacobian_and_hessian(x, *(params + self.values), **outputs)
+
+    @property
+    def has_derivatives(self):
+        return self.compiled.has_derivatives
+
+    curve_fit_functions = CompiledFormula.curve_fit_functions
+
+
+def _fill_derivatives(results, n, jacobian, index, hessian=None):
+    # Copy the derivatives returned by a generated function into the jacobian and hessian.
+    for i, derivative in enumerate(results[1:n+1]):
+        jacobian[index, i] = derivative
+
+    if hessian is not None:
+        second_derivatives = iter(results[n+1:])
+        for i in range(n):
+            for j in range(i, n):
+                hessian[index, i, j] = hessian[index, j, i] = next(second_derivatives)
+
+
+def _steps(params, n):
+    # (raised params, lowered params, step) for the central difference
+    #   of each of the first n parameters
+    for i, param in enumerate(params[:n]):
+        step = FINITE_DIFFERENCE_STEP*np.maximum(1.0, np.abs(param))
+        up = list(params)
+        up[i] = param + step
+        down = list(params)
+        down[i] = param - step
+        yield up, down, step
+
+
+def _output(out, shape):
+    # The array given, if it can hold the result, or a new one
+    if out is not None and out.shape == shape:
+        return out
+    return np.empty(shape)
+
+
+def generate_function(name, args, exprs, tuple_result=True, backend=None):
+    """
+    Generate a numpy function returning a tuple of the expressions given.
+    If tuple_result is False, exprs must hold a single expression,
+      which is returned on its own.
+
+    Common subexpressions are pulled out into temporaries,
+    so that they are only evaluated once per call.
+    """
+    backend = evaluation.get_backend(backend)
+    return load_function(name, generate_source(name, args, exprs, tuple_result, backend), backend)
+
+
+def generate_source(name, args, exprs, tuple_result=True, backend=None):
+    """
+    Returns the python source of the function made by generate_function.
+    """
+    backend = evaluation.get_backend(backend)
+    replacements, reduced = sympy.cse(exprs, symbols=sympy.numbered_symbols('_cse'))
+    return backend.source(name, args, replacements, reduced, tuple_result)
+
+
+def load_function(name, source, backend=None):
+    """
+    Execute the source of a generated function, and return the function.
+    """
+    backend = evaluation.get_backend(backend)
+    namespace = backend.namespace()
+    exec(source, namespace)
+    return namespace[name]
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse_text(text):
+    """
+    Parse a formula string into a sympy expression.
+
+    Raises SyntaxError or TokenError if the string is not a valid formula.
+    """
+    with instrumentation.timer('compile.parse'):
+        return parse_expr(text)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def expand_text(text, subexpressions=()):
+    """
+    Parse a formula string, then apply all subexpressions.
+
+    subexpressions must be given as a tuple, so that it can be hashed.
+    """
+    expr = parse_text(text)
+    if subexpressions:
+        with instrumentation.timer('compile.expand'):
+            expr = all_subs(expr, subexpressions)
+    return expr
+
+
+def compile_expression(expr, independent_var='x', backend=None):
+    """
+    Return the CompiledFormula for an already expanded sympy expression.
+
+    Formulas that are written differently but expand to the same expression
+    share a single CompiledFormula.
+    backend is the name of the evaluation backend, or None for the default.
+    """
+    return _compile_expression(expr, independent_var, evaluation.get_backend(backend).name)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _compile_expression(expr, independent_var, backend, constants=()):
+    return CompiledFormula(expr, independent_var, backend, constants)
+
+
+def compile_formula(text, subexpressions=None, independent_var='x', backend=None):
+    """
+    Return the CompiledFormula for a formula string.
+
+    Ex:
+        compile_formula('linear(m,b)', [('linear(slope,offset)','slope*x + offset')])
+    """
+    subexpressions = tuple(subexpressions) if subexpressions else ()
+    return compile_expression(expand_text(text, subexpressions), independent_var, backend)
+
+
+def clear_cache():
+    """
+    Drop all cached formulas.
+    Must be called whenever the meaning of a subexpression changes.
+    """
+    parse_text.cache_clear()
+    expand_text.cache_clear()
+    _compile_expression.cache_clear()
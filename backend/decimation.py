@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# Number of points read at once while building a pyramid.
+CHUNK_SIZE = 1 << 20
+
+# Data sets with at most this many points are drawn without decimation.
+DECIMATION_THRESHOLD = 10000
+
+# Number of points in each block whose bounds are kept for reading only the blocks in view.
+SCAN_BLOCK_SIZE = 4096
+
+
+class MinMaxPyramid:
+    """
+    Min/max decimation of y values sampled at increasing x values, for drawing as a line.
+
+    Level k holds the minimum and maximum y of each block of 2**(k+3) consecutive points,
+      along with the x value of the first point in the block.
+    Each level is half the size of the one before,
+      so the pyramid takes at most a quarter of the memory of the data.
+    decimate() picks the coarsest level that still has several blocks per pixel column,
+      so that its cost depends on the width of the canvas, and not the size of the data.
+    """
+    def __init__(self, xdata, ydata, chunk_size=CHUNK_SIZE):
+        self.xdata = xdata
+        self.ydata = ydata
+
+        block = 8
+        chunk_size -= chunk_size % block
+        firsts, mins, maxs = [], [], []
+        for start in range(0, len(ydata), chunk_size):
+            x = np.asarray(xdata[start:start+chunk_size])
+            y = np.asarray(ydata[start:start+chunk_size])
+            starts = np.arange(0, len(y), block)
+            firsts.append(x[starts])
+            mins.append(np.minimum.reduceat(y, starts))
+            maxs.append(np.maximum.reduceat(y, starts))
+
+        self.levels = [(block, np.concatenate(firsts), np.concatenate(mins), np.concatenate(maxs))]
+        while len(self.levels[-1][1]) > 1:
+            block, first, ymin, ymax = self.levels[-1]
+            starts = np.arange(0, len(first), 2)
+            self.levels.append((2*block, first[starts],
+                                np.minimum.reduceat(ymin, starts),
+                                np.maximum.reduceat(ymax, starts)))
+
+    def visible(self, low, high):
+        """
+        Returns the index range of the points within [low, high],
+          extended by one point on either side so that lines leave the view.
+        """
+        i0 = max(np.searchsorted(self.xdata, low) - 1, 0)
+        i1 = min(np.searchsorted(self.xdata, high, side='right') + 1, len(self.xdata))
+        return i0, i1
+
+    def decimate(self, low, high, n_columns):
+        """
+        Returns (x, y, decimated) for the points within [low, high].
+
+        If there are few enough points to draw each of them, these are returned as-is,
+          with decimated False.
+        Otherwise, each of the n_columns pixel columns is reduced to the minimum and maximum
+          y value within it, with decimated True.
+        The limits may be given in either order, as for an inverted axis.
+        """
+        low, high = sorted((low, high))
+        i0, i1 = self.visible(low, high)
+        n_visible = i1 - i0
+        if n_visible <= 4*n_columns:
+            return np.asarray(self.xdata[i0:i1]), np.asarray(self.ydata[i0:i1]), False
+
+        # Coarsest level with at least two blocks per pixel column
+        for block, first, ymin, ymax in reversed(self.levels):
+            if n_visible/block >= 2*n_columns:
+                break
+        b0 = i0//block
+        b1 = -(-i1//block)
+        first, ymin, ymax = first[b0:b1], ymin[b0:b1], ymax[b0:b1]
+
+        column = np.floor((first - low)/(high - low)*n_columns)
+        column = np.clip(column, -1, n_columns)
+        starts = np.flatnonzero(np.diff(column, prepend=np.nan) != 0)
+
+        x = np.repeat(first[starts], 2)
+        y = np.empty(len(x))
+        y[0::2] = np.minimum.reduceat(ymin, starts)
+        y[1::2] = np.maximum.reduceat(ymax, starts)
+        return x, y, True
+
+
+class OccupancyPyramid:
+    """
+    Decimation of unordered (x, y) points, for drawing as markers.
+
+    Each level divides the extent of the data into a square grid of cells,
+      and keeps one representative point for each occupied cell.
+    The finest level has resolution cells on a side, and each further level halves it.
+    Drawing one point per occupied pixel looks the same as drawing every point,
+      so decimate() never needs more points than the canvas has pixels.
+    When zoomed in past the finest level, the points themselves are drawn.
+    The x and y bounds of each block of scan_block_size points are kept,
+      so that only the blocks overlapping the view are read.
+    """
+    def __init__(self, xdata, ydata, x_range, y_range, resolution=4096, chunk_size=CHUNK_SIZE,
+                 scan_block_size=SCAN_BLOCK_SIZE):
+        self.xdata = xdata
+        self.ydata = ydata
+        self.x_range = x_range
+        self.y_range = y_range
+        self.scan_block_size = scan_block_size
+        chunk_size -= chunk_size % scan_block_size
+        self.chunk_size = max(chunk_size, scan_block_size)
+
+        cells, xs, ys = [], [], []
+        bounds = []
+        for start in range(0, len(xdata), self.chunk_size):
+            x = np.asarray(xdata[start:start+self.chunk_size])
+            y = np.asarray(ydata[start:start+self.chunk_size])
+            starts = np.arange(0, len(x), scan_block_size)
+            bounds.append((np.fmin.reduceat(x, starts), np.fmax.reduceat(x, starts),
+                           np.fmin.reduceat(y, starts), np.fmax.reduceat(y, starts)))
+            cell, index = np.unique(self._cells(x, y, resolution), return_index=True)
+            cells.append(cell)
+            xs.append(x[index])
+            ys.append(y[index])
+        cell, index = np.unique(np.concatenate(cells), return_index=True)
+        # (xmin, xmax, ymin, ymax) of each block, ignoring NaN
+        self.block_bounds = tuple(np.concatenate(b) for b in zip(*bounds)) if bounds else (np.zeros(0),)*4
+
+        # Cell ids are column-major, so each level is sorted by column.
+        self.levels = [(resolution, cell, np.concatenate(xs)[index], np.concatenate(ys)[index])]
+        while resolution > 1:
+            cell = (cell//resolution//2)*(resolution//2) + (cell%resolution)//2
+            resolution //= 2
+            cell, index = np.unique(cell, return_index=True)
+            _, _, x, y = self.levels[-1]
+            self.levels.append((resolution, cell, x[index], y[index]))
+
+    def _cells(self, x, y, resolution):
+        ix = self._bin(x, self.x_range, resolution)
+        iy = self._bin(y, self.y_range, resolution)
+        return ix*resolution + iy
+
+    @staticmethod
+    def _bin(values, value_range, n):
+        low, high = value_range
+        width = (high - low) or 1.0
+        return np.clip(((values - low)/width*n).astype(np.int64), 0, n-1)
+
+    def decimate(self, xlim, ylim, width, height):
+        """
+        Returns (x, y) of at most one point per pixel,
+          for a view of xlim and ylim drawn on width by height pixels.
+        The limits may be given in either order, as for an inverted axis.
+        """
+        xlim, ylim = sorted(xlim), sorted(ylim)
+        pixel_width = (xlim[1] - xlim[0])/width
+        pixel_height = (ylim[1] - ylim[0])/height
+        data_width = (self.x_range[1] - self.x_range[0]) or 1.0
+        data_height = (self.y_range[1] - self.y_range[0]) or 1.0
+
+        # Coarsest level whose cells are no larger than a pixel
+        for resolution, cell, x, y in reversed(self.levels):
+            if data_width/resolution <= pixel_width and data_height/resolution <= pixel_height:
+                break
+        else:
+            # Zoomed in past the finest level, so use the points themselves.
+            x, y = self._scan(xlim, ylim)
+            return self._one_per_pixel(x, y, xlim, ylim, width, height)
+
+        # Columns of the grid that overlap the view
+        c0 = self._bin(np.array(xlim[0]), self.x_range, resolution)
+        c1 = self._bin(np.array(xlim[1]), self.x_range, resolution)
+        i0 = np.searchsorted(cell, c0*resolution)
+        i1 = np.searchsorted(cell, (c1+1)*resolution)
+        x, y = x[i0:i1], y[i0:i1]
+
+        in_view = (x >= xlim[0]) & (x <= xlim[1]) & (y >= ylim[0]) & (y <= ylim[1])
+        return self._one_per_pixel(x[in_view], y[in_view], xlim, ylim, width, height)
+
+    def _scan(self, xlim, ylim):
+        """
+        Returns (x, y) of the points within the view,
+          reading only the runs of blocks whose bounds overlap it.
+        """
+        xmin, xmax, ymin, ymax = self.block_bounds
+        overlap = (xmax >= xlim[0]) & (xmin <= xlim[1]) & (ymax >= ylim[0]) & (ymin <= ylim[1])
+        edges = np.flatnonzero(np.diff(overlap.astype(np.int8), prepend=0, append=0))
+        xs, ys = [np.zeros(0)], [np.zeros(0)]
+        for run_start, run_end in zip(edges[0::2]*self.scan_block_size,
+                                      edges[1::2]*self.scan_block_size):
+            for start in range(run_start, min(run_end, len(self.xdata)), self.chunk_size):
+                end = min(start + self.chunk_size, run_end)
+                x = np.asarray(self.xdata[start:end])
+                y = np.asarray(self.ydata[start:end])
+                in_view = (x >= xlim[0]) & (x <= xlim[1]) & (y >= ylim[0]) & (y <= ylim[1])
+                xs.append(x[in_view])
+                ys.append(y[in_view])
+        return np.concatenate(xs), np.concatenate(ys)
+
+    @classmethod
+    def _one_per_pixel(cls, x, y, xlim, ylim, width, height):
+        width, height = max(int(width), 1), max(int(height), 1)
+        pixel = cls._bin(x, xlim, width)*height + cls._bin(y, ylim, height)
+        _, index = np.unique(pixel, return_index=True)
+        return x[index], y[index]
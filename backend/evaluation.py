@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+"""
+Backends for generating the numerical kernels of a CompiledFormula.
+
+The numpy backend evaluates one operation at a time,
+  allocating a temporary array for each.
+The numexpr and numba backends generate a fused kernel,
+  which evaluates many operations per pass over the data, on several threads.
+Their kernels fall back to the numpy code for results smaller than FUSED_THRESHOLD,
+  where the fixed cost of starting a fused kernel is larger than the saving.
+
+The backend used for new formulas is chosen by set_default_backend(),
+  or by the PYTHOTH_BACKEND environment variable.
+The default, 'auto', is the first of AUTO_ORDER that is installed.
+As the fused kernels gain most of their speed from running on several cores,
+  'auto' uses numpy on single-core machines.
+
+Ex:
+    from backend import evaluation
+    evaluation.set_default_backend('numpy')
+"""
+
+import importlib
+import os
+import threading
+
+import numpy as np
+import sympy
+from sympy.codegen.rewriting import create_expand_pow_optimization
+from sympy.printing.lambdarepr import NumExprPrinter
+from sympy.printing.numpy import SciPyPrinter
+from sympy.printing.pycode import PythonCodePrinter
+
+# Results with at least this many elements are computed by the fused kernel.
+FUSED_THRESHOLD = 1 << 15
+
+# The backends tried, in order, by 'auto'.
+AUTO_ORDER = ('numexpr', 'numba')
+
+# Whether each optional module can be imported
+_available = {}
+
+# numpy evaluates x**n with a call to pow() for each element, except for n=2.
+#   Small integer powers of a variable are much faster as repeated multiplication.
+_expand_powers = create_expand_pow_optimization(8)
+
+
+class NumPyBackend:
+    """
+    Evaluates each operation as a separate numpy call.
+    Always available, and the fastest for small arrays.
+    """
+    name = 'numpy'
+    module = None
+    # Changed whenever the generated source changes, so that cached source is not reused.
+    version = 3
+    # Large 1-d arrays are evaluated this many points at a time,
+    #   so that the temporary arrays of each operation stay in cache.
+    block_size = 1 << 14
+
+    @classmethod
+    def available(cls):
+        if cls.module is None:
+            return True
+        if cls.module not in _available:
+            try:
+                importlib.import_module(cls.module)
+                _available[cls.module] = True
+            except ImportError:
+                _available[cls.module] = False
+        return _available[cls.module]
+
+    def namespace(self):
+        # Special functions such as erf and gamma are printed as calls to scipy.special.
+        import scipy.special
+        namespace = dict(vars(np))
+        namespace['numpy'] = np
+        namespace['scipy'] = scipy
+        namespace['_store'] = store
+        return namespace
+
+    def source(self, name, args, replacements, reduced, tuple_result):
+        """
+        Returns the source of a function of args computing the reduced expressions,
+          where replacements are the (symbol, expression) pairs from sympy.cse.
+        If tuple_result is False, the function also takes an optional _out array,
+          into which the single result is written.
+        """
+        lines = [signature(name, args, tuple_result)]
+        lines.extend(numpy_body(replacements, reduced, tuple_result, '    '))
+        return '\n'.join(lines) + '\n'
+
+
+class NumExprBackend(NumPyBackend):
+    """
+    Evaluates each statement that involves an array with a single numexpr call,
+      which makes one multi-threaded pass and no intermediate arrays.
+    Statements involving only scalars, and any using functions that numexpr lacks,
+      are left to numpy.
+    """
+    name = 'numexpr'
+    module = 'numexpr'
+    block_size = None
+
+    # sympy functions with a numexpr equivalent of the name printed by NumExprPrinter
+    functions = (sympy.exp, sympy.log, sympy.sin, sympy.cos, sympy.tan,
+                 sympy.asin, sympy.acos, sympy.atan, sympy.atan2,
+                 sympy.sinh, sympy.cosh, sympy.tanh,
+                 sympy.asinh, sympy.acosh, sympy.atanh, sympy.Abs)
+
+    def namespace(self):
+        import numexpr
+        namespace = super().namespace()
+        namespace['_evaluate'] = numexpr.evaluate
+        namespace['_use_fused'] = use_fused
+        namespace['_as_float'] = as_float
+        return namespace
+
+    def source(self, name, args, replacements, reduced, tuple_result):
+        # Names holding arrays, rather than scalars, when only the independent variable is an array
+        arrays = set(args[:1])
+        for symbol, expr in replacements:
+            if any(sym.name in arrays for sym in expr.free_symbols):
+                arrays.add(symbol.name)
+
+        printer = SciPyPrinter()
+        def statement(expr):
+            if not self.fusable(expr, arrays):
+                return printer.doprint(expr)
+            names = sorted(sym.name for sym in expr.free_symbols)
+            return "_evaluate('{}', local_dict={{{}}})".format(
+                self.print_fused(expr),
+                ', '.join("'{0}':{0}".format(name) for name in names))
+
+        lines = [signature(name, args, tuple_result),
+                 '    if _use_fused({}):'.format(', '.join(args)),
+                 '        {}, = _as_float({})'.format(', '.join(args), ', '.join(args))]
+        for symbol, expr in replacements:
+            lines.append('        {} = {}'.format(symbol, statement(expr)))
+        if not tuple_result and self.fusable(reduced[0], arrays):
+            # numexpr writes the result directly into the output array.
+            lines.append('        return {}'.format(statement(reduced[0])[:-1] + ', out=_out)'))
+        else:
+            lines.append('        ' + return_statement([statement(expr) for expr in reduced], tuple_result))
+        lines.extend(numpy_body(replacements, reduced, tuple_result, '    '))
+        return '\n'.join(lines) + '\n'
+
+    def fusable(self, expr, arrays):
+        """
+        Whether expr depends on an array, and can be evaluated by numexpr.
+        """
+        if not any(sym.name in arrays for sym in expr.free_symbols):
+            return False
+        if isinstance(expr, sympy.Symbol):
+            return False
+        return all(self.supported(node) for node in sympy.preorder_traversal(expr))
+
+    def supported(self, node):
+        if isinstance(node, sympy.Number):
+            return bool(node.is_finite)
+        return isinstance(node, (sympy.Symbol, sympy.NumberSymbol, sympy.Add, sympy.Mul, sympy.Pow)
+                          + self.functions)
+
+    @staticmethod
+    def print_fused(expr):
+        # numexpr knows neither fractions nor named constants such as pi.
+        replace = {atom:sympy.Float(atom, 17) for atom in expr.atoms(sympy.Rational, sympy.NumberSymbol)
+                   if not atom.is_Integer}
+        expr = expr.xreplace(replace)
+        return super(NumExprPrinter, NumExprPrinter()).doprint(expr)
+
+
+class NumbaBackend(NumPyBackend):
+    """
+    Compiles the formula to a single loop over the data, run in parallel by numba.
+    Each point is computed in one pass, with no intermediate arrays at all.
+
+    The loop requires a 1-d array for the independent variable and scalar parameters,
+      as when fitting or drawing.
+    Other calls, such as from stacked fits, use the numpy code.
+    Kernels are compiled by numba the first time they are used.
+    """
+    name = 'numba'
+    module = 'numba'
+    block_size = None
+
+    def namespace(self):
+        import math
+        import numba
+        namespace = super().namespace()
+        namespace['math'] = math
+        namespace['_prange'] = numba.prange
+        namespace['_NumbaKernel'] = NumbaKernel
+        return namespace
+
+    def source(self, name, args, replacements, reduced, tuple_result):
+        printer = PythonCodePrinter({'fully_qualified_modules':True})
+        x = args[0]
+        outputs = ['_out{}'.format(i) for i in range(len(reduced))]
+        try:
+            # Parameter-only subexpressions are computed once, outside of the loop.
+            arrays = {x}
+            hoisted, looped = [], []
+            for symbol, expr in replacements:
+                line = '{} = {}'.format(symbol, printer.doprint(expr))
+                if any(sym.name in arrays for sym in expr.free_symbols):
+                    arrays.add(symbol.name)
+                    looped.append(line)
+                else:
+                    hoisted.append(line)
+            assignments = ['{}[_i] = {}'.format(out, printer.doprint(expr))
+                           for out, expr in zip(outputs, reduced)]
+        except (NotImplementedError, TypeError):
+            # Functions that numba cannot compile are left to numpy.
+            return super().source(name, args, replacements, reduced, tuple_result)
+
+        loop = name + '_loop'
+        lines = ['def {}({}, {}):'.format(loop, ', '.join(['_' + x] + args[1:]), ', '.join(outputs))]
+        lines.extend('    ' + line for line in hoisted)
+        lines.append('    for _i in _prange(_{}.shape[0]):'.format(x))
+        lines.append('        {} = _{}[_i]'.format(x, x))
+        lines.extend('        ' + line for line in looped + assignments)
+        lines.append('')
+        lines.append('{0}_kernel = _NumbaKernel({0}, {1}, {2})'.format(loop, len(reduced), tuple_result))
+        lines.append('')
+
+        lines.append(signature(name, args, tuple_result))
+        lines.append('    _result = {}_kernel({})'.format(
+            loop, ', '.join(args + ([] if tuple_result else ['_out=_out']))))
+        lines.append('    if _result is not None:')
+        lines.append('        return _result')
+        lines.extend(numpy_body(replacements, reduced, tuple_result, '    '))
+        return '\n'.join(lines) + '\n'
+
+
+class NumbaKernel:
+    """
+    A lazily-compiled numba loop, along with the checks of whether it can be used.
+
+    Calls return None if the arguments are not a large enough 1-d array and scalars,
+      or if numba could not compile the loop, in which case the caller uses numpy instead.
+    """
+    # The default numba threading layer does not allow kernels to be launched concurrently,
+    #   such as by a fit in a background thread while the GUI draws.
+    lock = threading.Lock()
+
+    def __init__(self, loop, n_outputs, tuple_result):
+        import numba
+        self.jitted = numba.njit(parallel=True)(loop)
+        self.n_outputs = n_outputs
+        self.tuple_result = tuple_result
+        self.failed = False
+
+    def __call__(self, x, *params, _out=None):
+        if self.failed or np.ndim(x) != 1 or np.size(x) < FUSED_THRESHOLD:
+            return None
+        if any(np.ndim(param) != 0 for param in params):
+            return None
+
+        x = np.ascontiguousarray(x, dtype=float)
+        params = [float(param) for param in params]
+        outputs = [np.empty(x.shape) for _ in range(self.n_outputs - 1)]
+        if _out is not None and _out.shape == x.shape and _out.dtype == float and _out.flags.c_contiguous:
+            outputs.insert(0, _out)
+        else:
+            outputs.insert(0, np.empty(x.shape))
+        try:
+            with self.lock:
+                self.jitted(x, *(params + outputs))
+        except Exception:
+            # Typing errors from numba, such as for functions it does not support
+            self.failed = True
+            return None
+        if self.tuple_result:
+            return tuple(outputs)
+        return store(outputs[0], _out)
+
+
+BACKENDS = {backend.name:backend for backend in [NumPyBackend, NumExprBackend, NumbaBackend]}
+
+_default_backend = os.environ.get('PYTHOTH_BACKEND') or 'auto'
+
+def get_backend(name=None):
+    """
+    Returns an instance of the backend of the given name.
+    If name is None, the default backend is used.
+    'auto' is the first available backend of AUTO_ORDER, or numpy if none are.
+    A backend instance may also be given, and is returned as-is.
+    """
+    if isinstance(name, NumPyBackend):
+        return name
+    if name is None:
+        name = _default_backend
+    if name == 'auto':
+        name = 'numpy'
+        if (os.cpu_count() or 1) > 1:
+            for fused in AUTO_ORDER:
+                if BACKENDS[fused].available():
+                    name = fused
+                    break
+
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown evaluation backend "{}", must be one of {}'.format(
+            name, ', '.join(['auto'] + sorted(BACKENDS))))
+    if not backend.available():
+        raise ValueError('Evaluation backend "{}" is not installed'.format(name))
+    return backend()
+
+def set_default_backend(name):
+    """
+    Set the backend used for formulas compiled from now on.
+    """
+    global _default_backend
+    get_backend(name)
+    _default_backend = name
+
+
+def numpy_body(replacements, reduced, tuple_result, indent):
+    printer = SciPyPrinter()
+    doprint = lambda expr: printer.doprint(_expand_powers(expr))
+    lines = ['{} = {}'.format(symbol, doprint(expr)) for symbol, expr in replacements]
+    lines.append(return_statement([doprint(expr) for expr in reduced], tuple_result))
+    return [indent + line for line in lines]
+
+def signature(name, args, tuple_result):
+    if tuple_result:
+        return 'def {}({}):'.format(name, ', '.join(args))
+    return 'def {}({}, _out=None):'.format(name, ', '.join(args))
+
+def return_statement(values, tuple_result):
+    if tuple_result:
+        return 'return ({},)'.format(', '.join(values))
+    return 'return _store({}, _out)'.format(values[0])
+
+def store(value, out):
+    """
+    Returns value, after copying it into out if out is not None.
+    """
+    if out is None or value is out:
+        return value
+    out[...] = value
+    return out
+
+def use_fused(*args):
+    try:
+        size = np.broadcast(*args).size
+    except ValueError:
+        size = max(np.size(arg) for arg in args)
+    return size >= FUSED_THRESHOLD
+
+def as_float(*args):
+    return [np.asarray(arg, dtype=float) for arg in args]
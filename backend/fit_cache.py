@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import collections
+import hashlib
+import threading
+
+import numpy as np
+
+from . import instrumentation
+
+# Number of fit results kept, unless overridden.
+DEFAULT_MAX_ENTRIES = 256
+
+# Number of blocks whose sums make up the fingerprint of a data set.
+FINGERPRINT_SIZE = 64
+
+# Number of points read at once while hashing data.
+CHUNK_SIZE = 1 << 20
+
+class FitCache:
+    """
+    The results of previous fits, reused by later fits of the same or similar data.
+
+    Each result is stored under the expanded formula, the fit options,
+      a hash of the data, and the initial values,
+      so that repeating a fit returns the previous result without refitting.
+    Results are grouped by formula, options, initial values, and the shape of the data.
+    A fit missing the cache is started from the result of the most similar successful fit
+      in its group, rather than from the initial values, if warm_start is true.
+    As the initial values are part of the group, editing them,
+      such as to leave a poor minimum, starts the next fit from the new values.
+    Similarity is the distance between fingerprints of the data,
+      the sums of the y values over FINGERPRINT_SIZE blocks,
+      so that a single edited bin finds the fit before the edit.
+    Beyond max_entries, the least recently used results are dropped.
+
+    Entries are not pickled, so a cache sent to a worker process starts empty there.
+
+    Ex:
+        cache = FitCache()
+        res = fit(formula, xdata, ydata, cache=cache)
+        res = fit(formula, xdata, ydata, cache=cache)  # Returned from the cache
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, warm_start=True):
+        self.max_entries = max_entries
+        self.warm_start = warm_start
+        # key -> (group, fingerprint, result)
+        self.entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'max_entries':self.max_entries, 'warm_start':self.warm_start}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key):
+        """
+        Returns the result stored under key, or None.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[2]
+
+    def nearest(self, group, fingerprint):
+        """
+        Returns the successful result in group whose data fingerprint is closest, or None.
+        """
+        best, best_distance = None, np.inf
+        with self._lock:
+            for entry_group, entry_fingerprint, result in self.entries.values():
+                if entry_group != group or not result.success:
+                    continue
+                if not np.all(np.isfinite(result.values)):
+                    continue
+                distance = np.sum((entry_fingerprint - fingerprint)**2)
+                if distance < best_distance:
+                    best, best_distance = result, distance
+        return best
+
+    def put(self, key, group, fingerprint, result):
+        with self._lock:
+            self.entries[key] = (group, fingerprint, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def formula_key(formula):
+    """
+    Returns a hashable key identifying a CompiledFormula or PartialFormula.
+    """
+    from .compiled_formula import PartialFormula
+    if isinstance(formula, PartialFormula):
+        return (formula_key(formula.compiled), formula.values)
+    return (formula.expr, formula.independent_var, formula.constants)
+
+
+def data_digest(*arrays):
+    """
+    Returns a hash of the contents, dtypes and shapes of the arrays.
+    None is allowed in place of an array.
+    Memory-mapped arrays, and 1-d array-likes with a dtype such as BinCentres,
+      are read CHUNK_SIZE elements at a time.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for array in arrays:
+        if array is None:
+            digest.update(b'None')
+            continue
+        if not hasattr(array, 'dtype'):
+            array = np.asanyarray(array)
+        digest.update('{}{}'.format(array.dtype.str, array.shape).encode('utf-8'))
+        flat = array if array.ndim == 1 else np.asanyarray(array).reshape(-1)
+        for start in range(0, len(flat), CHUNK_SIZE):
+            chunk = np.ascontiguousarray(flat[start:start+CHUNK_SIZE], dtype=array.dtype)
+            digest.update(chunk.view(np.uint8))
+    return digest.digest()
+
+
+def fingerprint(ydata, size=FINGERPRINT_SIZE):
+    """
+    Returns the sums of ydata over size nearly-equal blocks.
+    """
+    ydata = np.asarray(ydata, dtype=float).reshape(-1)
+    starts = np.unique(np.linspace(0, len(ydata), size, endpoint=False).astype(int))
+    if len(ydata) == 0:
+        return np.zeros(0)
+    return np.add.reduceat(ydata, starts)
+
+
+def cached_fit(cache, fit, compiled, xdata, ydata, errors, initial, fixed, bounds,
+               fit_method, error_calc, progress=None):
+    """
+    Fit through cache, as fit(compiled, xdata, ydata, errors, ...)
+      starting from initial with the given fixed mask and (lower, upper) bounds.
+
+    Returns the cached result of an identical fit if there is one,
+      without calling progress.
+    Otherwise, the fit is warm-started from the nearest result of the group,
+      keeping the initial values of fixed parameters, and its result is stored.
+    """
+    lower, upper = bounds
+    group = (formula_key(compiled), fit_method, error_calc, fixed.tobytes(), lower.tobytes(), upper.tobytes(), np.shape(ydata), initial.tobytes())
+    key = group + (data_digest(xdata, ydata, errors),)
+
+    res = cache.get(key)
+    if res is not None:
+        instrumentation.count('fit_cache.hit')
+        return res
+
+    data_fingerprint = fingerprint(ydata)
+    start = initial
+    if cache.warm_start:
+        nearest = cache.nearest(group, data_fingerprint)
+        if nearest is not None:
+            instrumentation.count('fit_cache.warm_start')
+            start = np.where(fixed, initial, nearest.values)
+    instrumentation.count('fit_cache.miss')
+
+    res = fit(compiled, xdata, ydata, errors,
+              fit_method=fit_method, error_calc=error_calc,
+              initial_values=start, fixed=fixed, bounds=bounds, progress=progress)
+    cache.put(key, group, data_fingerprint, res)
+    return res
@@ -1,30 +1,36 @@
 #!/usr/bin/env python3
 
-from ensure_venv import ensure_venv
-ensure_venv(python='python3',requirements='requirements.txt', system_site_packages=True)
-
+import concurrent.futures
 from enum import Enum
+import itertools
+import multiprocessing
+import os
 
-from func_sub import all_subs
-
-import sympy
-from sympy.core.function import AppliedUndef
-from sympy.parsing.sympy_parser import parse_expr
 import numpy as np
-import scipy.optimize
+
+from . import instrumentation
+
+# sympy and scipy are slow to import, so they are imported only by the
+#   functions that use them.  Importing this module stays cheap for
+#   command-line tools and workers that may never need them.
+
+# Number of points evaluated at once when accumulating a likelihood,
+#   to bound the memory used by the jacobian and hessian.
+CHUNK_SIZE = 65536
 
 class FitMethod(Enum):
     AutoDetect = 0
     LeastSquares = 1
     PoissonStat = 2
+    Unbinned = 3
 
     @staticmethod
     def auto_detect(ydata):
-        has_non_integer = any(int(y)!=y for y in ydata)
+        has_non_integer = any(np.any(np.mod(y,1)!=0) for y in iter_chunks(ydata))
         if has_non_integer:
             return FitMethod.LeastSquares
 
-        has_low_bin_counts = any(y<5 for y in ydata)
+        has_low_bin_counts = any(np.any(y<5) for y in iter_chunks(ydata))
         if has_low_bin_counts:
             return FitMethod.PoissonStat
         else:
@@ -37,21 +43,88 @@ class ErrorCalc(Enum):
 
     @staticmethod
     def auto_detect(ydata):
-        for y in ydata:
-            if int(y) != y:
+        for y in iter_chunks(ydata):
+            if np.any(np.mod(y,1)!=0):
                 return ErrorCalc.AllEqualOne
         else:
             return ErrorCalc.SqrtCounts
 
+class FitResult:
+    """
+    The outcome of a single fit.
+
+    param_names -- The names of the free parameters, in the order used by values and covariance.
+    values -- The fitted value of each parameter.
+    covariance -- The covariance matrix of the fitted values.
+    fit_method -- The FitMethod that was used, after auto-detection.
+    cost -- The minimized quantity.
+            For LeastSquares, the chi^2 of the fit.
+            For PoissonStat, the negative log-likelihood,
+              offset such that a model equal to the data has zero cost.
+            For Unbinned, the negative log-likelihood.
+    success -- Whether the optimizer reported convergence.
+    message -- The optimizer's description of the result.
+    """
+    def __init__(self, param_names, values, covariance, fit_method, cost,
+                 success=True, message=''):
+        self.param_names = list(param_names)
+        self.values = np.asarray(values)
+        self.covariance = np.asarray(covariance)
+        self.fit_method = fit_method
+        self.cost = cost
+        self.success = success
+        self.message = message
+
+    @property
+    def params(self):
+        return dict(zip(self.param_names, self.values))
+
+    @property
+    def errors(self):
+        return np.sqrt(np.diag(self.covariance))
+
+    def __repr__(self):
+        return 'FitResult({}, cost={}, success={})'.format(self.params, self.cost, self.success)
+
+
+class FitProgress:
+    """
+    The state of a fit in progress, as passed to a progress callback.
+
+    evaluation -- The number of times that the cost has been evaluated so far.
+    cost -- The cost at the current parameters, as in FitResult.
+    param_names -- The names of the free parameters, in the order used by values.
+    values -- The current value of each parameter.
+    """
+    def __init__(self, evaluation, cost, param_names, values):
+        self.evaluation = evaluation
+        self.cost = cost
+        self.param_names = param_names
+        self.values = np.array(values, dtype=float)
+
+    @property
+    def params(self):
+        return dict(zip(self.param_names, self.values))
+
+
+class FitCancelled(Exception):
+    """
+    Raised by a progress callback to stop a fit.
+    """
+
+
 def fit(fit_function, xdata, ydata, errors=None,
-        independent_var = sympy.symbol.Symbol('x'),
+        independent_var = 'x',
         fit_method = FitMethod.AutoDetect, error_calc = ErrorCalc.AutoDetect,
-        subexpressions = None):
+        subexpressions = None, initial_values = None, progress = None,
+        fixed = None, bounds = None, cache = None):
     """
     Given a fit function, fit the data given with that function.
+    Returns a FitResult.
 
     fit_function -- The function to be fit.
-                    This may be a python function, a sympy expression, or a string.
+                    This may be a python function, a sympy expression, a string,
+                       or a CompiledFormula.
                     Strings will be parsed as sympy expressions.
                     A python function should be passed an x value as first argument,
                        followed by each fit parameter,
@@ -88,53 +161,776 @@ def fit(fit_function, xdata, ydata, errors=None,
                       For example, (linear, m*x + b) will expand "linear" to "m*x + b".
                       Functions can also be provided, and will be expanded appropriately.
                       For example, (linear(m,b), m*x+b) will expand "linear(slope,offset)" to "slope*x + offset".
+
+    initial_values -- The starting point of the fit, as a dict mapping parameter name to value,
+                        a FreeParameters, or a sequence of values in the order of the free parameters.
+                      Any parameters not given in a dict start at 1.
+
+    progress -- If given, called with a FitProgress each time the cost is evaluated.
+                It may raise FitCancelled to stop the fit,
+                  which is then raised from fit().
+                Fixed parameters are not included.
+
+    fixed -- The parameters held at their initial values,
+               as a collection of names, or a boolean sequence in the order of the free parameters.
+             Only the remaining parameters are fit, using kernels compiled without
+               the derivatives of the fixed parameters.
+             Fixed parameters are given their initial value and zero covariance in the result.
+
+    bounds -- The (lower, upper) limits of the parameters,
+                as a dict mapping parameter name to a (lower, upper) pair,
+                or a pair of sequences in the order of the free parameters.
+              Unbounded sides are given as -inf or inf.
+
+    cache -- A FitCache of previous results.
+             An identical fit returns the previous result,
+               and any other fit starts from the result of the fit with the most similar data.
+             Not used for python functions.
     """
 
-    fit_function = normalize_fit_function(fit_function, subexpressions, independent_var)
-    free_parameters = fit_function.__code__.co_varnames[1:]
+    compiled = compile_fit_function(fit_function, subexpressions, independent_var)
+    if compiled is None:
+        free_parameters = function_parameters(fit_function)
+    else:
+        free_parameters = compiled.free_params
+
+    initial = initial_vector(initial_values, free_parameters)
+    fixed = parameter_mask(fixed, free_parameters)
+    lower, upper = bound_vectors(bounds, free_parameters)
+
+    # Parameters with equal bounds can only take that value.
+    pinned = lower == upper
+    if pinned.any():
+        fixed = fixed | pinned
+        initial = np.where(pinned, lower, initial)
+
+    if cache is not None and compiled is not None:
+        from .fit_cache import cached_fit
+        return cached_fit(cache, fit, compiled, xdata, ydata, errors,
+                          initial, fixed, (lower, upper), fit_method, error_calc, progress)
+
+    if fixed.all():
+        return fixed_result(compiled if compiled is not None else fit_function,
+                            xdata, ydata, errors, free_parameters, initial,
+                            fit_method, error_calc)
+
+    if fixed.any():
+        if compiled is None:
+            raise ValueError('Fixed parameters require the fit function as a string or sympy expression')
+        partial = compiled.with_fixed(fixed_values(free_parameters, initial, fixed))
+        free = ~fixed
+        res = fit(partial, xdata, ydata, errors,
+                  fit_method=fit_method, error_calc=error_calc,
+                  initial_values=initial[free], bounds=(lower[free], upper[free]),
+                  progress=progress)
+        return expand_result(res, free_parameters, fixed, initial)
+
+    if compiled is None:
+        jacobian = None
+    else:
+        fit_function, jacobian = compiled.curve_fit_functions()
+
+    # Memory-mapped data is left in place, and is only read as needed.
+    # xdata may also be an array-like that is only read in slices, such as a BinCentres,
+    #   so it is converted only for fits that need all of it at once.
+    ydata = np.asarray(ydata)
+
+    if fit_method == FitMethod.AutoDetect:
+        fit_method = FitMethod.auto_detect(ydata)
+
+    # Optimizers require the starting point to be within the bounds.
+    initial = np.clip(initial, lower, upper)
+    bounded = np.isfinite(lower).any() or np.isfinite(upper).any()
+
+    if fit_method == FitMethod.PoissonStat:
+        if compiled is None:
+            raise ValueError('PoissonStat fits require the fit function as a string or sympy expression')
+        return fit_poisson(compiled, xdata, ydata, initial, progress,
+                           bounds=(lower, upper) if bounded else None)
+
+    elif fit_method == FitMethod.LeastSquares:
+        xdata = np.asarray(xdata)
+        if errors is None:
+            errors = generate_errors(ydata, error_calc)
+
+        if progress is not None:
+            fit_function = report_least_squares(fit_function, ydata, errors,
+                                                free_parameters, progress)
 
-    xdata = np.array(xdata)
-    ydata = np.array(ydata)
+        fit_function = instrumentation.wrap('fit.objective', fit_function)
+        if jacobian is not None:
+            jacobian = instrumentation.wrap('fit.jacobian', jacobian)
 
+        import scipy.optimize
+        with instrumentation.timer('fit.least_squares'):
+            fitval, cov, info, message, ier = scipy.optimize.curve_fit(
+                fit_function, xdata, ydata, p0=initial,
+                sigma=errors, absolute_sigma=True,
+                bounds=(lower, upper) if bounded else (-np.inf, np.inf),
+                jac=jacobian, full_output=True)
+        return FitResult(free_parameters, fitval, cov, fit_method,
+                         cost=np.sum(info['fvec']**2),
+                         success=ier in (1,2,3,4), message=message)
+
+    else:
+        raise ValueError('fit() cannot perform {} fits'.format(fit_method))
+
+
+def fixed_result(fit_function, xdata, ydata, errors, param_names, values,
+                 fit_method, error_calc):
+    """
+    Returns the FitResult of a fit in which every parameter is fixed,
+      with the cost of the function at values.
+    fit_function is a CompiledFormula or a python function.
+    """
     if fit_method == FitMethod.AutoDetect:
         fit_method = FitMethod.auto_detect(ydata)
+    evaluate = getattr(fit_function, 'evaluate', None)
+    if evaluate is None:
+        evaluate = lambda x, params: fit_function(x, *params)
 
+    n = len(param_names)
+    empty = FitResult([], np.empty(0), np.empty((0,0)), fit_method,
+                      cost=cost_at(evaluate, xdata, ydata, errors, values, fit_method, error_calc),
+                      message='All parameters are fixed')
+    return expand_result(empty, param_names, np.ones(n, dtype=bool), values)
 
+
+def cost_at(evaluate, xdata, ydata, errors, values, fit_method, error_calc):
+    """
+    Returns the cost of a fit, as in FitResult, of evaluate(x, values) to the data.
+    """
     if fit_method == FitMethod.PoissonStat:
-        raise NotImplementedError('Maximum-likelihood Poisson statistic not implemented')
+        import scipy.special
+        cost = 0.0
+        for x, y in zip(iter_chunks(xdata), iter_chunks(ydata)):
+            mu = evaluate(x, values)
+            cost += np.sum(mu - scipy.special.xlogy(y, mu) + scipy.special.xlogy(y, y) - y)
+        return cost
 
     elif fit_method == FitMethod.LeastSquares:
+        xdata = np.asarray(xdata)
         if errors is None:
             errors = generate_errors(ydata, error_calc)
+        return sum(np.sum(((evaluate(x, values) - y)/sigma)**2)
+                   for x, y, sigma in zip(iter_chunks(xdata), iter_chunks(ydata),
+                                          iter_chunks(np.broadcast_to(errors, np.shape(ydata)))))
 
-        fitval, cov = scipy.optimize.curve_fit(fit_function, xdata, ydata,
-                                               sigma=errors, absolute_sigma=True)
-        print(fitval)
-        print(cov)
-        import IPython; IPython.embed()
+    else:
+        raise ValueError('fit() cannot perform {} fits'.format(fit_method))
 
 
+def fit_poisson(compiled, xdata, ydata, initial, progress=None, bounds=None):
+    """
+    Maximum-likelihood fit of binned data, assuming poisson statistics in each bin.
 
+    compiled -- The CompiledFormula giving the expected bin content.
+    xdata -- The x coordinates of the bins.
+    ydata -- The observed bin content.
+    initial -- The starting value of each free parameter, ordered as compiled.free_params.
+    progress -- As for fit().
+    bounds -- None, or a (lower, upper) pair of arrays ordered as compiled.free_params.
+
+    Returns a FitResult, with the covariance taken from the inverse hessian
+      of the negative log-likelihood at the minimum.
+    """
+    likelihood = PoissonLikelihood(compiled, xdata, ydata)
+    return minimize_likelihood(likelihood, compiled.free_params, initial,
+                               FitMethod.PoissonStat, progress, bounds)
+
+
+def fit_unbinned(fit_function, events, low=None, high=None, extended=True,
+                 independent_var = 'x',
+                 subexpressions = None, initial_values = None,
+                 chunk_size = CHUNK_SIZE, progress = None):
+    """
+    Maximum-likelihood fit of individual events, without binning.
+    Returns a FitResult.
+
+    fit_function -- The event density, as a string, sympy expression, or CompiledFormula.
+                    For an extended fit, this is the expected number of events per unit x,
+                      so that it integrates to the expected total number of events.
+                    A binned fit of a histogram with bin width w to the formula f
+                      is equivalent to an extended unbinned fit to f/w.
+                    For a non-extended fit, only the shape matters,
+                      and the normalization is divided out.
+
+    events -- A 1-d array of event x values.  This may be a numpy.memmap,
+              as events are only read CHUNK_SIZE at a time.
+
+    low, high -- The range of x over which the model is normalized.
+                 Events outside of this range are ignored.
+                 Default to the smallest and largest event.
+
+    extended -- Whether to perform an extended likelihood fit,
+                  in which the total number of events is also fit.
+
+    The remaining arguments are as for fit().
+    """
+    compiled = compile_fit_function(fit_function, subexpressions, independent_var)
+    if compiled is None:
+        raise ValueError('Unbinned fits require the fit function as a string or sympy expression')
+
+    if low is None:
+        low = min(chunk.min() for chunk in iter_chunks(events, chunk_size))
+    if high is None:
+        high = max(chunk.max() for chunk in iter_chunks(events, chunk_size))
+
+    initial = initial_vector(initial_values, compiled.free_params)
+
+    likelihood = UnbinnedLikelihood(compiled, events, low, high, extended, chunk_size)
+    return minimize_likelihood(likelihood, compiled.free_params, initial,
+                               FitMethod.Unbinned, progress)
+
+
+def minimize_likelihood(likelihood, param_names, initial, fit_method, progress=None, bounds=None):
+    """
+    Minimize a negative log-likelihood, given as an object with
+      nll_and_gradient(params) and hessian(params) methods.
+    progress is as for fit().
+    bounds is None, or a (lower, upper) pair of arrays ordered as param_names.
+
+    Returns a FitResult, with the covariance taken from the inverse hessian
+      of the negative log-likelihood at the minimum.
+    """
+    objective = likelihood.nll_and_gradient
+    if progress is not None:
+        count = itertools.count(1)
+        def objective(params):
+            nll, gradient = likelihood.nll_and_gradient(params)
+            progress(FitProgress(next(count), nll, param_names, params))
+            return nll, gradient
+
+    objective = instrumentation.wrap('fit.objective', objective)
+    hessian = instrumentation.wrap('fit.hessian', likelihood.hessian)
+
+    import scipy.optimize
+    with instrumentation.timer('fit.minimize'):
+        if bounds is None:
+            res = scipy.optimize.minimize(objective, initial, jac=True,
+                                          hess=hessian, method='trust-exact')
+        else:
+            # trust-exact does not support bounds.
+            res = scipy.optimize.minimize(objective, initial, jac=True,
+                                          hess=hessian, method='trust-constr',
+                                          bounds=scipy.optimize.Bounds(*bounds))
+
+    try:
+        cov = np.linalg.inv(likelihood.hessian(res.x))
+    except np.linalg.LinAlgError:
+        cov = np.full((len(initial), len(initial)), np.inf)
+
+    return FitResult(param_names, res.x, cov, fit_method,
+                     cost=res.fun, success=res.success, message=res.message)
+
+
+def function_parameters(fit_function):
+    """
+    Returns the names of the fit parameters of a python function,
+      being all of its positional arguments after the first.
+    """
+    code = fit_function.__code__
+    return code.co_varnames[1:code.co_argcount]
+
+
+def initial_vector(initial_values, param_names):
+    """
+    Returns the starting values of the parameters named, as an array in the same order.
+
+    initial_values may be None, for all parameters to start at 1,
+      a dict mapping parameter name to value, with missing parameters starting at 1,
+      a FreeParameters, from which the initial values are read,
+      or a sequence of values already in the order of param_names.
+    """
+    if initial_values is None:
+        return np.ones(len(param_names))
+    if isinstance(initial_values, dict):
+        return np.array([initial_values.get(name, 1.0) for name in param_names], dtype=float)
+    if hasattr(initial_values, 'vector'):
+        return initial_values.vector('initial', param_names).astype(float)
+
+    initial = np.array(initial_values, dtype=float)
+    if initial.shape != (len(param_names),):
+        raise ValueError('Expected {} initial values, received {}'.format(
+            len(param_names), initial.shape))
+    return initial
+
+
+def parameter_mask(fixed, param_names):
+    """
+    Returns a boolean array, true for each parameter of param_names that is fixed.
+    fixed may be None, a collection of names, or a boolean sequence in the order of param_names.
+    """
+    if fixed is None:
+        return np.zeros(len(param_names), dtype=bool)
+    mask = np.asarray(fixed)
+    if mask.dtype == bool:
+        if mask.shape != (len(param_names),):
+            raise ValueError('Expected {} fixed flags, received {}'.format(
+                len(param_names), mask.shape))
+        return mask
+    return np.array([name in fixed for name in param_names], dtype=bool)
+
+
+def fixed_values(param_names, values, fixed):
+    """
+    Returns a dict mapping the name of each fixed parameter to its value.
+    """
+    return {name:val for name,val,is_fixed in zip(param_names, values, fixed) if is_fixed}
+
+
+def bound_vectors(bounds, param_names):
+    """
+    Returns (lower, upper) arrays of the bounds of each parameter of param_names.
+    bounds may be None, a dict mapping parameter name to a (lower, upper) pair,
+      or a (lower, upper) pair of scalars or sequences in the order of param_names.
+    """
+    n = len(param_names)
+    if bounds is None:
+        return np.full(n, -np.inf), np.full(n, np.inf)
+    if isinstance(bounds, dict):
+        pairs = [bounds.get(name, (-np.inf, np.inf)) for name in param_names]
+        return (np.array([low for low,_ in pairs], dtype=float).reshape(n),
+                np.array([high for _,high in pairs], dtype=float).reshape(n))
+    lower, upper = bounds
+    return (np.broadcast_to(np.asarray(lower, dtype=float), (n,)).copy(),
+            np.broadcast_to(np.asarray(upper, dtype=float), (n,)).copy())
+
+
+def expand_result(res, param_names, fixed, initial):
+    """
+    Returns the FitResult of a fit with the fixed parameters removed,
+      extended to all of param_names.
+    Fixed parameters keep their initial value, and have zero covariance.
+    """
+    n = len(param_names)
+    free = ~fixed
+    values = np.array(initial, dtype=float)
+    values[free] = res.values
+    covariance = np.zeros((n,n))
+    covariance[np.ix_(free, free)] = res.covariance
+    return FitResult(param_names, values, covariance, res.fit_method, res.cost,
+                     success=res.success, message=res.message)
+
+
+def report_least_squares(fit_function, ydata, errors, param_names, progress):
+    """
+    Wrap a fit function so that each evaluation is reported to progress.
+    """
+    count = itertools.count(1)
+    def reporting(x, *params):
+        value = fit_function(x, *params)
+        cost = np.sum(((value - ydata)/errors)**2)
+        progress(FitProgress(next(count), cost, param_names, params))
+        return value
+    return reporting
+
+
+def iter_chunks(array, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over consecutive slices of an array, each of at most chunk_size elements.
+    """
+    for start in range(0, len(array), chunk_size):
+        yield np.asarray(array[start:start+chunk_size], dtype=float)
+
+
+class Workspace:
+    """
+    Arrays reused between evaluations of a likelihood,
+      so that each iteration of a fit does not allocate new jacobians and hessians.
+    """
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape):
+        """
+        Returns an uninitialized array of the given shape,
+          sharing memory with the previous array of the same name if it is large enough.
+        """
+        array = self.arrays.get(name)
+        if array is None or array.shape[1:] != shape[1:] or len(array) < shape[0]:
+            array = self.arrays[name] = np.empty(shape)
+        return array[:shape[0]]
+
+    def derivatives(self, n_points, n_params):
+        """
+        Returns the output arguments for CompiledFormula.value_jacobian_and_hessian.
+        """
+        return {'jacobian_out':self.get('jac', (n_points, n_params)),
+                'hessian_out':self.get('hess', (n_points, n_params, n_params))}
+
+
+class PoissonLikelihood:
+    """
+    The binned poisson negative log-likelihood of a model, with its derivatives.
+
+    The likelihood is offset so that it is zero when the model is equal to the data,
+      i.e. half of the Baker-Cousins likelihood-ratio chi^2.
+    The terms y*log(mu) are evaluated with xlogy, so empty bins contribute only mu.
+    Points are evaluated CHUNK_SIZE at a time, to bound the memory needed.
+    """
+    def __init__(self, compiled, xdata, ydata, chunk_size=CHUNK_SIZE):
+        import scipy.special
+        self.xlogy = scipy.special.xlogy
+
+        self.compiled = compiled
+        self.xdata = xdata
+        self.ydata = ydata
+        self.chunk_size = chunk_size
+        self.workspace = Workspace()
+        self.offset = sum(np.sum(self.xlogy(y, y) - y)
+                          for _, y in self.chunks())
+
+    def chunks(self):
+        return zip(iter_chunks(self.xdata, self.chunk_size),
+                   iter_chunks(self.ydata, self.chunk_size))
+
+    @staticmethod
+    def is_valid(mu, y):
+        # A bin with observed counts must have a positive expectation.
+        return not (np.any(mu < 0) or np.any((mu == 0) & (y > 0)))
+
+    @staticmethod
+    def ratio(y, mu):
+        # y/mu, taken to be zero for empty bins
+        return np.divide(y, mu, out=np.zeros(np.shape(mu)), where=(y != 0))
+
+    def nll_and_gradient(self, params):
+        total = self.offset
+        gradient = np.zeros(len(params))
+        for x, y in self.chunks():
+            mu, jac = self.compiled.value_and_jacobian(
+                x, *params, jacobian_out=self.workspace.get('jac', (len(x), len(params))))
+            if not self.is_valid(mu, y):
+                return np.inf, gradient
+            total += np.sum(mu - self.xlogy(y, mu))
+            gradient += (1 - self.ratio(y, mu)).dot(jac)
+        return total, gradient
+
+    def hessian(self, params):
+        n = len(params)
+        hessian = np.zeros((n,n))
+        for x, y in self.chunks():
+            mu, jac, hess = self.compiled.value_jacobian_and_hessian(
+                x, *params, **self.workspace.derivatives(len(x), n))
+            ratio = self.ratio(y, mu)
+            hessian += (jac.T * self.ratio(y, mu**2)).dot(jac)
+            hessian += np.tensordot(1 - ratio, hess, axes=1)
+        return hessian
+
+
+class UnbinnedLikelihood:
+    """
+    The unbinned negative log-likelihood of a set of events, with its derivatives.
+
+    For extended fits, this is integral(f) - sum(log(f(x_i))).
+    Otherwise, this is N*log(integral(f)) - sum(log(f(x_i))).
+    The per-event terms are accumulated chunk_size events at a time,
+      so that the memory used does not depend on the number of events.
+    """
+    def __init__(self, compiled, events, low, high, extended=True, chunk_size=CHUNK_SIZE):
+        self.compiled = compiled
+        self.events = events
+        self.low = low
+        self.high = high
+        self.extended = extended
+        self.chunk_size = chunk_size
+        self.workspace = Workspace()
+        self.normalization = make_normalization(compiled, low, high)
+        self.n_events = sum(len(x) for x in self.chunks())
+
+    def chunks(self):
+        for x in iter_chunks(self.events, self.chunk_size):
+            in_range = (x >= self.low) & (x <= self.high)
+            yield x if in_range.all() else x[in_range]
+
+    def nll_and_gradient(self, params):
+        norm, norm_gradient = self.normalization.value_and_jacobian(params)
+        gradient = np.zeros(len(params))
+        if not norm > 0:
+            return np.inf, gradient
+
+        total = 0.0
+        for x in self.chunks():
+            f, jac = self.compiled.value_and_jacobian(
+                x, *params, jacobian_out=self.workspace.get('jac', (len(x), len(params))))
+            if np.any(f <= 0):
+                return np.inf, gradient
+            total -= np.sum(np.log(f))
+            gradient -= (1/f).dot(jac)
+
+        if self.extended:
+            total += norm
+            gradient += norm_gradient
+        else:
+            total += self.n_events*np.log(norm)
+            gradient += self.n_events*norm_gradient/norm
+        return total, gradient
+
+    def hessian(self, params):
+        norm, norm_gradient, norm_hessian = self.normalization.value_jacobian_and_hessian(params)
+        n = len(params)
+        hessian = np.zeros((n,n))
+        for x in self.chunks():
+            f, jac, hess = self.compiled.value_jacobian_and_hessian(
+                x, *params, **self.workspace.derivatives(len(x), n))
+            hessian += (jac.T / f**2).dot(jac)
+            hessian -= np.tensordot(1/f, hess, axes=1)
+
+        if self.extended:
+            hessian += norm_hessian
+        else:
+            hessian += self.n_events*(norm_hessian/norm -
+                                      np.outer(norm_gradient, norm_gradient)/norm**2)
+        return hessian
+
+
+def make_normalization(compiled, low, high):
+    """
+    Returns the integral of a CompiledFormula over [low, high], with its derivatives.
+    The integral is found symbolically if possible, and numerically otherwise.
+    """
+    import sympy
+
+    x = sympy.Symbol(compiled.independent_var)
+    try:
+        integral = sympy.integrate(compiled.expr, (x, low, high), conds='none')
+    except (NotImplementedError, ValueError, TypeError):
+        integral = None
+
+    if integral is None or integral.has(sympy.Integral):
+        return NumericNormalization(compiled, low, high)
+
+    normalization = SymbolicNormalization(compiled, integral)
+    try:
+        # The antiderivative may use functions that numpy cannot evaluate.
+        normalization.value_jacobian_and_hessian(np.ones(len(compiled.free_params)))
+    except (NotImplementedError, NameError, SyntaxError):
+        return NumericNormalization(compiled, low, high)
+    return normalization
+
+
+class SymbolicNormalization:
+    """
+    The normalization integral of a formula, from its symbolic antiderivative.
+    """
+    def __init__(self, compiled, integral):
+        from .compiled_formula import compile_expression
+        self.integral = compile_expression(integral, compiled.independent_var)
+        # Position of each of the integral's parameters in the formula's parameters
+        self.index = [compiled.free_params.index(name) for name in self.integral.free_params]
+
+    def value_and_jacobian(self, params):
+        params = np.asarray(params)
+        value, jac = self.integral.value_and_jacobian(0.0, *params[self.index])
+        gradient = np.zeros(len(params))
+        gradient[self.index] = jac
+        return float(value), gradient
+
+    def value_jacobian_and_hessian(self, params):
+        params = np.asarray(params)
+        value, jac, hess = self.integral.value_jacobian_and_hessian(0.0, *params[self.index])
+        gradient = np.zeros(len(params))
+        gradient[self.index] = jac
+        hessian = np.zeros((len(params), len(params)))
+        hessian[np.ix_(self.index, self.index)] = hess
+        return float(value), gradient, hessian
+
+
+class NumericNormalization:
+    """
+    The normalization integral of a formula, by composite Gauss-Legendre quadrature.
+    """
+    def __init__(self, compiled, low, high, n_intervals=64, order=32):
+        self.compiled = compiled
+        nodes, weights = np.polynomial.legendre.leggauss(order)
+        edges = np.linspace(low, high, n_intervals+1)
+        half_width = (edges[1:] - edges[:-1])/2
+        middle = (edges[1:] + edges[:-1])/2
+        self.x = (middle[:,np.newaxis] + half_width[:,np.newaxis]*nodes).ravel()
+        self.weights = (half_width[:,np.newaxis]*weights).ravel()
+
+    def value_and_jacobian(self, params):
+        value, jac = self.compiled.value_and_jacobian(self.x, *params)
+        return self.weights.dot(value), self.weights.dot(jac)
+
+    def value_jacobian_and_hessian(self, params):
+        value, jac, hess = self.compiled.value_jacobian_and_hessian(self.x, *params)
+        return (self.weights.dot(value), self.weights.dot(jac),
+                np.tensordot(self.weights, hess, axes=1))
+
+
+def fit_many(fit_function, datasets,
+             independent_var = 'x',
+             fit_method = FitMethod.AutoDetect, error_calc = ErrorCalc.AutoDetect,
+             subexpressions = None, initial_values = None,
+             executor = 'process', max_workers = None,
+             fixed = None, bounds = None, cache = None):
+    """
+    Fit the same function to many data sets, in parallel.
+
+    The fit function is parsed, expanded and compiled once,
+    then each data set is fit as by fit().
+    Yields (index, FitResult) pairs as each fit completes,
+      where index is the position of the data set in datasets.
+    A fit that fails to converge yields a FitResult with success=False
+      rather than raising.
+
+    fit_function -- As for fit(), but must not be a python function
+                    when using a process pool.
+
+    datasets -- An iterable of data sets.
+                Each may be an (xdata, ydata) or (xdata, ydata, errors) tuple,
+                  or an object with xdata and ydata attributes.
+                The iterable is consumed lazily, so it may be a generator.
+
+    executor -- 'process' to use a pool of processes,
+                'thread' to use a pool of threads,
+                or None to fit serially in the calling thread.
+                Processes are started from a fork server where available,
+                  so a script using them must guard its entry point
+                  with if __name__=='__main__'.
+
+    max_workers -- The size of the pool.
+                   Defaults to the number of cores.
+
+    cache -- A FitCache, as for fit(), so that each data set is started
+               from the result of the most similar data set already fit.
+             Each worker process keeps a separate, initially empty, copy.
+
+    The remaining arguments are as for fit().
+    """
+    compiled = compile_fit_function(fit_function, subexpressions, independent_var)
+    if compiled is not None:
+        fit_function = compiled
+        # Converted once, rather than by name in each fit,
+        #   and so that a FreeParameters need not be sent to worker processes.
+        initial_values = initial_vector(initial_values, compiled.free_params)
+        fixed = parameter_mask(fixed, compiled.free_params)
+        bounds = bound_vectors(bounds, compiled.free_params)
+
+        # Generate the derivative kernels once, rather than in each fit.
+        kernels = compiled
+        if fixed.any():
+            kernels = compiled.with_fixed(
+                fixed_values(compiled.free_params, initial_values, fixed)).compiled
+        kernels.prepare_derivatives(
+            hessian=fit_method in (FitMethod.AutoDetect, FitMethod.PoissonStat))
+
+    options = {'fit_method':fit_method, 'error_calc':error_calc,
+               'initial_values':initial_values, 'fixed':fixed, 'bounds':bounds,
+               'cache':cache}
+    tasks = ((i,) + unpack_dataset(dataset) for i,dataset in enumerate(datasets))
+
+    if executor is None:
+        for task in tasks:
+            yield _fit_task(fit_function, options, *task)
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if executor == 'process':
+        if compiled is None:
+            raise ValueError('Process pools require the fit function as a string or sympy expression')
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers, mp_context=_worker_context(), initializer=_init_fit_worker,
+            initargs=(compiled.expr, compiled.independent_var, compiled.backend.name, options))
+        submit = lambda task: pool.submit(_fit_worker_task, *task)
+    elif executor == 'thread':
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+        submit = lambda task: pool.submit(_fit_task, fit_function, options, *task)
+    else:
+        raise ValueError("executor must be 'process', 'thread', or None")
+
+    # Keep a bounded number of fits in flight,
+    #   so that a generator of data sets is not read all at once.
+    with pool:
+        pending = {submit(task) for task in itertools.islice(tasks, 2*max_workers)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+            pending |= {submit(task) for task in itertools.islice(tasks, len(done))}
+
+
+def unpack_dataset(dataset):
+    """
+    Returns (xdata, ydata, errors) for any of the data set forms accepted by fit_many.
+    """
+    if isinstance(dataset, tuple):
+        if len(dataset) == 2:
+            return dataset + (None,)
+        return tuple(dataset)
+    return (dataset.xdata, dataset.ydata, None)
+
+
+def _fit_task(fit_function, options, index, xdata, ydata, errors):
+    try:
+        result = fit(fit_function, xdata, ydata, errors, **options)
+    except (RuntimeError, ValueError, np.linalg.LinAlgError) as e:
+        compiled = compile_fit_function(fit_function, None, None)
+        param_names = (compiled.free_params if compiled is not None
+                       else function_parameters(fit_function))
+        n = len(param_names)
+        result = FitResult(param_names, np.full(n, np.nan), np.full((n,n), np.nan),
+                           options['fit_method'], cost=np.nan,
+                           success=False, message=str(e))
+    return index, result
+
+
+# Per-process state of fit_many's process pool workers
+_worker_fit_function = None
+_worker_options = None
+
+def _worker_context():
+    # Forking after numba kernels have started their threads is unsafe,
+    #   and leaves this process hanging on exit,
+    #   so workers are started from a fork server where available.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context()
+
+def _init_fit_worker(expr, independent_var, backend, options):
+    from .compiled_formula import compile_expression
+
+    global _worker_fit_function, _worker_options
+    _worker_fit_function = compile_expression(expr, independent_var, backend)
+    _worker_options = options
+
+def _fit_worker_task(index, xdata, ydata, errors):
+    return _fit_task(_worker_fit_function, _worker_options, index, xdata, ydata, errors)
+
+
+def compile_fit_function(fit_function, subexpressions, independent_var):
+    """
+    Returns the CompiledFormula for a fit function given as a string or sympy expression.
+    Returns None if the fit function is already a python function.
+    """
+    from .compiled_formula import CompiledFormula, PartialFormula, compile_expression, compile_formula
+
+    if isinstance(fit_function, (CompiledFormula, PartialFormula)):
+        return fit_function
 
-def normalize_fit_function(fit_function, subexpressions, independent_var):
-    # Convert string to sympy expression
     if isinstance(fit_function, str):
-        fit_function = parse_expr(fit_function)
+        return compile_formula(fit_function, subexpressions, str(independent_var))
+
+    import sympy
+    if not isinstance(fit_function, sympy.Basic):
+        return None
 
-    # Convert sympy expression to function
-    if isinstance(fit_function, tuple(sympy.core.all_classes)):
-        if subexpressions is not None:
-            fit_function = all_subs(fit_function, subexpressions)
+    if subexpressions is not None:
+        from .substitutions import all_subs
+        fit_function = all_subs(fit_function, subexpressions)
 
-        symbols = sorted(list(fit_function.free_symbols),
-                         key=lambda sym:sym.name)
+    return compile_expression(fit_function, str(independent_var))
 
-        # Move the independent variable to be first
-        symbols.sort(key=lambda sym:sym!=independent_var)
-        fit_function = sympy.lambdify(symbols, fit_function,
-                                      dummify=False)
 
-    return fit_function
+def normalize_fit_function(fit_function, subexpressions, independent_var):
+    compiled = compile_fit_function(fit_function, subexpressions, independent_var)
+    if compiled is None:
+        return fit_function
+    else:
+        return compiled.fit_function
 
 def generate_errors(ydata, error_calc):
     if error_calc == ErrorCalc.AutoDetect:
@@ -147,6 +943,10 @@ def generate_errors(ydata, error_calc):
 
 
 if __name__=='__main__':
-    #import IPython; IPython.embed()
-    fit('a*x**2 + b*x + c',[1,2,3,4,5],[50,80,90,80,50],
-        error_calc=ErrorCalc.AllEqualOne)
+    from ensure_venv import ensure_venv
+    ensure_venv(python='python3',requirements='requirements.txt', system_site_packages=True)
+
+    res = fit('a*x**2 + b*x + c',[1,2,3,4,5],[50,80,90,80,50],
+              error_calc=ErrorCalc.AllEqualOne)
+    print(res.params)
+    print(res.covariance)
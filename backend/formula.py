@@ -1,22 +1,19 @@
 #!/usr/bin/env python
 
+import numpy as np
+
 from .signal import Signal
 
-import sympy
-from sympy.parsing.sympy_parser import parse_expr
 from sympy.parsing.sympy_tokenize import TokenError
-from sympy.core.basic import Basic as SympyBasic
-
-import numpy as np
 
-from .substitutions import all_subs
+from . import compiled_formula
 
 class Formula:
     def __init__(self, subexpressions):
         self.raw_formula_changed = Signal()
         self.formula_changed = Signal()
         self.free_parameters_changed = Signal()
-        self.subexpressions = subexpressions
+        self._subexpressions = subexpressions
 
         self._raw_text = ''
         self.valid_text = None
@@ -27,81 +24,148 @@ class Formula:
 
     @raw_text.setter
     def raw_text(self, val):
+        self.set_raw_text(val)
+
+    def set_raw_text(self, val, validate=True):
+        """
+        Set the text of the formula as entered.
+
+        With validate=False, the text is only stored, and raw_formula_changed emitted.
+        The caller should then call prepare(val), such as on a worker thread,
+          followed by accept(val) if it returns True.
+        """
         self._raw_text = val
         self.raw_formula_changed.emit(val)
-        if self.is_valid(val):
-            self.valid_text = val
-            self.formula_changed.emit(self)
-            self.free_parameters_changed.emit(self.free_params)
+        if validate and self.is_valid(val):
+            self.accept(val)
+
+    def prepare(self, raw_formula, subexpressions=None):
+        """
+        Parse, expand and compile raw_formula, returning whether it is a valid formula.
+
+        Does not change the formula, and may be called from any thread.
+        When called from another thread, pass the subexpressions read on the GUI thread,
+          as they may be replaced while this runs.
+        Otherwise, the current subexpressions are used.
+        The results are cached, so that a following accept() repeats none of the work.
+        """
+        if subexpressions is None:
+            subexpressions = self.subexpressions
+        try:
+            if not self.is_valid(raw_formula):
+                return False
+            compiled = compiled_formula.compile_formula(raw_formula, subexpressions)
+        except (TypeError, AttributeError, ValueError):
+            # Parse errors other than syntax errors, such as calling a symbol as a function
+            return False
+
+        try:
+            # Generated now, rather than when the formula is first drawn.
+            compiled.fit_function
+        except (NotImplementedError, KeyError, TypeError, SyntaxError):
+            # Functions that cannot be printed as numpy, or constants such as zoo.
+            # Raised again when the function is used, as for formulas set through raw_text.
+            pass
+        return True
+
+    def accept(self, raw_formula):
+        """
+        Make raw_formula, which must be valid, the current formula.
+        Listeners are only notified if it differs from the current formula,
+          and only if it is still the text entered.
+        """
+        if raw_formula != self._raw_text or raw_formula == self.valid_text:
+            return
+        self.valid_text = raw_formula
+        self.formula_changed.emit(self)
+        self.free_parameters_changed.emit(self.free_params)
+
+    @property
+    def subexpressions(self):
+        return self._subexpressions
+
+    @subexpressions.setter
+    def subexpressions(self, val):
+        self._subexpressions = val
+        compiled_formula.clear_cache()
 
     def is_valid(self, raw_formula):
         try:
-            parse_expr(raw_formula)
+            compiled_formula.parse_text(raw_formula)
             return True
         except (SyntaxError, TokenError):
             return False
 
     @property
-    def formula(self):
+    def compiled(self):
         if not self.valid_text:
             return None
 
-        parsed = parse_expr(self.valid_text)
-        if self.subexpressions:
-            parsed = all_subs(parsed, self.subexpressions)
+        return compiled_formula.compile_formula(self.valid_text, self.subexpressions)
+
+    @property
+    def formula(self):
+        compiled = self.compiled
+        if compiled is None:
+            return None
 
-        return parsed
+        return compiled.expr
 
     @property
     def all_params(self):
-        formula = self.formula
-        if formula is None:
+        compiled = self.compiled
+        if compiled is None:
             return None
 
-        return sorted((sym.name for sym in formula.free_symbols),
-                      key=lambda name:name != 'x')
+        return compiled.all_params
 
     @property
     def free_params(self):
-        formula = self.formula
-        if formula is None:
+        compiled = self.compiled
+        if compiled is None:
             return None
 
-        return sorted(sym.name for sym in formula.free_symbols if sym.name!='x')
+        return compiled.free_params
 
     @property
     def fit_function(self):
-        formula = self.formula
-        if formula is None:
+        compiled = self.compiled
+        if compiled is None:
             return None
 
-        return sympy.lambdify(self.all_params, formula, dummify=False, modules=np)
+        return compiled.fit_function
 
     @property
     def latex(self):
-        formula = self.formula
-        if formula:
-            return '${}$'.format(sympy.latex(formula))
-        else:
+        compiled = self.compiled
+        if compiled is None:
             return ''
 
-    def apply(self, xvalues, free_parameters, value_type='fitted'):
+        return compiled.latex
+
+    def apply(self, xvalues, free_parameters, value_type='fitted', out=None):
+        """
+        Evaluate the formula at xvalues, using either the fitted or the initial parameter values.
+        Returns None if the formula is invalid, or if any of its parameters has no value.
+
+        If out is given, the values are written into it, and out is returned.
+        Reusing the same out for each call avoids allocating a new array for the result.
+        """
         assert value_type in ('fitted','initial'), "Invalid value_type '{}'".format(value_type)
 
-        # Grab the parameters
-        if value_type == 'fitted':
-            params = free_parameters.fitted_values()
-        else:
-            params = free_parameters.initial_values()
+        compiled = self.compiled
+        if compiled is None:
+            return None
 
-        # Remove any parameters that don't belong to this function
+        # Grab the parameters, in the order used by the compiled formula
         try:
-            params = {name:params[name] for name in self.free_params}
-        except (KeyError,TypeError):
+            params = free_parameters.vector(value_type, compiled.free_params)
+        except KeyError:
             return None
 
-        if any(val==None for val in params.values()):
+        # Unfitted parameters are NaN
+        if np.isnan(params).any():
             return None
 
         # Apply the function
-        return self.fit_function(x=xvalues, **params)
+        return compiled.evaluate(xvalues, params, out=out)
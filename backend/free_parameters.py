@@ -1,15 +1,42 @@
 #!/usr/bin/env python3
 
-from .signal import Signal
+import numpy as np
+
+from .signal import Signal, batch
 
 class FreeParameters:
-    def __init__(self, formula = None):
-        self.param_changed = Signal()
+    """
+    The values of every parameter that has appeared in a formula,
+      along with the list of those in the current formula.
+
+    Values are stored column-wise, with one numpy array per field,
+      and each parameter owning one slot of every array.
+    vector() and set_vector() read and write a field for many parameters at once,
+      such as the initial values passed to a fit, or the fitted values of its result.
+    FreeParameter objects are views of a single slot.
+
+    Fields:
+    initial -- The starting value of a fit.  Defaults to 1.
+    fitted -- The result of the last fit, or NaN if there has been none.
+    error -- The uncertainty of the fitted value, or NaN if there has been no fit.
+    lower, upper -- The bounds of the parameter.  Default to -inf and inf.
+    fixed -- Whether the parameter is held at its initial value during fits.
+    """
+    defaults = {'initial':1.0, 'fitted':np.nan, 'error':np.nan,
+                'lower':-np.inf, 'upper':np.inf, 'fixed':False}
+
+    def __init__(self, formula = None, capacity = 16):
+        # Deferred, so that bursts of changes are drawn once.
+        self.param_changed = Signal(deferred=True)
         self.param_list_changed = Signal()
 
+        self.columns = {field:np.full(capacity, default, dtype=type(default))
+                        for field,default in self.defaults.items()}
         self.all_vars = {}
+        self.by_slot = []
         self.current_vars = []
         self.current_var_lookup = {}
+        self.current_slots = np.empty(0, dtype=int)
 
         if formula is not None:
             formula.free_parameters_changed.connect(self.define_variables)
@@ -18,10 +45,11 @@ class FreeParameters:
     def define_variables(self, var_list):
         self.current_vars = [self.get_or_make(var_name) for var_name in var_list]
         self.current_var_lookup = {par.name:par for par in self.current_vars}
+        self.current_slots = np.array([par.slot for par in self.current_vars], dtype=int)
         self.param_list_changed.emit(self)
 
     def initial_values(self):
-        return {par.name:par.initial_value for par in self}
+        return dict(zip([par.name for par in self], self.vector('initial').tolist()))
 
     def fitted_values(self):
         return {par.name:par.fitted_value for par in self}
@@ -30,8 +58,54 @@ class FreeParameters:
         try:
             return self.all_vars[key]
         except KeyError:
-            self.all_vars[key] = FreeParameter(key, self.param_changed)
-            return self.all_vars[key]
+            slot = len(self.all_vars)
+            if slot == len(self.columns['initial']):
+                self._grow()
+            par = FreeParameter(key, self, slot)
+            self.all_vars[key] = par
+            self.by_slot.append(par)
+            return par
+
+    def _grow(self):
+        for field,column in self.columns.items():
+            extra = np.full(len(column), self.defaults[field], dtype=column.dtype)
+            self.columns[field] = np.concatenate([column, extra])
+
+    def slots(self, names=None):
+        """
+        Returns the slots of the parameters named, or of the current parameters if None.
+        Raises KeyError if a parameter has never been defined.
+        """
+        if names is None:
+            return self.current_slots
+        return np.array([self.all_vars[name].slot for name in names], dtype=int)
+
+    def vector(self, field, names=None):
+        """
+        Returns a new array of the given field for the parameters named,
+          in the order given, or for the current parameters if names is None.
+
+        Ex:
+            initial = parameters.vector('initial', compiled.free_params)
+        """
+        return self.columns[field][self.slots(names)]
+
+    def set_vector(self, field, values, names=None):
+        """
+        Set the given field for the parameters named, or for the current parameters.
+        param_changed is emitted for each parameter whose value changed,
+          with all deliveries held back until every value has been written.
+        """
+        slots = self.slots(names)
+        column = self.columns[field]
+        values = np.broadcast_to(np.asarray(values, dtype=column.dtype), slots.shape)
+        previous = column[slots]
+        column[slots] = values
+
+        if self.param_changed.callbacks:
+            with batch():
+                for slot in slots[_changed(previous, values)]:
+                    self.param_changed.emit(self.by_slot[slot])
 
     def __iter__(self):
         return iter(self.current_vars)
@@ -48,31 +122,82 @@ class FreeParameters:
         return len(self.current_vars)
 
 
+def _changed(previous, values):
+    # NaN marks an unset value, so is treated as equal to itself.
+    changed = previous != values
+    if previous.dtype.kind == 'f':
+        changed &= ~(np.isnan(previous) & np.isnan(values))
+    return changed
+
+
 class FreeParameter:
-    def __init__(self, name, param_changed = None):
+    """
+    A view of the values of one parameter within FreeParameters.
+    """
+    __slots__ = ('name', 'store', 'slot')
+
+    def __init__(self, name, store, slot):
         self.name = name
-        self.param_changed = param_changed
-        self._initial_value = 1
-        self._fitted_value = None
+        self.store = store
+        self.slot = slot
+
+    def _get(self, field):
+        return self.store.columns[field][self.slot].item()
+
+    def _set(self, field, val):
+        column = self.store.columns[field]
+        previous = column[self.slot]
+        column[self.slot] = val
+        if _changed(previous, column[self.slot]):
+            self.store.param_changed.emit(self)
 
     @property
     def initial_value(self):
-        return self._initial_value
+        return self._get('initial')
 
     @initial_value.setter
     def initial_value(self, val):
-        changed = (val != self._initial_value)
-        self._initial_value = val
-        if changed and self.param_changed is not None:
-            self.param_changed.emit(self)
+        self._set('initial', val)
 
     @property
     def fitted_value(self):
-        return self._fitted_value
+        # None until the parameter has been fit
+        val = self._get('fitted')
+        return None if np.isnan(val) else val
 
     @fitted_value.setter
     def fitted_value(self, val):
-        changed = (val != self._fitted_value)
-        self._fitted_value = val
-        if changed and self.param_changed is not None:
-            self.param_changed.emit(self)
+        self._set('fitted', np.nan if val is None else val)
+
+    @property
+    def error(self):
+        val = self._get('error')
+        return None if np.isnan(val) else val
+
+    @error.setter
+    def error(self, val):
+        self._set('error', np.nan if val is None else val)
+
+    @property
+    def lower(self):
+        return self._get('lower')
+
+    @lower.setter
+    def lower(self, val):
+        self._set('lower', val)
+
+    @property
+    def upper(self):
+        return self._get('upper')
+
+    @upper.setter
+    def upper(self, val):
+        self._set('upper', val)
+
+    @property
+    def fixed(self):
+        return self._get('fixed')
+
+    @fixed.setter
+    def fixed(self, val):
+        self._set('fixed', bool(val))
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
 from .signal import Signal
+from .decimation import MinMaxPyramid, DECIMATION_THRESHOLD
 
 import numpy as np
 
+# Number of bins read at once when iterating over a data set.
+CHUNK_SIZE = 1 << 20
+
 class HistDataSet:
     def __init__(self, bin_edges, bin_content, loc='middle'):
         if len(bin_edges) != len(bin_content)+1:
@@ -13,8 +17,21 @@ class HistDataSet:
         self.bin_edges = bin_edges
         self.bin_content = bin_content
         self.loc = loc
+        self._y_range = None
+        self._pyramid = None
 
         self.data_set_changed = Signal()
+        self.data_set_changed.connect(self._clear_cache)
+
+    @classmethod
+    def from_npy(cls, edges_path, content_path, loc='middle', mode='r'):
+        """
+        Open .npy files of bin edges and bin content as a data set,
+          memory-mapped rather than read into memory.
+        mode is as for numpy.load's mmap_mode.
+        """
+        return cls(np.load(edges_path, mmap_mode=mode),
+                   np.load(content_path, mmap_mode=mode), loc=loc)
 
     def __len__(self):
         return len(self.bin_content)
@@ -22,14 +39,51 @@ class HistDataSet:
     def __getitem__(self, index):
         return HistDataPoint(self, index)
 
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Iterate over (xdata, ydata) pairs of consecutive slices of the data set.
+        For memory-mapped data, only one slice is read at a time.
+        """
+        for start in range(0, len(self), chunk_size):
+            stop = start + chunk_size
+            yield self._bin_x(self.bin_edges[start:stop+1]), self.bin_content[start:stop]
+
+    def x_range(self):
+        """
+        Returns the smallest and largest x values.
+        """
+        return min(self.bin_edges[0], self.bin_edges[-1]), max(self.bin_edges[0], self.bin_edges[-1])
+
+    def y_range(self):
+        """
+        Returns the smallest and largest bin content.
+        """
+        if self._y_range is None:
+            low, high = np.inf, -np.inf
+            for _, ydata in self.iter_chunks():
+                low = min(low, np.min(ydata))
+                high = max(high, np.max(ydata))
+            self._y_range = (low, high)
+        return self._y_range
+
     @property
     def xdata(self):
+        """
+        The x value of each bin.
+        For bins located at their middle, this is a BinCentres,
+          so that the centres are computed only for the slices read.
+        """
+        if self.loc=='middle':
+            return BinCentres(self.bin_edges)
+        return self._bin_x(self.bin_edges)
+
+    def _bin_x(self, bin_edges):
         if self.loc=='left':
-            return self.bin_edges[:-1]
+            return bin_edges[:-1]
         elif self.loc=='middle':
-            return (self.bin_edges[:-1] + self.bin_edges[1:])/2.0
+            return (bin_edges[:-1] + bin_edges[1:])/2.0
         elif self.loc=='right':
-            return self.bin_edges[1:]
+            return bin_edges[1:]
         else:
             raise ValueError("Bin location must be one of 'left', 'middle', or 'right'")
 
@@ -37,14 +91,83 @@ class HistDataSet:
     def ydata(self):
         return self.bin_content
 
+    def _clear_cache(self, *args):
+        self._y_range = None
+        self._pyramid = None
+
+    def plot_data(self, axes):
+        """
+        Returns (x, y, drawstyle) of the line to draw on the axes given.
+        Histograms with more bins than can be shown are reduced to
+          the minimum and maximum bin content of each pixel column of the current view.
+        """
+        if len(self) <= DECIMATION_THRESHOLD:
+            bin_edges = np.asarray(self.bin_edges)
+            bin_content = np.asarray(self.bin_content)
+        else:
+            if self._pyramid is None:
+                self._pyramid = MinMaxPyramid(self.bin_edges[:-1], self.bin_content)
+            xlim = axes.get_xlim()
+            xdata, ydata, decimated = self._pyramid.decimate(xlim[0], xlim[1], int(axes.bbox.width))
+            if decimated:
+                return xdata, ydata, 'default'
+
+            i0, i1 = self._pyramid.visible(xlim[0], xlim[1])
+            bin_edges = np.asarray(self.bin_edges[i0:i1+1])
+            bin_content = ydata
+
+        ydata = np.insert(bin_content, 0, bin_content[0])
+        return bin_edges, ydata, 'steps-pre'
+
     def draw(self, axes):
-        ydata = np.insert(self.bin_content, 0, self.bin_content[0])
-        return axes.step(self.bin_edges, ydata)
+        # Set the view from the full data, as the decimation depends on it.
+        (xlow, xhigh), (ylow, yhigh) = self.x_range(), self.y_range()
+        axes.update_datalim([(xlow, ylow), (xhigh, yhigh)])
+        axes.autoscale_view()
+
+        xdata, ydata, drawstyle = self.plot_data(axes)
+        return axes.plot(xdata, ydata, drawstyle=drawstyle)
 
     def update(self, drawn_obj):
-        ydata = np.insert(self.bin_content, 0, self.bin_content[0])
-        drawn_obj[0].set_xdata(self.bin_edges)
-        drawn_obj[0].set_ydata(ydata)
+        xdata, ydata, drawstyle = self.plot_data(drawn_obj[0].axes)
+        drawn_obj[0].set_data(xdata, ydata)
+        drawn_obj[0].set_drawstyle(drawstyle)
+
+
+class BinCentres:
+    """
+    The centres of the bins given by bin_edges, computed as they are read.
+
+    Slicing returns the centres of the bins in the slice, as an array,
+      reading only the edges of those bins.
+    numpy.asarray() returns the centres of all of the bins.
+    """
+    ndim = 1
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, bin_edges):
+        self.bin_edges = bin_edges
+
+    def __len__(self):
+        return len(self.bin_edges) - 1
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) and index.step in (None, 1):
+            start, stop, _ = index.indices(len(self))
+            edges = np.asarray(self.bin_edges[start:max(start, stop)+1], dtype=self.dtype)
+            return (edges[:-1] + edges[1:])/2.0
+        if isinstance(index, (int, np.integer)):
+            index = range(len(self))[index]
+            return (self.bin_edges[index] + self.bin_edges[index+1])/2.0
+        return self[:][index]
+
+    def __array__(self, dtype=None, copy=None):
+        centres = self[:]
+        return centres if dtype is None else centres.astype(dtype)
 
 
 class HistDataPoint:
@@ -77,4 +200,4 @@ class HistDataPoint:
     @bin_content.setter
     def bin_content(self, val):
         self._data_set.bin_content[self._i] = val
-        self._data_set.data_set_changed.smit(self._data_set)
+        self._data_set.data_set_changed.emit(self._data_set)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""
+Opt-in timers and counters for the slow paths of fitting and drawing.
+
+Instrumentation is off by default, and costs a single attribute check per hook while off.
+It is turned on by enable(), or by setting the PYTHOTH_PROFILE environment variable.
+
+Ex:
+    from backend import instrumentation
+    instrumentation.enable()
+    fit('a*x + b', xdata, ydata)
+    print(instrumentation.report())
+
+Ex:
+    with instrumentation.timer('my_step'):
+        do_something()
+"""
+
+import functools
+import os
+import threading
+import time
+
+enabled = bool(os.environ.get('PYTHOTH_PROFILE'))
+
+_stats = {}
+_lock = threading.Lock()
+
+class Stat:
+    """
+    The accumulated measurements under one name.
+
+    count -- The number of times that the timer or counter was hit.
+    total -- The total time in seconds.  Zero for plain counters.
+    max -- The longest single time in seconds.
+    """
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self, count=0, total=0.0, max=0.0):
+        self.count = count
+        self.total = total
+        self.max = max
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    def __repr__(self):
+        return 'Stat(count={}, total={:.6f}, max={:.6f})'.format(self.count, self.total, self.max)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def record(name, elapsed=0.0, n=1):
+    """
+    Add n hits and elapsed seconds to the stat of the given name.
+    """
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat()
+        stat.count += n
+        stat.total += elapsed
+        if elapsed > stat.max:
+            stat.max = elapsed
+
+
+def count(name, n=1):
+    """
+    Increment a counter, if instrumentation is enabled.
+    """
+    if enabled:
+        record(name, n=n)
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_null_timer = _NullTimer()
+
+
+def timer(name):
+    """
+    Returns a context manager that records the time spent inside it.
+    If instrumentation is disabled, a shared do-nothing context manager is returned.
+    """
+    if enabled:
+        return _Timer(name)
+    return _null_timer
+
+
+def timed(name):
+    """
+    Decorator recording the time of each call to the function.
+    Whether to record is decided at each call,
+      so functions decorated at import time can still be instrumented later.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def wrap(name, func):
+    """
+    Returns func, timed under the given name if instrumentation is currently enabled.
+    Unlike timed(), the decision is made once, so there is no cost when disabled.
+    Used for callbacks that are created per call, such as a fit's objective function.
+    """
+    if not enabled:
+        return func
+    return timed(name)(func)
+
+
+def stats():
+    """
+    Returns a snapshot of all stats, as a dict mapping name to Stat.
+    """
+    with _lock:
+        return {name:Stat(stat.count, stat.total, stat.max) for name,stat in _stats.items()}
+
+
+def report():
+    """
+    Returns a table of all stats, sorted by total time.
+    """
+    lines = ['{:<28}{:>10}{:>12}{:>12}{:>12}'.format('name', 'count', 'total (ms)', 'mean (ms)', 'max (ms)')]
+    snapshot = sorted(stats().items(), key=lambda item:(-item[1].total, item[0]))
+    for name,stat in snapshot:
+        lines.append('{:<28}{:>10}{:>12.2f}{:>12.3f}{:>12.3f}'.format(
+            name, stat.count, 1e3*stat.total, 1e3*stat.mean, 1e3*stat.max))
+    return '\n'.join(lines)
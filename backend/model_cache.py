@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import tempfile
+
+import sympy
+
+# Location of the cache, unless overridden by the PYTHOTH_CACHE_DIR environment variable.
+# Setting PYTHOTH_CACHE_DIR to an empty string disables the cache.
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'pythoth', 'models')
+
+# Total size of the cached files, beyond which the least recently used are removed.
+DEFAULT_MAX_BYTES = 64*1024*1024
+
+class ModelCache:
+    """
+    A content-addressed directory of generated model source code.
+
+    Each entry is keyed by the expanded expression, the order of its arguments,
+      the kind of function generated, and the sympy version.
+    Reading an entry marks it as recently used.
+    Once the total size exceeds max_bytes, the least recently used entries are removed.
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(expr, args, kind):
+        text = '\n'.join([sympy.__version__, kind, ','.join(args), sympy.srepr(expr)])
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.py')
+
+    def get(self, key):
+        """
+        Returns the source stored under key, or None if there is none.
+        """
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                source = f.read()
+            os.utime(path, None)
+        except OSError:
+            return None
+        return source
+
+    def put(self, key, source):
+        """
+        Store source under key, then evict entries as needed.
+        Errors writing to the cache are ignored, as it is only an optimization.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write then rename, so that concurrent readers never see a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(source)
+            os.replace(tmp_path, self.path(key))
+        except OSError:
+            return
+        self.evict()
+
+    def evict(self):
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.py')]
+        except OSError:
+            return
+
+        entries = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.py'):
+                os.remove(os.path.join(self.directory, name))
+
+
+_default_cache = None
+_default_initialized = False
+
+def default_cache():
+    """
+    Returns the ModelCache used by CompiledFormula, or None if caching is disabled.
+    """
+    global _default_cache, _default_initialized
+    if not _default_initialized:
+        directory = os.environ.get('PYTHOTH_CACHE_DIR', DEFAULT_DIRECTORY)
+        _default_cache = ModelCache(directory) if directory else None
+        _default_initialized = True
+    return _default_cache
+
+def set_default_cache(cache):
+    """
+    Replace the ModelCache used by CompiledFormula.
+    Pass None to disable caching.
+    """
+    global _default_cache, _default_initialized
+    _default_cache = cache
+    _default_initialized = True
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+def adaptive_sample(func, low, high, max_points, tolerance=None):
+    """
+    Sample a function of x between low and high, for drawing as a line.
+
+    Returns (x, y), with at most max_points points, or None if func returns None.
+
+    func is first evaluated on an even grid of an eighth of max_points.
+    Each interval whose midpoint is further than tolerance from the straight line
+      between its ends is then split, repeatedly, until the line is within tolerance,
+      the intervals are narrower than |high-low|/max_points, or max_points is reached.
+    If more intervals need splitting than there are points left,
+      those furthest from a straight line are split first.
+    Intervals at the edge of where func is finite are split, so that the edge is found.
+
+    Each call allocates new x and y arrays.
+    For redraws that must not allocate, such as while a parameter is dragged,
+      evaluate func into the y array returned by the last call instead.
+
+    Ex:
+        x, y = adaptive_sample(np.sin, 0, 10, 500)
+
+    func -- Called with an array of x values, returns the y values or None.
+    max_points -- The most points to return, such as the width of the axes in pixels.
+    tolerance -- The distance in y that the line may be from func.
+                 Defaults to 1e-3 of the range of y on the initial grid.
+    """
+    max_points = max(int(max_points), 2)
+    x = np.linspace(low, high, min(max(max_points//8, 16), max_points))
+
+    # The view may extend past the domain of the formula, such as log(x) for negative x.
+    with np.errstate(all='ignore'):
+        y = _evaluate(func, x)
+        if y is None:
+            return None
+
+        if tolerance is None:
+            finite = y[np.isfinite(y)]
+            tolerance = 1e-3*np.ptp(finite) if len(finite) else 0.0
+        # Inverted axes give low > high.
+        min_width = abs(high - low)/max_points
+
+        # Index of the left end of each interval that may need splitting
+        split = np.arange(len(x) - 1)
+        while len(split) and len(x) < max_points:
+            split = split[np.abs(x[split+1] - x[split]) > min_width]
+            xmid = 0.5*(x[split] + x[split+1])
+            ymid = _evaluate(func, xmid)
+            if ymid is None:
+                return None
+
+            error = np.abs(ymid - 0.5*(y[split] + y[split+1]))
+            error[np.isfinite(y[split]) != np.isfinite(y[split+1])] = np.inf
+            error[np.isnan(error)] = 0.0
+
+            accept = np.flatnonzero(error > tolerance)
+            room = max_points - len(x)
+            if len(accept) > room:
+                accept = np.sort(accept[np.argsort(error[accept])[len(accept)-room:]])
+            split = split[accept]
+
+            x = np.insert(x, split+1, xmid[accept])
+            y = np.insert(y, split+1, ymid[accept])
+
+            # Both halves of each split interval may need splitting again.
+            inserted = split + 1 + np.arange(len(split))
+            split = np.stack([inserted-1, inserted], axis=1).ravel()
+
+    return x, y
+
+
+def _evaluate(func, x):
+    y = func(x)
+    if y is None:
+        return None
+    # Constant formulas may return a scalar.
+    return np.array(np.broadcast_to(y, x.shape), dtype=float)
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 
 from .signal import Signal
+from .decimation import OccupancyPyramid, DECIMATION_THRESHOLD
+
+import numpy as np
+
+# Number of points read at once when iterating over a data set.
+CHUNK_SIZE = 1 << 20
 
 class ScatterDataSet:
     def __init__(self, xdata, ydata):
@@ -10,8 +16,42 @@ class ScatterDataSet:
 
         self.xdata = xdata
         self.ydata = ydata
+        self._x_range = None
+        self._y_range = None
+        self._pyramid = None
 
         self.data_set_changed = Signal()
+        self.data_set_changed.connect(self._clear_cache)
+
+    @classmethod
+    def from_npy(cls, xpath, ypath=None, mode='r'):
+        """
+        Open .npy files as a data set, memory-mapped rather than read into memory.
+
+        If ypath is None, xpath must hold an array of shape (N,2),
+          with columns x and y.
+        mode is as for numpy.load's mmap_mode.
+          Use 'r+' to allow data points to be edited in place,
+          or 'c' to allow edits without writing them back to the file.
+        """
+        if ypath is None:
+            data = np.load(xpath, mmap_mode=mode)
+            return cls(data[:,0], data[:,1])
+        else:
+            return cls(np.load(xpath, mmap_mode=mode), np.load(ypath, mmap_mode=mode))
+
+    @classmethod
+    def from_binary(cls, path, dtype=np.float64, offset=0, columns=2, xcol=0, ycol=1, mode='r'):
+        """
+        Open a raw binary file of records as a data set, memory-mapped.
+
+        Each record holds the given number of columns of the given dtype,
+          of which xcol and ycol hold the x and y values.
+        offset is the number of header bytes to skip.
+        """
+        data = np.memmap(path, dtype=dtype, mode=mode, offset=offset)
+        data = data[:len(data) - len(data)%columns].reshape(-1, columns)
+        return cls(data[:,xcol], data[:,ycol])
 
     def __len__(self):
         return len(self.xdata)
@@ -19,12 +59,70 @@ class ScatterDataSet:
     def __getitem__(self, index):
         return ScatterDataPoint(self, index)
 
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Iterate over (xdata, ydata) pairs of consecutive slices of the data set.
+        For memory-mapped data, only one slice is read at a time.
+        """
+        for start in range(0, len(self), chunk_size):
+            stop = start + chunk_size
+            yield self.xdata[start:stop], self.ydata[start:stop]
+
+    def x_range(self):
+        """
+        Returns the smallest and largest x values.
+        """
+        if self._x_range is None:
+            low, high = np.inf, -np.inf
+            for xdata, _ in self.iter_chunks():
+                low = min(low, xdata.min())
+                high = max(high, xdata.max())
+            self._x_range = (low, high)
+        return self._x_range
+
+    def y_range(self):
+        """
+        Returns the smallest and largest y values.
+        """
+        if self._y_range is None:
+            low, high = np.inf, -np.inf
+            for _, ydata in self.iter_chunks():
+                low = min(low, ydata.min())
+                high = max(high, ydata.max())
+            self._y_range = (low, high)
+        return self._y_range
+
+    def _clear_cache(self, *args):
+        self._x_range = None
+        self._y_range = None
+        self._pyramid = None
+
+    def plot_data(self, axes):
+        """
+        Returns the (x, y) points to draw on the axes given.
+        Large data sets are decimated to at most one point per pixel of the current view.
+        """
+        if len(self) <= DECIMATION_THRESHOLD:
+            return self.xdata, self.ydata
+
+        if self._pyramid is None:
+            self._pyramid = OccupancyPyramid(self.xdata, self.ydata,
+                                             self.x_range(), self.y_range())
+        return self._pyramid.decimate(axes.get_xlim(), axes.get_ylim(),
+                                      axes.bbox.width, axes.bbox.height)
+
     def draw(self, axes):
-        return axes.scatter(self.xdata, self.ydata)
+        # Set the view from the full data, as the decimation depends on it.
+        (xlow, xhigh), (ylow, yhigh) = self.x_range(), self.y_range()
+        axes.update_datalim([(xlow, ylow), (xhigh, yhigh)])
+        axes.autoscale_view()
+
+        xdata, ydata = self.plot_data(axes)
+        return axes.plot(xdata, ydata, linestyle='none', marker='o')
 
     def update(self, drawn_obj):
-        drawn_obj.set_xdata(self.xdata)
-        drawn_obj.set_ydata(self.ydata)
+        xdata, ydata = self.plot_data(drawn_obj[0].axes)
+        drawn_obj[0].set_data(xdata, ydata)
 
 
 class ScatterDataPoint:
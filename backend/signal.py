@@ -1,18 +1,170 @@
 #!/usr/bin/env python3
 
-class Signal:
+import collections
+import contextlib
+import threading
+
+from . import instrumentation
+
+class _State(threading.local):
+    # Each thread batches its own emissions, and delivers them itself.
     def __init__(self):
+        # Deliveries held back by batch() or by deferred signals,
+        #   keyed so that repeated emissions replace each other.
+        self.pending = collections.OrderedDict()
+        self.batch_depth = 0
+        self.flush_scheduled = False
+
+_state = _State()
+_dispatcher = None
+_dispatcher_thread = None
+
+class Signal:
+    """
+    A list of callbacks, all called when the signal is emitted.
+
+    Inside a batch(), or for a signal constructed with deferred=True,
+      emissions are held back and coalesced:
+      each listener is called once, with the most recent arguments.
+    Listeners connected with per_args=True are instead called once
+      for each distinct set of arguments.
+
+    Batches are per thread: a batch() holds back only the emissions of its own thread,
+      and delivers them in that thread.
+    Deferred signals are deferred only when emitted in the thread that set the dispatcher,
+      and are delivered immediately when emitted in any other thread.
+
+    emit_count, delivery_count, and dropped_count record how many times
+      the signal was emitted, how many callbacks were made,
+      and how many callbacks were skipped by coalescing.
+    """
+    def __init__(self, deferred=False):
         self.callbacks = []
+        self.per_args = set()
+        self.deferred = deferred
+
+        self.emit_count = 0
+        self.delivery_count = 0
+        self.dropped_count = 0
 
-    def connect(self, func):
+    def connect(self, func, per_args=False):
         self.callbacks.append(func)
+        if per_args:
+            self.per_args.add(func)
 
     def disconnect(self, func):
         self.callbacks.remove(func)
+        if func not in self.callbacks:
+            self.per_args.discard(func)
 
     def disconnect_all(self):
         del self.callbacks[:]
+        self.per_args.clear()
 
     def emit(self, *args, **kwargs):
+        self.emit_count += 1
+
+        state = _state
+        deferred = (self.deferred and _dispatcher is not None and
+                    threading.get_ident() == _dispatcher_thread)
+        if not (state.batch_depth or deferred):
+            if instrumentation.enabled:
+                with instrumentation.timer('signal.emit'):
+                    self._deliver(args, kwargs)
+            else:
+                self._deliver(args, kwargs)
+            return
+
+        if instrumentation.enabled:
+            instrumentation.count('signal.held_back')
+
         for callback in self.callbacks:
+            key = (id(self), callback)
+            if callback in self.per_args:
+                key += (_args_key(args, kwargs),)
+            if key in state.pending:
+                self.dropped_count += 1
+            state.pending[key] = (self, callback, args, kwargs)
+
+        if deferred and not state.batch_depth:
+            _schedule_flush(state)
+
+    def _deliver(self, args, kwargs):
+        for callback in list(self.callbacks):
+            self.delivery_count += 1
             callback(*args, **kwargs)
+
+    def reset_counts(self):
+        self.emit_count = 0
+        self.delivery_count = 0
+        self.dropped_count = 0
+
+
+@contextlib.contextmanager
+def batch():
+    """
+    Hold back all signal deliveries made by this thread until the end of the block.
+
+    Ex:
+        with batch():
+            for par in parameters:
+                par.fitted_value = 0  # Listeners are called once, after the loop.
+    """
+    state = _state
+    state.batch_depth += 1
+    try:
+        yield
+    finally:
+        state.batch_depth -= 1
+        if not state.batch_depth:
+            flush()
+
+
+def flush():
+    """
+    Deliver all emissions held back in this thread, in the order that they were first emitted.
+    """
+    state = _state
+    state.flush_scheduled = False
+    if state.pending:
+        with instrumentation.timer('signal.flush'):
+            _deliver_pending(state.pending)
+
+
+def _deliver_pending(pending):
+    while pending:
+        _, (signal, callback, args, kwargs) = pending.popitem(last=False)
+        # Skip listeners that disconnected after the emission.
+        if callback in signal.callbacks:
+            signal.delivery_count += 1
+            callback(*args, **kwargs)
+
+
+def set_dispatcher(dispatcher):
+    """
+    Set the function used to deliver deferred signals.
+
+    The dispatcher is passed a function of no arguments,
+      and should arrange for it to be called soon in the calling thread,
+      such as on the next pass of that thread's event loop.
+    With no dispatcher, deferred signals are delivered immediately.
+    """
+    global _dispatcher, _dispatcher_thread
+    _dispatcher = dispatcher
+    _dispatcher_thread = threading.get_ident()
+
+
+def _schedule_flush(state):
+    if not state.flush_scheduled:
+        state.flush_scheduled = True
+        _dispatcher(flush)
+
+
+def _args_key(args, kwargs):
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        return (tuple(id(arg) for arg in args),
+                tuple((name, id(val)) for name,val in sorted(kwargs.items())))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from .fitter import FitMethod, FitResult, ErrorCalc, compile_fit_function, generate_errors
+
+class StackedFitResult:
+    """
+    The outcome of fitting many same-shape data sets at once.
+
+    param_names -- The names of the free parameters, in the order used by the last axis of values.
+    values -- The fitted parameters, with shape (n_datasets, n_params).
+    covariance -- The covariance matrices, with shape (n_datasets, n_params, n_params).
+    cost -- The chi^2 of each fit, with shape (n_datasets,).
+    success -- Whether each fit converged, with shape (n_datasets,).
+    iterations -- The number of iterations taken by each fit, with shape (n_datasets,).
+    """
+    def __init__(self, param_names, values, covariance, cost, success, iterations):
+        self.param_names = list(param_names)
+        self.values = values
+        self.covariance = covariance
+        self.cost = cost
+        self.success = success
+        self.iterations = iterations
+
+    @property
+    def params(self):
+        return {name:self.values[:,i] for i,name in enumerate(self.param_names)}
+
+    @property
+    def errors(self):
+        return np.sqrt(np.diagonal(self.covariance, axis1=1, axis2=2))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        message = 'Converged' if self.success[i] else 'Did not converge'
+        return FitResult(self.param_names, self.values[i], self.covariance[i],
+                         FitMethod.LeastSquares, self.cost[i],
+                         success=bool(self.success[i]), message=message)
+
+
+def fit_stacked(fit_function, xdata, ydata, errors=None,
+                independent_var = 'x',
+                error_calc = ErrorCalc.AutoDetect,
+                subexpressions = None, initial_values = None,
+                max_iterations = 200, tolerance = 1e-8):
+    """
+    Least-squares fit of one function to many data sets sharing the same x coordinates,
+    such as histograms with identical binning.
+
+    All data sets are fit simultaneously by a vectorized Levenberg-Marquardt,
+    with each data set having its own damping and convergence state.
+    Converged data sets are dropped from further iterations.
+    Returns a StackedFitResult.
+
+    fit_function -- A string, sympy expression, or CompiledFormula.
+
+    xdata -- The x coordinates shared by all data sets, with shape (n_points,).
+
+    ydata -- The y coordinates, with shape (n_datasets, n_points).
+
+    errors -- The uncertainties of each point, broadcastable to the shape of ydata.
+              If None, will be auto-generated according to error_calc.
+              Points with zero uncertainty (e.g. empty bins with SqrtCounts) are given an uncertainty of one.
+
+    initial_values -- The starting point, as a dict mapping parameter name to either
+                        a single value for all data sets, or an array of shape (n_datasets,).
+                      Any parameters not given start at 1.
+
+    max_iterations -- The maximum number of iterations for any one data set.
+
+    tolerance -- A fit has converged once an accepted step changes its chi^2
+                   by less than this fraction.
+
+    The remaining arguments are as for fitter.fit().
+    """
+    compiled = compile_fit_function(fit_function, subexpressions, independent_var)
+    if compiled is None:
+        raise ValueError('Stacked fits require the fit function as a string or sympy expression')
+
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.atleast_2d(np.asarray(ydata, dtype=float))
+    n_datasets, n_points = ydata.shape
+    param_names = compiled.free_params
+    n_params = len(param_names)
+
+    if errors is None:
+        errors = generate_errors(ydata.ravel(), error_calc).reshape(ydata.shape)
+    errors = np.broadcast_to(np.asarray(errors, dtype=float), ydata.shape)
+    errors = np.where(errors > 0, errors, 1.0)
+
+    initial_values = initial_values or {}
+    params = np.empty((n_datasets, n_params))
+    for i,name in enumerate(param_names):
+        params[:,i] = initial_values.get(name, 1.0)
+
+    def evaluate(params, ydata, errors):
+        # Weighted residuals and jacobian of a subset of the data sets
+        value, jac = compiled.value_and_jacobian(xdata, *params.T[:,:,np.newaxis])
+        residuals = (ydata - value)/errors
+        jac = jac/errors[:,:,np.newaxis]
+        return residuals, jac
+
+    def chi2(params, ydata, errors):
+        value = compiled.fit_function(xdata, *params.T[:,:,np.newaxis])
+        return np.sum(((ydata - value)/errors)**2, axis=-1)
+
+    damping = np.full(n_datasets, 1e-3)
+    iterations = np.zeros(n_datasets, dtype=int)
+    converged = np.zeros(n_datasets, dtype=bool)
+    stuck = np.zeros(n_datasets, dtype=bool)
+    active = np.arange(n_datasets)
+
+    # Residuals and jacobian of the active data sets, at their current parameters
+    residuals, jac = evaluate(params, ydata, errors)
+    cost = np.sum(residuals**2, axis=-1)
+
+    while len(active):
+        alpha = np.einsum('dbp,dbq->dpq', jac, jac)
+        beta = np.einsum('dbp,db->dp', jac, residuals)
+
+        # Levenberg-Marquardt step, scaled by the diagonal of alpha
+        diagonal = np.einsum('dpp->dp', alpha)
+        damped = alpha.copy()
+        damped[:, np.arange(n_params), np.arange(n_params)] += (
+            damping[active, np.newaxis] * np.maximum(diagonal, 1e-12))
+        try:
+            step = np.linalg.solve(damped, beta[:,:,np.newaxis])[:,:,0]
+        except np.linalg.LinAlgError:
+            step = np.einsum('dpq,dq->dp', np.linalg.pinv(damped), beta)
+
+        trial = params[active] + step
+        with np.errstate(all='ignore'):
+            trial_cost = chi2(trial, ydata[active], errors[active])
+        improved = np.isfinite(trial_cost) & (trial_cost <= cost[active])
+        iterations[active] += 1
+
+        # Accepted steps decrease the damping, rejected steps increase it.
+        damping[active] = np.where(improved, damping[active]/10, damping[active]*10)
+
+        accepted = active[improved]
+        change = cost[accepted] - trial_cost[improved]
+        params[accepted] = trial[improved]
+        cost[accepted] = trial_cost[improved]
+        converged[accepted] = change <= tolerance*cost[accepted]
+
+        # No downhill step can be found from the current point.
+        stuck[active] = ~improved & (damping[active] > 1e16)
+
+        remaining = ~converged[active] & ~stuck[active] & (iterations[active] < max_iterations)
+        active = active[remaining]
+        residuals, jac = residuals[remaining], jac[remaining]
+
+        # Only the data sets that moved need a new jacobian.
+        moved = improved[remaining]
+        if moved.any():
+            residuals[moved], jac[moved] = evaluate(
+                params[active[moved]], ydata[active[moved]], errors[active[moved]])
+
+    residuals, jac = evaluate(params, ydata, errors)
+    alpha = np.einsum('dbp,dbq->dpq', jac, jac)
+    covariance = np.linalg.pinv(alpha)
+
+    return StackedFitResult(param_names, params, covariance, cost,
+                            success=converged, iterations=iterations)
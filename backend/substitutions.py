@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
+import functools
+
 from sympy.parsing.sympy_parser import parse_expr
 
 import sympy
 from sympy.core.function import AppliedUndef
 
+# Number of distinct subexpression tables kept parsed at any one time.
+CACHE_SIZE = 16
+
 def func_sub_single(expr, func_def, func_body):
     """
     Given an expression and a function definition,
@@ -61,18 +66,168 @@ def all_subs(expr, subexpressions):
     Accepts arguments either as strings or as sympy expressions.
 
     If the symbol is a function to be expanded, expands as a function.
+    Expansions may themselves use any of the other subexpressions.
     """
     if isinstance(expr, str):
         expr = parse_expr(expr)
 
-    for (symbol, expansion) in subexpressions:
-        if isinstance(symbol, str):
-            symbol = parse_expr(symbol)
-        if isinstance(expansion, str):
-            expansion = parse_expr(expansion)
+    try:
+        table = substitution_table(tuple(subexpressions))
+    except TypeError:
+        # Unhashable subexpressions, so cannot be cached.
+        table = SubstitutionTable(subexpressions)
+    return table.expand(expr)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def substitution_table(subexpressions):
+    """
+    Returns the SubstitutionTable for a tuple of (symbol, expansion) pairs,
+    parsing each table only once.
+    """
+    return SubstitutionTable(subexpressions)
+
+
+class SubstitutionTable:
+    """
+    A parsed set of subexpressions, which can be expanded in a single pass.
+
+    Each subexpression is expanded at most once, the first time it is used,
+      and the result is reused for every later call.
+    Keys that are expressions rather than symbols, such as x**2, are replaced after the pass,
+      in the order given, with sympy's subs, so that they also match within larger terms.
+    Raises ValueError on construction if any subexpression refers back to itself,
+      whether directly or through other subexpressions.
+
+    Ex:
+        table = SubstitutionTable([('linear(m,b)', 'm*x+b'),
+                                   ('double(y)', '2*y')])
+        table.expand(parse_expr('double(linear(2,1))'))  # returns 4*x + 2
+    """
+    def __init__(self, subexpressions):
+        # name -> (tuple of argument symbols, body)
+        self.functions = {}
+        # symbol -> body
+        self.symbols = {}
+        # [(expression, body)]
+        self.expressions = []
+
+        for (symbol, expansion) in subexpressions:
+            if isinstance(symbol, str):
+                symbol = parse_expr(symbol)
+            if isinstance(expansion, str):
+                expansion = parse_expr(expansion)
+
+            if isinstance(symbol, AppliedUndef):
+                self.functions[symbol.func.__name__] = (symbol.args, expansion)
+            elif symbol.args:
+                self.expressions.append((symbol, expansion))
+            else:
+                self.symbols[symbol] = expansion
+
+        self._check_cycles()
+
+        self._expanded_functions = {}
+        self._expanded_symbols = {}
+        self._expanded_expressions = None
+
+    def _dependencies(self, key):
+        if isinstance(key, str):
+            args, body = self.functions[key]
+            bound = set(args)
+        else:
+            body = self.symbols[key]
+            bound = set()
+
+        deps = [func.func.__name__ for func in body.atoms(AppliedUndef)
+                if func.func.__name__ in self.functions]
+        deps.extend(sym for sym in body.free_symbols
+                    if sym in self.symbols and sym not in bound)
+        return deps
+
+    def _check_cycles(self):
+        # Depth-first search, keeping the current path to report any cycle found.
+        finished = set()
+        for start in list(self.functions) + list(self.symbols):
+            if start in finished:
+                continue
+            path = [start]
+            on_path = {start}
+            stack = [iter(self._dependencies(start))]
+            while stack:
+                for dep in stack[-1]:
+                    if dep in on_path:
+                        cycle = path[path.index(dep):] + [dep]
+                        raise ValueError('Subexpressions may not be recursively defined: {}'.format(
+                            ' -> '.join(str(item) for item in cycle)))
+                    if dep not in finished:
+                        path.append(dep)
+                        on_path.add(dep)
+                        stack.append(iter(self._dependencies(dep)))
+                        break
+                else:
+                    stack.pop()
+                    done = path.pop()
+                    on_path.discard(done)
+                    finished.add(done)
+
+    def expand(self, expr):
+        """
+        Expand all subexpressions within expr.
+        """
+        expr = self._expand(expr, frozenset(), {})
+        if self.expressions:
+            if self._expanded_expressions is None:
+                self._expanded_expressions = [(key, self._expand(body, frozenset(), {}))
+                                              for key, body in self.expressions]
+            for key, body in self._expanded_expressions:
+                expr = expr.subs(key, body)
+        return expr
 
-        if isinstance(symbol, AppliedUndef):
-            expr = func_sub(expr, symbol, expansion)
+    def _expand(self, expr, bound, memo):
+        # Postorder traversal: arguments are expanded before the node using them.
+        # Symbols in bound are function arguments, and are not substituted.
+        try:
+            return memo[expr]
+        except KeyError:
+            pass
+
+        if not expr.args:
+            if expr in self.symbols and expr not in bound:
+                result = self._expanded_symbol(expr)
+            else:
+                result = expr
         else:
-            expr = expr.subs(symbol, expansion)
-    return expr
+            args = tuple(self._expand(arg, bound, memo) for arg in expr.args)
+            name = expr.func.__name__ if isinstance(expr, AppliedUndef) else None
+            if name in self.functions:
+                params, body = self._expanded_function(name)
+                result = body.xreplace(dict(zip(params, args)))
+            elif args != expr.args:
+                result = expr.func(*args)
+            else:
+                result = expr
+
+        memo[expr] = result
+        return result
+
+    def _expanded_function(self, name):
+        try:
+            return self._expanded_functions[name]
+        except KeyError:
+            pass
+
+        params, body = self.functions[name]
+        expanded = (params, self._expand(body, frozenset(params), {}))
+        self._expanded_functions[name] = expanded
+        return expanded
+
+    def _expanded_symbol(self, symbol):
+        try:
+            return self._expanded_symbols[symbol]
+        except KeyError:
+            pass
+
+        expanded = self._expand(self.symbols[symbol], frozenset(), {})
+        self._expanded_symbols[symbol] = expanded
+        return expanded
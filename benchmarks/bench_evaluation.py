@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compares the evaluation backends on the models of benchmarks.synthetic,
+for the value and value-and-jacobian kernels, and for a complete fit.
+Results are checked against the numpy backend.
+
+Run from the top-level directory as
+    python -m benchmarks.bench_evaluation [max_size]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from backend import evaluation
+from backend.compiled_formula import compile_formula
+from backend.fitter import fit
+from benchmarks.synthetic import MODELS
+
+def best_time(func, n_repeat=5):
+    func()
+    times = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(max_size=10**7):
+    backends = [name for name in sorted(evaluation.BACKENDS)
+                if evaluation.BACKENDS[name].available()]
+    print('Backends: {}'.format(', '.join(backends)))
+    print('{:<14}{:<12}{:>10}'.format('model', 'kernel', 'points') +
+          ''.join('{:>12}'.format(name) for name in backends) + '  (ms, best of 5)')
+
+    sizes = [n for n in (10**3, 10**5, 10**6, 10**7) if n <= max_size]
+    for model in [MODELS['gaussian'], MODELS['exponential'], MODELS['polynomial7']]:
+        compiled = {name:compile_formula(model.formula, backend=name) for name in backends}
+        reference = compiled['numpy']
+        params = [model.truth[name] for name in reference.free_params]
+
+        for n_points in sizes:
+            xdata = np.linspace(model.low, model.high, n_points)
+            expected = reference.value_and_jacobian(xdata, *params)
+            for kernel in ['value', 'jacobian']:
+                times = []
+                for name in backends:
+                    if kernel == 'value':
+                        func = lambda: compiled[name].fit_function(xdata, *params)
+                    else:
+                        func = lambda: compiled[name].value_and_jacobian(xdata, *params)
+                    times.append(best_time(func))
+
+                    value, jacobian = compiled[name].value_and_jacobian(xdata, *params)
+                    if not (np.allclose(value, expected[0], rtol=1e-10) and
+                            np.allclose(jacobian, expected[1], rtol=1e-10)):
+                        print('Mismatch between {} and numpy for {}'.format(name, model.name))
+                print('{:<14}{:<12}{:>10}'.format(model.name, kernel, n_points) +
+                      ''.join('{:>12.3f}'.format(1e3*t) for t in times))
+
+    model = MODELS['gaussian']
+    n_points = min(max_size, 10**6)
+    xdata, ydata, errors = model.generate(n_points)
+    times = []
+    for name in backends:
+        compiled = compile_formula(model.formula, backend=name)
+        times.append(best_time(lambda: fit(compiled, xdata, ydata, errors,
+                                           initial_values=model.initial), n_repeat=3))
+    print('{:<14}{:<12}{:>10}'.format(model.name, 'fit', n_points) +
+          ''.join('{:>12.3f}'.format(1e3*t) for t in times))
+
+if __name__=='__main__':
+    main(*[int(float(arg)) for arg in sys.argv[1:]])
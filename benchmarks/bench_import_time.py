@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Measures the time to import each entry point in a fresh interpreter,
+and which of the slow-to-import libraries each one pulls in.
+
+Run from the top-level directory as
+    python -m benchmarks.bench_import_time [n_repeat]
+"""
+
+import os
+import subprocess
+import sys
+
+MODULES = ['backend.fitter', 'backend.stacked_fitter', 'backend.formula', 'runfit', 'rungui', 'gui']
+HEAVY = ['numpy', 'scipy', 'sympy', 'matplotlib', 'PyQt4', 'IPython']
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+try:
+    import {module}
+    status = 'ok'
+except ImportError as e:
+    status = 'ImportError: {{}}'.format(e)
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(repr((elapsed, status, heavy)))
+"""
+
+def time_import(module):
+    top_level = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT.format(module=module, heavy=HEAVY)],
+        cwd=top_level, universal_newlines=True)
+    return eval(output)
+
+def main(n_repeat=3):
+    print('{:<24}{:>12}  {}'.format('module', 'time (ms)', 'heavy modules loaded'))
+    for module in MODULES:
+        # Best of several runs, to reduce the effect of a cold disk cache.
+        runs = [time_import(module) for _ in range(n_repeat)]
+        elapsed = min(run[0] for run in runs)
+        _, status, heavy = runs[-1]
+        if status != 'ok':
+            print('{:<24}{:>12}  {}'.format(module, '-', status))
+        else:
+            print('{:<24}{:>12.1f}  {}'.format(module, 1e3*elapsed, ', '.join(heavy) or '-'))
+
+if __name__=='__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Compares fit_stacked against calling fit() once per histogram.
+
+Run from the top-level directory as
+    python -m benchmarks.bench_stacked_fit [n_datasets] [n_bins]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from backend.fitter import fit, FitMethod
+from backend.stacked_fitter import fit_stacked
+
+FORMULA = 'height*exp(-(x-mu)**2/(2*sigma**2)) + background'
+INITIAL = {'height':80, 'mu':25, 'sigma':4, 'background':8}
+
+def generate(n_datasets, n_bins, seed=0):
+    rng = np.random.RandomState(seed)
+    xdata = np.arange(n_bins, dtype=float)
+    mu = rng.uniform(0.4*n_bins, 0.6*n_bins, n_datasets)
+    expected = 100*np.exp(-(xdata - mu[:,np.newaxis])**2/(2*5.0**2)) + 10
+    return xdata, rng.poisson(expected).astype(float)
+
+def main(n_datasets=100000, n_bins=50, n_loop=1000):
+    xdata, ydata = generate(n_datasets, n_bins)
+
+    start = time.time()
+    res = fit_stacked(FORMULA, xdata, ydata, initial_values=INITIAL)
+    stacked_time = time.time() - start
+    print('fit_stacked: {} histograms in {:.2f} s ({:.1f} us/histogram), {:.1%} converged'.format(
+        n_datasets, stacked_time, 1e6*stacked_time/n_datasets, res.success.mean()))
+
+    n_loop = min(n_loop, n_datasets)
+    start = time.time()
+    max_diff = 0
+    for i in range(n_loop):
+        single = fit(FORMULA, xdata, ydata[i], initial_values=INITIAL,
+                     fit_method=FitMethod.LeastSquares)
+        max_diff = max(max_diff, np.max(np.abs(single.values - res.values[i])/single.errors))
+    loop_time = time.time() - start
+    print('fit loop:    {} histograms in {:.2f} s ({:.1f} us/histogram)'.format(
+        n_loop, loop_time, 1e6*loop_time/n_loop))
+
+    print('Speedup: {:.1f}x'.format((loop_time/n_loop)/(stacked_time/n_datasets)))
+    print('Largest difference in fitted values: {:.2g} sigma'.format(max_diff))
+
+if __name__=='__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Compares the single-pass SubstitutionTable against the previous
+sequential, per-function expansion of subexpressions.
+
+Run from the top-level directory as
+    python -m benchmarks.bench_substitutions [n_components]
+"""
+
+import sys
+import time
+
+from sympy.parsing.sympy_parser import parse_expr
+from sympy.core.function import AppliedUndef
+
+from backend.substitutions import func_sub, substitution_table, SubstitutionTable
+
+def sequential_subs(expr, subexpressions):
+    # The previous implementation of all_subs,
+    #   repeated until nothing changes to allow for nested use.
+    while True:
+        prev = expr
+        for (symbol, expansion) in subexpressions:
+            symbol = parse_expr(symbol)
+            expansion = parse_expr(expansion)
+            if isinstance(symbol, AppliedUndef):
+                expr = func_sub(expr, symbol, expansion)
+            else:
+                expr = expr.subs(symbol, expansion)
+        if expr == prev:
+            return expr
+
+def library(n_components):
+    """
+    A library of peaks, backgrounds and composite models,
+      where each composite model uses several earlier components.
+    """
+    subexpressions = [
+        ('gaus(height,mu,sigma)', 'height*exp(-(x-mu)**2/(2*sigma**2))'),
+        ('linear(slope,offset)', 'slope*x + offset'),
+        ('quad(a,b,c)', 'a*x**2 + linear(b,c)'),
+    ]
+    for i in range(n_components):
+        subexpressions.append(('peak{0}(h,m)'.format(i),
+                               'gaus(h, m, {0}+1)'.format(i)))
+        subexpressions.append(('bg{0}(a)'.format(i),
+                               'quad(a, a/{0}, 1)'.format(i+1)))
+        if i >= 2:
+            subexpressions.append(('model{0}(h,m,a)'.format(i),
+                                   'peak{0}(h,m) + peak{1}(h,m+1) + model{2}(h,m,a) + bg{0}(a)'.format(
+                                       i, i-1, i-2 if i >= 4 else 2)
+                                   if i >= 4 else
+                                   'peak{0}(h,m) + bg{0}(a)'.format(i)))
+    return subexpressions
+
+def main(n_components=70):
+    subexpressions = library(n_components)
+    top = max(i for i in range(n_components) if i >= 2)
+    expr = parse_expr('model{0}(A, M, B) + model{1}(C, P, D)'.format(top, top-1))
+    print('{} subexpressions'.format(len(subexpressions)))
+
+    start = time.time()
+    new = SubstitutionTable(subexpressions).expand(expr)
+    cold = time.time() - start
+    print('SubstitutionTable, cold: {:.3f} s'.format(cold))
+
+    substitution_table(tuple(subexpressions)).expand(expr)
+    start = time.time()
+    substitution_table(tuple(subexpressions)).expand(expr)
+    warm = time.time() - start
+    print('SubstitutionTable, cached: {:.4f} s'.format(warm))
+
+    start = time.time()
+    old = sequential_subs(expr, subexpressions)
+    seq = time.time() - start
+    print('Sequential func_sub: {:.3f} s'.format(seq))
+
+    print('Results agree: {}'.format((old - new).expand() == 0))
+    print('Speedup: {:.1f}x cold'.format(seq/cold))
+
+if __name__=='__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Times fitting, refitting, function evaluation, subexpression expansion and plot updates
+across models and data set sizes, and writes the results as JSON.
+
+Run from the top-level directory as
+    python -m benchmarks.bench_suite [--output results.json] [--max-size 1e7] [--compare old.json]
+
+Each result records the best time of several runs, the throughput in points per second,
+  and the peak memory allocated during one run, as measured by tracemalloc.
+With --compare, the ratio of each time to that of a previous run is printed,
+  so that regressions between releases stand out.
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import MODELS
+from benchmarks.bench_substitutions import library
+
+SIZES = [10**k for k in range(2, 8)]
+
+def measure(func, min_time=0.5, max_repeat=10):
+    """
+    Returns (best time, peak memory, number of runs) for calling func.
+
+    A first, untimed call absorbs one-off costs such as compiling the fit function.
+    The second call is made under tracemalloc, and is also excluded from the timing.
+    """
+    func()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times = []
+    while len(times) < max_repeat and (sum(times) < min_time or not times):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times), peak, len(times)
+
+
+def record(results, benchmark, name, n_points, func, **extra):
+    best, peak, repeats = measure(func)
+    entry = {'benchmark':benchmark, 'name':name, 'n_points':n_points,
+             'time':best, 'throughput':n_points/best if n_points else None,
+             'peak_memory':peak, 'repeats':repeats}
+    entry.update(extra)
+    results.append(entry)
+    size = n_points or extra.get('n_subexpressions')
+    print('{:<16}{:<20}{:>10}{:>12.3f} ms{:>10.1f} MB'.format(
+        benchmark, name, size, 1e3*best, peak/2**20))
+    sys.stdout.flush()
+
+
+def bench_fit(results, sizes):
+    from backend.fitter import fit
+
+    for model in MODELS.values():
+        for n_points in sizes:
+            xdata, ydata, errors = model.generate(n_points)
+            outcome = {}
+            def run():
+                outcome['res'] = fit(model.formula, xdata, ydata, errors,
+                                     initial_values=model.initial)
+            record(results, 'fit', model.name, n_points, run,
+                   n_params=model.n_params)
+            res = outcome['res']
+            results[-1].update(success=bool(res.success), fit_method=res.fit_method.name)
+
+
+def bench_refit(results, sizes):
+    from backend.fit_cache import FitCache
+    from backend.fitter import fit
+
+    # Refitting after a different bin is edited in each run,
+    #   from the initial values and warm-started from the nearest earlier fit,
+    #   and repeating an unchanged fit, which is answered by the cache.
+    for model in MODELS.values():
+        for n_points in sizes:
+            xdata, ydata, errors = model.generate(n_points)
+            cache = FitCache()
+            edits = itertools.count()
+            def edited():
+                ynew = ydata.copy()
+                ynew[next(edits) % n_points] += 1
+                return ynew
+            def run(cache):
+                return fit(model.formula, xdata, edited(), errors,
+                           initial_values=model.initial, cache=cache)
+
+            record(results, 'refit', model.name + '.cold', n_points, lambda: run(None),
+                   n_params=model.n_params)
+            record(results, 'refit', model.name + '.warm', n_points, lambda: run(cache),
+                   n_params=model.n_params)
+            record(results, 'refit', model.name + '.hit', n_points,
+                   lambda: fit(model.formula, xdata, ydata, errors,
+                               initial_values=model.initial, cache=cache),
+                   n_params=model.n_params)
+
+
+def bench_apply(results, sizes):
+    from backend.formula import Formula
+    from backend.free_parameters import FreeParameters
+
+    for model in MODELS.values():
+        formula = Formula([])
+        parameters = FreeParameters(formula=formula)
+        formula.raw_text = model.formula
+        for par in parameters:
+            par.fitted_value = model.truth[par.name]
+
+        for n_points in sizes:
+            xdata = np.linspace(model.low, model.high, n_points)
+            record(results, 'apply', model.name, n_points,
+                   lambda: formula.apply(xdata, parameters),
+                   n_params=model.n_params)
+
+
+def bench_all_subs(results, n_components=(5, 20, 70)):
+    from sympy.parsing.sympy_parser import parse_expr
+    from backend.substitutions import all_subs, substitution_table
+
+    for n in n_components:
+        subexpressions = library(n)
+        top = max(n-1, 2)
+        expr = parse_expr('model{0}(A, M, B) + peak0(C, P)'.format(top))
+
+        def cold():
+            substitution_table.cache_clear()
+            all_subs(expr, subexpressions)
+        record(results, 'all_subs', 'cold', 0, cold,
+               n_subexpressions=len(subexpressions))
+        record(results, 'all_subs', 'cached', 0, lambda: all_subs(expr, subexpressions),
+               n_subexpressions=len(subexpressions))
+
+
+def bench_plot_update(results, sizes):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from backend.scatter_data_set import ScatterDataSet
+    from backend.hist_data_set import HistDataSet
+
+    model = MODELS['gaussian']
+    for n_points in sizes:
+        xdata, ydata, _ = model.generate(n_points)
+        edges = np.linspace(model.low, model.high, n_points+1)
+        for name, data_set in [('scatter', ScatterDataSet(xdata, ydata)),
+                               ('hist', HistDataSet(edges, ydata))]:
+            figure = Figure(figsize=(8,6), dpi=100)
+            canvas = FigureCanvasAgg(figure)
+            axes = figure.add_subplot(111)
+            drawn = data_set.draw(axes)
+            canvas.draw()
+
+            # Alternate between the full view and a zoomed-in view, as when panning.
+            views = [axes.get_xlim(), (40.0, 60.0)]
+            def run():
+                views.reverse()
+                axes.set_xlim(*views[0])
+                data_set.update(drawn)
+                canvas.draw()
+            record(results, 'plot_update', name, n_points, run)
+
+
+def bench_formula_update(results, sizes):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from backend.hist_data_set import HistDataSet
+
+    # Redrawing a formula line over a histogram, as when a parameter is dragged,
+    #   with a full draw and by blitting onto the saved background.
+    model = MODELS['gaussian']
+    xline = np.linspace(model.low, model.high, 500)
+    for n_points in sizes:
+        xdata, ydata, _ = model.generate(n_points)
+        edges = np.linspace(model.low, model.high, n_points+1)
+        figure = Figure(figsize=(8,6), dpi=100)
+        canvas = FigureCanvasAgg(figure)
+        axes = figure.add_subplot(111)
+        HistDataSet(edges, ydata).draw(axes)
+        line, = axes.plot(xline, xline, animated=True)
+        canvas.draw()
+        background = canvas.copy_from_bbox(figure.bbox)
+
+        heights = [model.truth['height'], 0.5*model.truth['height']]
+        def set_line():
+            heights.reverse()
+            line.set_ydata(heights[0]*np.exp(-(xline-model.truth['mu'])**2/(2*model.truth['sigma']**2)))
+
+        def full():
+            set_line()
+            canvas.draw()
+            axes.draw_artist(line)
+        def blit():
+            set_line()
+            canvas.restore_region(background)
+            axes.draw_artist(line)
+            canvas.blit(figure.bbox)
+        record(results, 'formula_update', 'full', n_points, full)
+        record(results, 'formula_update', 'blit', n_points, blit)
+
+
+BENCHMARKS = {'fit':bench_fit, 'refit':bench_refit, 'apply':bench_apply,
+              'all_subs':bench_all_subs, 'plot_update':bench_plot_update,
+              'formula_update':bench_formula_update}
+
+def metadata():
+    import scipy
+    import sympy
+    from backend import evaluation
+    info = {'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'backend':evaluation.get_backend().name,
+            'python':platform.python_version(),
+            'platform':platform.platform(),
+            'numpy':np.__version__, 'scipy':scipy.__version__, 'sympy':sympy.__version__}
+    try:
+        import matplotlib
+        info['matplotlib'] = matplotlib.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def compare(results, path):
+    with open(path) as f:
+        previous = json.load(f)['results']
+    key = lambda entry: (entry['benchmark'], entry['name'], entry['n_points'],
+                         entry.get('n_subexpressions'))
+    previous = {key(entry):entry for entry in previous}
+
+    print()
+    print('Compared to {} (ratio > 1 is slower):'.format(path))
+    for entry in results:
+        old = previous.get(key(entry))
+        if old is not None:
+            print('{:<12}{:<20}{:>10}{:>8.2f}x time{:>8.2f}x memory'.format(
+                entry['benchmark'], entry['name'],
+                entry['n_points'] or entry.get('n_subexpressions'),
+                entry['time']/old['time'],
+                entry['peak_memory']/max(old['peak_memory'], 1)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run the pythoth benchmark suite.')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='The JSON file to write the results to.')
+    parser.add_argument('--max-size', type=float, default=1e7,
+                        help='The largest data set size to run.')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help='Run only the benchmarks given.  May be repeated.')
+    parser.add_argument('--compare',
+                        help='A previous JSON output to compare against.')
+    args = parser.parse_args(argv)
+
+    sizes = [n for n in SIZES if n <= args.max_size]
+    results = []
+    for name in args.only or BENCHMARKS:
+        if name == 'all_subs':
+            BENCHMARKS[name](results)
+        else:
+            BENCHMARKS[name](results, sizes)
+
+    with open(args.output, 'w') as f:
+        json.dump({'metadata':metadata(), 'results':results}, f, indent=2)
+    print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
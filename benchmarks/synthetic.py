@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Reproducible synthetic data sets for the benchmarks.
+
+Ex:
+    model = MODELS['gaussian']
+    xdata, ydata, errors = model.generate(10000, seed=1)
+    fit(model.formula, xdata, ydata, errors, initial_values=model.initial)
+"""
+
+import numpy as np
+
+class Model:
+    """
+    A fit function, along with the parameters used to generate data from it.
+
+    name -- A short name, used to label the benchmark results.
+    formula -- The fit function, as a string.
+    truth -- The parameters used to generate the data.
+    initial -- The starting point for fits, near but not at the truth.
+    low, high -- The range of x values.
+    poisson -- If True, the data are Poisson-distributed counts with no errors given.
+               Otherwise, the data have gaussian noise with errors of sqrt(|y|)+1.
+    """
+    def __init__(self, name, formula, truth, initial, low, high, poisson=False):
+        self.name = name
+        self.formula = formula
+        self.truth = truth
+        self.initial = initial
+        self.low = low
+        self.high = high
+        self.poisson = poisson
+        self._compiled = None
+
+    @property
+    def n_params(self):
+        return len(self.truth)
+
+    def expected(self, xdata):
+        """
+        Returns the fit function evaluated at the true parameters.
+        """
+        if self._compiled is None:
+            from backend.compiled_formula import compile_formula
+            self._compiled = compile_formula(self.formula)
+        params = dict(self.truth)
+        params[self._compiled.independent_var] = xdata
+        return np.broadcast_to(self._compiled.fit_function(**params), xdata.shape)
+
+    def generate(self, n_points, seed=0):
+        """
+        Returns (xdata, ydata, errors) with n_points evenly spaced points.
+        errors is None for Poisson data.
+        The same n_points and seed always give the same data.
+        """
+        rng = np.random.RandomState(seed)
+        xdata = np.linspace(self.low, self.high, n_points)
+        expected = self.expected(xdata)
+        if self.poisson:
+            return xdata, rng.poisson(expected).astype(float), None
+
+        errors = np.sqrt(np.abs(expected)) + 1
+        return xdata, expected + errors*rng.standard_normal(n_points), errors
+
+
+def polynomial(degree):
+    """
+    A polynomial model with degree+1 parameters, on x in [-1,1].
+    """
+    names = ['c{}'.format(i) for i in range(degree+1)]
+    formula = ' + '.join('{}*x**{}'.format(name, i) for i,name in enumerate(names))
+    truth = {name:10.0/(i+1) for i,name in enumerate(names)}
+    initial = {name:0.8*val for name,val in truth.items()}
+    return Model('polynomial{}'.format(degree), formula, truth, initial, -1.0, 1.0)
+
+
+MODELS = {model.name:model for model in [
+    Model('gaussian', 'height*exp(-(x-mu)**2/(2*sigma**2)) + background',
+          {'height':100.0, 'mu':50.0, 'sigma':5.0, 'background':10.0},
+          {'height':80.0, 'mu':48.0, 'sigma':6.0, 'background':8.0},
+          0.0, 100.0),
+    Model('exponential', 'norm*exp(-x/tau)',
+          {'norm':1000.0, 'tau':2.0},
+          {'norm':800.0, 'tau':2.5},
+          0.0, 10.0),
+    polynomial(1),
+    polynomial(3),
+    polynomial(7),
+    # Mostly-empty bins, as from a rare process.
+    Model('sparse_poisson', 'height*exp(-(x-mu)**2/(2*sigma**2)) + background',
+          {'height':3.0, 'mu':50.0, 'sigma':5.0, 'background':0.05},
+          {'height':2.5, 'mu':48.0, 'sigma':6.0, 'background':0.1},
+          0.0, 100.0, poisson=True),
+    ]}
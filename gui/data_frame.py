@@ -11,18 +11,38 @@ import numpy as np
 import sympy
 from sympy.core.basic import Basic as SympyBasic
 
-import scipy.optimize
-
-from .util import fill_placeholder
+from .util import fill_placeholder, LatestWorker
 from .latex_label import LatexLabel
+from .fit_worker import FitWorker
+from backend import instrumentation
+from backend.fit_cache import FitCache
+from backend.fitter import FitMethod, ErrorCalc
+from backend.sampling import adaptive_sample
+from backend.signal import Signal
 
 Ui_DataFrame, _ = uic.loadUiType(os.path.join(os.path.dirname(__file__),'dataframe.ui'))
 
 class DataFrame(QtGui.QWidget):
-    def __init__(self, data_set, formula, parameters, parent=None):
+    validated = QtCore.pyqtSignal(int, object)
+
+    def __init__(self, data_set, formula, parameters, validate_delay_ms=150,
+                 resample_delay_ms=200, parent=None):
         super().__init__(parent)
+        # Deferred, so that a zoom changing both limits resamples once.
+        self.view_changed = Signal(deferred=True)
+        self.view_changed.connect(self.from_view_changed)
         self._setup_ui()
 
+        # Typed formulas are validated on a worker thread once typing pauses.
+        # Each request is numbered, so that results for outdated text are dropped.
+        self._validate_id = 0
+        self.validated.connect(self.from_validated)
+        self.validator = LatestWorker(self.validate_text, self.validated.emit)
+        self.validate_timer = QtCore.QTimer(self)
+        self.validate_timer.setSingleShot(True)
+        self.validate_timer.setInterval(validate_delay_ms)
+        self.validate_timer.timeout.connect(self.request_validation)
+
         self.data_set = data_set
         self.data_set.data_set_changed.connect(self.from_data_set_changed)
 
@@ -31,7 +51,29 @@ class DataFrame(QtGui.QWidget):
         self.formula.formula_changed.connect(self.from_formula_changed)
 
         self.parameters = parameters
-        self.parameters.param_changed.connect(lambda *args:self.update())
+        self.parameters.param_changed.connect(self.from_param_changed)
+
+        self.fit_worker = None
+        self.fit_running_changed = Signal()
+        # Unweighted least squares, as the GUI has always fit.
+        self.fit_method = FitMethod.LeastSquares
+        self.error_calc = ErrorCalc.AllEqualOne
+        # Repeated fits return the previous result,
+        #   and fits after an edit to the data start from the previous result.
+        self.fit_cache = FitCache()
+
+        # The rendered figure without the formula lines, captured after each full draw,
+        #   so that parameter changes only need to redraw the lines.
+        self._background = None
+
+        # The (x, y) arrays of each formula curve, from the last adaptive sampling.
+        # Parameter changes re-evaluate the formula into y at the same x,
+        #   and the curves are resampled for the new parameters once changes pause.
+        self._curves = {}
+        self.resample_timer = QtCore.QTimer(self)
+        self.resample_timer.setSingleShot(True)
+        self.resample_timer.setInterval(resample_delay_ms)
+        self.resample_timer.timeout.connect(self.from_resample_timeout)
 
         self.redraw()
 
@@ -45,6 +87,8 @@ class DataFrame(QtGui.QWidget):
         color = (bg.redF(), bg.greenF(), bg.blueF())
         self.figure = plt.figure(edgecolor=color, facecolor=color)
         self.canvas = FigureCanvas(self.figure)
+        self.canvas.mpl_connect('resize_event', lambda event: self.view_changed.emit())
+        self.canvas.mpl_connect('draw_event', self.from_draw_event)
         toolbar = NavigationToolbar(self.canvas, self)
         toolbar.pan()
         toolbar.hide()
@@ -56,50 +100,122 @@ class DataFrame(QtGui.QWidget):
     def from_data_set_changed(self, data_set):
         self.update()
 
+    @instrumentation.timed('gui.redraw')
     def redraw(self):
+        self._background = None
         self.figure.clear()
         self.axes = self.figure.add_subplot(1,1,1)
 
         self.drawn_data = self.data_set.draw(self.axes)
         self.draw_formula(self.axes)
 
-        self.canvas.draw()
+        # Large data sets are decimated for the current view, and the formula is sampled
+        #   across the visible range, so both must be recomputed on pan or zoom.
+        self.axes.callbacks.connect('xlim_changed', lambda axes: self.view_changed.emit())
+        self.axes.callbacks.connect('ylim_changed', lambda axes: self.view_changed.emit())
 
-    def update(self):
-        self.data_set.update(self.drawn_data)
-        self.update_formula()
-        self.canvas.draw()
+        with instrumentation.timer('gui.canvas_draw'):
+            self.canvas.draw()
 
-    def draw_formula(self, axes):
-        xfit, yinitial, yfit = self.fit_formula_data()
-        self.initial_line = axes.plot(xfit, yinitial, color='red', linestyle='--')
-        self.fitted_line = axes.plot(xfit, yfit, color='red')
-
-    def update_formula(self):
-        xfit, yinitial, yfit = self.fit_formula_data()
-        self.initial_line[0].set_xdata(xfit)
-        self.initial_line[0].set_ydata(yinitial)
-        self.fitted_line[0].set_xdata(xfit)
-        self.fitted_line[0].set_ydata(yfit)
-
-    def fit_formula_data(self):
-        low = self.data_set.xdata.min()
-        high = self.data_set.xdata.max()
-        N = 1000
-        xfit = np.arange(low, high, (high-low)/N)
-
-        yinitial = self.formula.apply(xfit, self.parameters, value_type='initial')
-        if yinitial is None:
-            yinitial = np.empty(xfit.shape)
-            yinitial[:] = np.NAN
+    @instrumentation.timed('gui.view_changed')
+    def from_view_changed(self, *args):
+        self.data_set.update(self.drawn_data)
+        with instrumentation.timer('gui.update_formula'):
+            self.update_formula()
+        self.canvas.draw_idle()
 
-        yfit = self.formula.apply(xfit, self.parameters, value_type='fitted')
-        if yfit is None:
-            yfit = np.empty(xfit.shape)
-            yfit[:] = np.NAN
+    @instrumentation.timed('gui.update')
+    def update(self):
+        self.data_set.update(self.drawn_data)
+        with instrumentation.timer('gui.update_formula'):
+            self.update_formula()
+        with instrumentation.timer('gui.canvas_draw'):
+            self.canvas.draw()
+
+    def from_param_changed(self, *args):
+        with instrumentation.timer('gui.update_formula'):
+            self.update_formula(resample=False)
+        self.blit_formula()
+        self.resample_timer.start()
+
+    def from_resample_timeout(self):
+        with instrumentation.timer('gui.update_formula'):
+            self.update_formula()
+        self.blit_formula()
+
+    def from_draw_event(self, event):
+        instrumentation.count('gui.draw_event')
+        # The full draw is about to be shown, so the lines only need to be drawn, not blit.
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_formula_lines()
+
+    @instrumentation.timed('gui.blit')
+    def blit_formula(self):
+        """
+        Redraw only the formula lines, on top of the background from the last full draw.
+        Falls back to a full draw if there has not been one since the figure was cleared.
+        """
+        if self._background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self._background)
+        self.draw_formula_lines()
+        self.canvas.blit(self.figure.bbox)
 
-        return xfit, yinitial, yfit
+    def draw_formula_lines(self):
+        for line in self.initial_line + self.fitted_line:
+            self.axes.draw_artist(line)
 
+    def draw_formula(self, axes):
+        xinitial, yinitial, xfit, yfit = self.fit_formula_data()
+        # Animated lines are left out of full draws, and drawn by from_draw_event instead.
+        self.initial_line = axes.plot(xinitial, yinitial, color='red', linestyle='--', animated=True)
+        self.fitted_line = axes.plot(xfit, yfit, color='red', animated=True)
+
+    def update_formula(self, resample=True):
+        xinitial, yinitial, xfit, yfit = self.fit_formula_data(resample)
+        self.initial_line[0].set_data(xinitial, yinitial)
+        self.fitted_line[0].set_data(xfit, yfit)
+
+    def fit_formula_data(self, resample=True):
+        """
+        Returns (xinitial, yinitial, xfit, yfit) for drawing the formula in the current view.
+        Each curve is sampled separately, as their sharp features may be in different places.
+
+        With resample=False, the formula is evaluated at the x values of the last sampling,
+          writing into the same y arrays, so that no arrays are allocated.
+        """
+        xinitial, yinitial = self.formula_curve('initial', resample)
+        xfit, yfit = self.formula_curve('fitted', resample)
+        return xinitial, yinitial, xfit, yfit
+
+    def formula_curve(self, value_type, resample=True):
+        curve = self._curves.get(value_type)
+        if resample or curve is None or len(curve[0]) == 0:
+            curve = self._curves[value_type] = self.sample_formula(value_type)
+            return curve
+
+        x, y = curve
+        if self.formula.apply(x, self.parameters, value_type=value_type, out=y) is None:
+            y.fill(np.nan)
+        return curve
+
+    def sample_formula(self, value_type):
+        """
+        Sample the formula across the visible x range, with at most one point per pixel column.
+        Points are concentrated where the formula curves,
+          until it is drawn to within half a pixel.
+        """
+        low, high = self.axes.get_xlim()
+        ylim = self.axes.get_ylim()
+        width = max(int(self.axes.bbox.width), 2)
+        tolerance = 0.5*abs(ylim[1] - ylim[0])/max(self.axes.bbox.height, 1)
+
+        func = lambda x: self.formula.apply(x, self.parameters, value_type=value_type)
+        samples = adaptive_sample(func, low, high, width, tolerance)
+        if samples is None:
+            return np.empty(0), np.empty(0)
+        return samples
 
     def from_data_point_changed(self, data_point):
         self.update()
@@ -109,21 +225,76 @@ class DataFrame(QtGui.QWidget):
             self.ui.formula_input.setText(text)
 
     def on_text_changed(self,*args):
-        self.formula.raw_text = self.ui.formula_input.text()
+        self.formula.set_raw_text(self.ui.formula_input.text(), validate=False)
+        self.validate_timer.start()
 
-    def from_formula_changed(self, formula):
-        self.formula_display.latex_text = formula.latex
+    def request_validation(self):
+        self._validate_id += 1
+        # Copied here, as the GUI thread may replace the subexpressions during validation.
+        self.validator.request(self._validate_id, self.formula.raw_text,
+                               tuple(self.formula.subexpressions or ()))
 
-    def fit(self):
-        func = self.formula.fit_function
-        if not func:
+    def validate_text(self, text, subexpressions):
+        # Called on the worker thread
+        return text, self.formula.prepare(text, subexpressions)
+
+    def from_validated(self, request_id, result):
+        if request_id != self._validate_id or result is None:
             return
+        text, valid = result
+        if valid:
+            self.formula.accept(text)
+
+    def from_formula_changed(self, formula):
+        # Generating the latex can take tens of milliseconds for long formulas,
+        #   so it is done on the label's rendering thread.
+        compiled = formula.compiled
+        self.formula_display.set_latex_source(lambda: compiled.latex if compiled is not None else '')
 
-        param_names = func.__code__.co_varnames[1:]
-        initial = [self.parameters[name].initial_value for name in param_names]
+    @property
+    def fit_running(self):
+        return self.fit_worker is not None
 
-        fitvals, cov = scipy.optimize.curve_fit(func, self.data_set.xdata, self.data_set.ydata,
-                                                p0=initial)
+    def fit(self):
+        """
+        Start fitting the formula to the data set in the background.
+        The fitted values are updated as the fit progresses.
+        The fit uses fit_method and error_calc, which default to unweighted least squares.
+        """
+        compiled = self.formula.compiled
+        if not compiled or self.fit_running:
+            return
 
-        for name,val in zip(param_names, fitvals):
-            self.parameters[name].fitted_value = val
+        names = compiled.free_params
+        initial = self.parameters.vector('initial', names)
+        fixed = self.parameters.vector('fixed', names)
+        bounds = (self.parameters.vector('lower', names), self.parameters.vector('upper', names))
+        self.fit_worker = FitWorker(compiled, self.data_set.xdata, self.data_set.ydata,
+                                    initial, fixed=fixed, bounds=bounds,
+                                    fit_method=self.fit_method, error_calc=self.error_calc,
+                                    cache=self.fit_cache, parent=self)
+        self.fit_worker.progress.connect(self.from_fit_progress)
+        self.fit_worker.result.connect(self.from_fit_result)
+        self.fit_worker.error.connect(self.from_fit_error)
+        self.fit_worker.finished.connect(self.from_fit_finished)
+        self.fit_worker.finished.connect(self.fit_worker.deleteLater)
+        self.fit_worker.start()
+        self.fit_running_changed.emit(True)
+
+    def cancel_fit(self):
+        if self.fit_running:
+            self.fit_worker.cancel()
+
+    def from_fit_progress(self, progress):
+        self.parameters.set_vector('fitted', progress.values, progress.param_names)
+
+    def from_fit_result(self, res):
+        self.parameters.set_vector('fitted', res.values, res.param_names)
+        self.parameters.set_vector('error', res.errors, res.param_names)
+
+    def from_fit_error(self, message):
+        QtGui.QMessageBox.warning(self, 'Fit failed', message)
+
+    def from_fit_finished(self):
+        self.fit_worker = None
+        self.fit_running_changed.emit(False)
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from PyQt4 import QtCore
+
+from backend.fitter import fit, FitCancelled, FitMethod, ErrorCalc
+
+class FitWorker(QtCore.QThread):
+    """
+    Runs a fit on a separate thread, so that the GUI remains responsive.
+
+    progress is emitted with a FitProgress at most max_rate times per second.
+    result is emitted with the FitResult if the fit completes,
+      and error with a message if it raises any exception,
+      such as a NameError from the model or a LinAlgError from the minimizer.
+    Neither is emitted if the fit is cancelled.
+    finished is emitted in every case.
+    fit_method, error_calc, fixed, bounds and cache are passed to fit().
+    """
+    progress = QtCore.pyqtSignal(object)
+    result = QtCore.pyqtSignal(object)
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, compiled, xdata, ydata, initial_values, fixed=None, bounds=None,
+                 fit_method=FitMethod.AutoDetect, error_calc=ErrorCalc.AutoDetect,
+                 cache=None, max_rate=10, parent=None):
+        super().__init__(parent)
+        self.compiled = compiled
+        self.xdata = xdata
+        self.ydata = ydata
+        self.initial_values = initial_values
+        self.fixed = fixed
+        self.bounds = bounds
+        self.fit_method = fit_method
+        self.error_calc = error_calc
+        self.cache = cache
+        self.min_interval = 1.0/max_rate
+
+        self._cancelled = threading.Event()
+        self._last_progress = 0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        try:
+            res = fit(self.compiled, self.xdata, self.ydata,
+                      initial_values=self.initial_values,
+                      fit_method=self.fit_method, error_calc=self.error_calc,
+                      fixed=self.fixed, bounds=self.bounds, cache=self.cache,
+                      progress=self.on_progress)
+        except FitCancelled:
+            return
+        except Exception as e:
+            # An exception escaping run() would skip error, and may abort the application.
+            self.error.emit('{}: {}'.format(type(e).__name__, e))
+        else:
+            self.result.emit(res)
+
+    def on_progress(self, progress):
+        if self._cancelled.is_set():
+            raise FitCancelled()
+
+        now = time.time()
+        if now - self._last_progress >= self.min_interval:
+            self._last_progress = now
+            self.progress.emit(progress)
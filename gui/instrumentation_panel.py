@@ -0,0 +1,62 @@
+from PyQt4 import QtGui, QtCore
+
+from backend import instrumentation
+
+class InstrumentationPanel(QtGui.QWidget):
+    """
+    A window showing the timers and counters of backend.instrumentation,
+      refreshed periodically while visible.
+    """
+    def __init__(self, refresh_ms=500, parent=None):
+        super().__init__(parent, QtCore.Qt.Tool)
+        self.setWindowTitle('Profiling')
+
+        self.enabled = QtGui.QCheckBox('Enabled', self)
+        self.enabled.setChecked(instrumentation.enabled)
+        self.enabled.toggled.connect(self.on_enabled_toggled)
+
+        reset = QtGui.QPushButton('Reset', self)
+        reset.clicked.connect(self.on_reset)
+
+        self.table = QtGui.QPlainTextEdit(self)
+        self.table.setReadOnly(True)
+        self.table.setLineWrapMode(QtGui.QPlainTextEdit.NoWrap)
+        font = QtGui.QFont('Monospace')
+        font.setStyleHint(QtGui.QFont.TypeWriter)
+        self.table.setFont(font)
+
+        buttons = QtGui.QHBoxLayout()
+        buttons.addWidget(self.enabled)
+        buttons.addStretch()
+        buttons.addWidget(reset)
+        layout = QtGui.QVBoxLayout(self)
+        layout.addLayout(buttons)
+        layout.addWidget(self.table)
+        self.resize(640, 320)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(refresh_ms)
+        self.timer.timeout.connect(self.refresh)
+
+    def on_enabled_toggled(self, checked):
+        if checked:
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+    def on_reset(self, *args):
+        instrumentation.reset()
+        self.refresh()
+
+    def refresh(self):
+        self.table.setPlainText(instrumentation.report())
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.enabled.setChecked(instrumentation.enabled)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.timer.stop()
@@ -1,28 +1,107 @@
+import functools
+import threading
+
 from PyQt4 import QtGui, QtCore
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from .util import LatestWorker
+
+# Number of rendered formulas kept, shared between all labels.
+CACHE_SIZE = 64
+
+# Font size at which text extents are measured, before scaling to fit.
+BASE_FONTSIZE = 36
+DPI = 100
+
+# Mathtext keeps module-level parser state, so only one thread may lay out text at a time.
+_render_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def text_extent(latex):
+    """
+    Returns the (width, height) in pixels of the latex string at BASE_FONTSIZE.
+    The extent scales with the font size, so this is laid out once for all widget sizes.
+    """
+    figure = Figure(dpi=DPI)
+    canvas = FigureCanvasAgg(figure)
+    text = figure.text(0.5, 0.5, latex, fontsize=BASE_FONTSIZE)
+    bounds = text.get_window_extent(canvas.get_renderer())
+    return bounds.width, bounds.height
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def render_latex(latex, width, height, background):
+    """
+    Returns an image of the latex string, scaled to fill width by height pixels,
+      as a (height, width, 4) uint8 array in the byte order of QImage.Format_RGB32.
+    Returns None if the string cannot be rendered.
+
+    background -- The (red, green, blue) fill color, each from 0 to 1.
+    """
+    with _render_lock:
+        try:
+            figure = Figure(figsize=(width/DPI, height/DPI), dpi=DPI,
+                            facecolor=background, edgecolor=background)
+            canvas = FigureCanvasAgg(figure)
+            fontsize = BASE_FONTSIZE
+            text_width, text_height = text_extent(latex)
+            if text_width != 0 and text_height != 0:
+                fontsize *= min(width/text_width, height/text_height)
+            figure.text(0.5, 0.5, latex, fontsize=fontsize,
+                        horizontalalignment='center', verticalalignment='center')
+            canvas.draw()
+        except ValueError:
+            # Mathtext parse errors
+            return None
 
-from .util import fill_placeholder
+    rgba = np.asarray(canvas.buffer_rgba())
+    return np.ascontiguousarray(rgba[..., [2,1,0,3]])
 
-class LatexLabel(QtGui.QWidget):
-    def __init__(self, parent=None):
+
+def render_source(source, width, height, background):
+    """
+    Render the latex string returned by source(), or return None if it is empty.
+    """
+    latex = source()
+    if not latex:
+        return None
+    return render_latex(latex, width, height, background)
+
+
+class LatexLabel(QtGui.QLabel):
+    """
+    Displays a latex string, scaled to fill the widget.
+
+    Rendering happens on a background thread, after the text has stopped changing
+      for delay_ms, so that typing is never blocked by laying out a long formula.
+    The previous image is shown until the new one is ready.
+    """
+    rendered = QtCore.pyqtSignal(int, object)
+
+    def __init__(self, delay_ms=100, parent=None):
         super().__init__(parent)
+        self.setAlignment(QtCore.Qt.AlignCenter)
+        self.setSizePolicy(QtGui.QSizePolicy.Ignored, QtGui.QSizePolicy.Ignored)
 
         bg = self.palette().window().color()
-        color = (bg.redF(), bg.greenF(), bg.blueF())
-        self.figure = plt.figure(edgecolor=color, facecolor=color)
-        self.canvas = FigureCanvas(self.figure)
-        fill_placeholder(self, self.canvas)
+        self.background = (bg.redF(), bg.greenF(), bg.blueF())
+
+        # Each request is numbered, so that results arriving after a newer request are dropped.
+        self._request_id = 0
+        self._source = lambda: ''
+        self.rendered.connect(self.from_rendered)
+        # Emitting the signal from the rendering thread queues the result for the GUI thread.
+        self.renderer = LatestWorker(render_source, self.rendered.emit)
 
-        self.text = self.figure.suptitle('',
-                                         x=0.5, y=0.5,
-                                         horizontalalignment='center',
-                                         verticalalignment='center',
-                                         fontsize=36
-                                     )
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.request_render)
 
-        self.latex_text = ''
+        self._latex_text = ''
 
     @property
     def latex_text(self):
@@ -31,18 +110,33 @@ class LatexLabel(QtGui.QWidget):
     @latex_text.setter
     def latex_text(self, val):
         self._latex_text = val
+        self.set_latex_source(lambda: val)
 
-        self.text.set_text(val)
-        self.adjust_text_size()
-        self.canvas.draw()
+    def set_latex_source(self, source):
+        """
+        Display the latex string returned by source.
+        source is called on the rendering thread, so may be slow to compute.
+        """
+        self._source = source
+        self.timer.start()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        self.adjust_text_size()
-
-    def adjust_text_size(self):
-        bounds = self.text.get_window_extent(self.canvas.get_renderer())
-        if bounds.width != 0 and bounds.height != 0:
-            scaling = min(self.canvas.width()/bounds.width,
-                          self.canvas.height()/bounds.height)
-            self.text.set_fontsize(self.text.get_fontsize()*scaling)
+        self.timer.start()
+
+    def request_render(self):
+        self._request_id += 1
+        self.renderer.request(self._request_id, self._source,
+                              max(self.width(), 1), max(self.height(), 1), self.background)
+
+    def from_rendered(self, request_id, image):
+        if request_id != self._request_id:
+            return
+        if image is None:
+            self.clear()
+            return
+        height, width, _ = image.shape
+        data = image.tobytes()
+        # QImage does not copy the data, so convert to a pixmap while data is alive.
+        qimage = QtGui.QImage(data, width, height, 4*width, QtGui.QImage.Format_RGB32)
+        self.setPixmap(QtGui.QPixmap.fromImage(qimage))
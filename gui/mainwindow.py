@@ -5,21 +5,26 @@ import numpy as np
 
 from .data_frame import DataFrame
 from .parameter_tab import ParameterTab
+from .instrumentation_panel import InstrumentationPanel
 from .util import fill_placeholder, load_style
+from backend import signal
 from backend.free_parameters import FreeParameters
 from backend.formula import Formula
 from backend.hist_data_set import HistDataSet
 
 Ui_MainWindow, _ = uic.loadUiType(os.path.join(os.path.dirname(__file__),'mainwindow.ui'))
 
-load_style()
-
 class MainWindow(QtGui.QMainWindow):
-    def __init__(self, parent=None):
+    def __init__(self, data_set=None, parent=None):
         super().__init__(parent)
+        load_style()
+
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
+        # Deliver deferred signals on the next pass of the Qt event loop.
+        signal.set_dispatcher(lambda func: QtCore.QTimer.singleShot(0, func))
+
         self.subexpressions = [
             ('gaus(height,mu,sigma)','height * exp(-(x-mu)**2/(2*sigma**2))'),
             ('gausn(area,mu,sigma)','area/sqrt(2*pi*sigma**2) * exp(-(x-mu)**2/(2*sigma**2))'),
@@ -28,7 +33,7 @@ class MainWindow(QtGui.QMainWindow):
         self.formula = Formula(self.subexpressions)
         self.parameters = FreeParameters(formula=self.formula)
 
-        self.data_set = self._gen_data()
+        self.data_set = data_set if data_set is not None else self._gen_data()
         self.data_frame = DataFrame(data_set=self.data_set,
                                     parameters=self.parameters,
                                     formula=self.formula)
@@ -38,6 +43,12 @@ class MainWindow(QtGui.QMainWindow):
         fill_placeholder(self.ui.parameters_box, self.parameters)
 
         self.ui.fit_button.clicked.connect(self.on_do_fit)
+        self.data_frame.fit_running_changed.connect(self.from_fit_running_changed)
+
+        # Timers and counters of the fit and redraw paths, shown with Ctrl+Shift+P.
+        self.instrumentation_panel = InstrumentationPanel(parent=self)
+        shortcut = QtGui.QShortcut(QtGui.QKeySequence('Ctrl+Shift+P'), self)
+        shortcut.activated.connect(self.on_toggle_instrumentation)
 
         self.formula.raw_text = 'A*exp(-(x-mu)**2/(2*sigma**2))'
 
@@ -48,4 +59,14 @@ class MainWindow(QtGui.QMainWindow):
         return HistDataSet(bin_edges, bin_content)
 
     def on_do_fit(self, *args):
-        self.data_frame.fit()
+        if self.data_frame.fit_running:
+            self.data_frame.cancel_fit()
+        else:
+            self.data_frame.fit()
+
+    def on_toggle_instrumentation(self, *args):
+        panel = self.instrumentation_panel
+        panel.setVisible(not panel.isVisible())
+
+    def from_fit_running_changed(self, running):
+        self.ui.fit_button.setText('Cancel' if running else 'Fit')
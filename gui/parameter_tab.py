@@ -1,58 +1,157 @@
-import os
+import difflib
 
-from PyQt4 import uic, QtGui, QtCore
+from PyQt4 import QtGui, QtCore
+import numpy as np
 
-from .util import fill_placeholder
+from backend import instrumentation
+
+class ParameterModel(QtCore.QAbstractTableModel):
+    """
+    The free parameters of a formula, as a table with one row per parameter.
+
+    When the parameter list changes, only the rows of parameters that were added
+      or removed are inserted or deleted, so that views keep their state for the rest.
+    Bounds are edited as text, so that an empty or "inf" entry removes the bound.
+    """
+    headers = ['Parameter','Initial Value','Fitted Value','Lower','Upper','Fixed']
+    NAME, INITIAL, FITTED, LOWER, UPPER, FIXED = range(6)
 
-class ParameterTab(QtGui.QTableWidget):
     def __init__(self, parameters, parent=None):
         super().__init__(parent)
-        self.verticalHeader().hide()
-        self.horizontalScrollBar().hide()
-
         self.parameters = parameters
-        self.parameters.param_changed.connect(self.from_parameter_change)
+        self.rows = list(parameters)
+        self.index_lookup = {par.name:i for i,par in enumerate(self.rows)}
+
+        self.parameters.param_changed.connect(self.from_parameter_change, per_args=True)
         self.parameters.param_list_changed.connect(self.from_parameter_list_change)
 
-        self.index_lookup = {}
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
 
-    def from_parameter_list_change(self, parameters):
-        self.clear()
-        self.index_lookup = {}
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
 
-        self.setRowCount(len(parameters))
-        self.setColumnCount(3)
-        self.setHorizontalHeaderLabels(['Parameter','Initial Value','Fitted Value'])
-        for i,par in enumerate(parameters):
-            label = QtGui.QLabel(par.name, self)
-            self.setCellWidget(i,0,label)
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.headers[section]
+        return None
 
-            spinner = QtGui.QDoubleSpinBox(self)
-            spinner.setMinimum(-1e99)
-            spinner.setMaximum(1e99)
-            spinner.editingFinished.connect(
-                lambda par=par,spinner=spinner :
-                self.on_initial_value_change(par,spinner)
-            )
-            self.setCellWidget(i,1,spinner)
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        column = index.column()
+        if column in (self.INITIAL, self.LOWER, self.UPPER):
+            flags |= QtCore.Qt.ItemIsEditable
+        elif column == self.FIXED:
+            flags |= QtCore.Qt.ItemIsUserCheckable
+        return flags
 
-            fitted = QtGui.QLabel('',self)
-            self.setCellWidget(i,2,fitted)
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        par = self.rows[index.row()]
+        column = index.column()
+        if column == self.FIXED:
+            if role == QtCore.Qt.CheckStateRole:
+                return QtCore.Qt.Checked if par.fixed else QtCore.Qt.Unchecked
+            return None
 
-            self.index_lookup[par.name] = i
+        if role not in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return None
+        if column == self.NAME:
+            return par.name
+        elif column == self.INITIAL:
+            return float(par.initial_value)
+        elif column == self.FITTED:
+            return str(par.fitted_value)
+        elif column == self.LOWER:
+            return format_bound(par.lower)
+        elif column == self.UPPER:
+            return format_bound(par.upper)
 
-            self.from_parameter_change(par)
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        # Changes are reported back through param_changed.
+        par = self.rows[index.row()]
+        column = index.column()
+        if column == self.FIXED and role == QtCore.Qt.CheckStateRole:
+            par.fixed = (value == QtCore.Qt.Checked)
+            return True
+        if role != QtCore.Qt.EditRole:
+            return False
+
+        try:
+            if column == self.INITIAL:
+                par.initial_value = float(value)
+            elif column == self.LOWER:
+                par.lower = parse_bound(value, -np.inf)
+            elif column == self.UPPER:
+                par.upper = parse_bound(value, np.inf)
+            else:
+                return False
+        except ValueError:
+            return False
+        return True
 
     def from_parameter_change(self, par):
-        i = self.index_lookup[par.name]
-        self.cellWidget(i,0).setText(par.name)
-        self.cellWidget(i,1).setValue(par.initial_value)
-        self.cellWidget(i,2).setText(str(par.fitted_value))
-
-    def resizeEvent(self, event):
-        for i in range(self.columnCount()):
-            self.setColumnWidth(i, self.width()/self.columnCount())
-        super().resizeEvent(event)
-
-    def on_initial_value_change(self, par, spinner):
-        par.initial_value = spinner.value()
+        i = self.index_lookup.get(par.name)
+        if i is not None:
+            self.dataChanged.emit(self.index(i, self.INITIAL), self.index(i, len(self.headers)-1))
+
+    def from_parameter_list_change(self, parameters):
+        with instrumentation.timer('gui.parameter_list'):
+            new_rows = list(parameters)
+            for tag, i1, i2, j1, j2 in list_edits(self.rows, new_rows):
+                if tag in ('delete', 'replace'):
+                    self.beginRemoveRows(QtCore.QModelIndex(), i1, i2-1)
+                    del self.rows[i1:i2]
+                    self.endRemoveRows()
+                if tag in ('insert', 'replace'):
+                    self.beginInsertRows(QtCore.QModelIndex(), i1, i1 + (j2-j1) - 1)
+                    self.rows[i1:i1] = new_rows[j1:j2]
+                    self.endInsertRows()
+            self.index_lookup = {par.name:i for i,par in enumerate(self.rows)}
+
+
+def format_bound(value):
+    return '' if np.isinf(value) else str(value)
+
+def parse_bound(text, default):
+    # An empty entry removes the bound.
+    text = str(text).strip()
+    return float(text) if text else default
+
+
+def list_edits(old, new):
+    """
+    Returns the (tag, i1, i2, j1, j2) edits turning the list old into new,
+      as given by difflib.SequenceMatcher.get_opcodes, but without the equal ranges.
+    The edits are in reverse order, so that applying each to old
+      does not move the indices of those that follow.
+    """
+    matcher = difflib.SequenceMatcher(None, [par.name for par in old], [par.name for par in new],
+                                      autojunk=False)
+    return [edit for edit in reversed(matcher.get_opcodes()) if edit[0] != 'equal']
+
+
+class InitialValueDelegate(QtGui.QStyledItemDelegate):
+    """
+    Edits initial values with a spin box allowing any magnitude.
+    """
+    def createEditor(self, parent, option, index):
+        spinner = QtGui.QDoubleSpinBox(parent)
+        spinner.setMinimum(-1e99)
+        spinner.setMaximum(1e99)
+        return spinner
+
+
+class ParameterTab(QtGui.QTableView):
+    def __init__(self, parameters, parent=None):
+        super().__init__(parent)
+        self.verticalHeader().hide()
+        self.horizontalScrollBar().hide()
+        self.horizontalHeader().setResizeMode(QtGui.QHeaderView.Stretch)
+
+        self.parameters = parameters
+        self.parameter_model = ParameterModel(parameters, self)
+        self.setModel(self.parameter_model)
+        self.setItemDelegateForColumn(ParameterModel.INITIAL, InitialValueDelegate(self))
+        self.setEditTriggers(QtGui.QAbstractItemView.AllEditTriggers)
@@ -1,3 +1,5 @@
+import threading
+
 from PyQt4 import QtGui
 
 import matplotlib as mpl
@@ -40,3 +42,42 @@ def clear_layout(layout):
         widget_to_remove = layout.itemAt(i).widget()
         layout.removeWidget(widget_to_remove)
         widget_to_remove.setParent(None)
+
+
+class LatestWorker:
+    """
+    A background thread calling func for the most recent of the requests made to it.
+
+    Requests made while func is running replace any request still waiting,
+      so that work for outdated input is skipped rather than queued.
+    callback is called on the worker thread with the request id and the result,
+      or None if func raised.
+    Passing it the emit of a pyqtSignal delivers the result to the GUI thread.
+    """
+    def __init__(self, func, callback):
+        self.func = func
+        self.callback = callback
+        self._condition = threading.Condition()
+        self._request = None
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def request(self, request_id, *args):
+        with self._condition:
+            self._request = (request_id, args)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._request is None:
+                    self._condition.wait()
+                request_id, args = self._request
+                self._request = None
+
+            try:
+                result = self.func(*args)
+            except Exception:
+                # An error must not stop the thread, or later requests would never be handled.
+                result = None
+            self.callback(request_id, result)
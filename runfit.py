@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Fit a formula to data files from the command line, without the GUI.
+
+Ex:
+    python3 runfit.py 'height*exp(-(x-mu)**2/(2*sigma**2))' hist.npy \\
+        --initial height=100 --initial mu=0 --initial sigma=1
+
+Each data file is either a .npy file or a whitespace-separated text file.
+A file with two or three columns holds x, y, and optionally the error of y,
+  and is fit as a histogram or scatter plot.
+A file with a single column holds individual events, and is fit unbinned.
+
+The results are written as a JSON list, with one entry per data file.
+Neither Qt nor matplotlib is imported.
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from backend.fit_cache import FitCache
+from backend.fitter import FitMethod, fit_many, fit_unbinned
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Fit a formula to one or more data files.')
+    parser.add_argument('formula',
+                        help='The function to fit, in terms of x and the free parameters.')
+    parser.add_argument('files', nargs='+',
+                        help='Data files to fit, each fit independently.')
+    parser.add_argument('--method', default='AutoDetect',
+                        choices=[method.name for method in FitMethod],
+                        help='The fit method to use for binned data.  Single-column files are always fit unbinned, and Unbinned may only be given if every file has a single column.')
+    parser.add_argument('--initial', action='append', default=[], metavar='NAME=VALUE',
+                        help='The starting value of a parameter.  May be repeated.')
+    parser.add_argument('--define', action='append', default=[], metavar='LHS=RHS',
+                        help='A subexpression usable in the formula, such as "linear(m,b)=m*x+b".  May be repeated.')
+    parser.add_argument('--backend', default=None,
+                        help='The evaluation backend: auto, numpy, numexpr or numba.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='The number of processes to use when fitting several files.')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='Start each binned fit from the result of the most similar file already fit, rather than the initial values.')
+    parser.add_argument('--output', default='-',
+                        help='The file to write the results to.  Defaults to stdout.')
+    return parser
+
+
+def parse_args(argv):
+    return make_parser().parse_args(argv)
+
+
+def parse_assignments(assignments, convert=str):
+    output = []
+    for assignment in assignments:
+        name, sep, value = assignment.partition('=')
+        if not sep:
+            raise ValueError('Expected NAME=VALUE, but received "{}"'.format(assignment))
+        output.append((name.strip(), convert(value.strip())))
+    return output
+
+
+def load_data(path):
+    """
+    Returns the contents of a data file as an array of shape (N,) or (N, columns).
+    .npy files are memory-mapped, so that only the parts used are read.
+    """
+    if path.endswith('.npy'):
+        data = np.load(path, mmap_mode='r')
+    else:
+        data = np.loadtxt(path)
+
+    if data.ndim == 2 and data.shape[1] == 1:
+        data = data[:,0]
+    if data.ndim == 2 and data.shape[1] not in (2,3):
+        raise ValueError('{} has {} columns, expected 1, 2 or 3'.format(path, data.shape[1]))
+    if data.ndim not in (1,2):
+        raise ValueError('{} has {} dimensions, expected 1 or 2'.format(path, data.ndim))
+    return data
+
+
+def result_to_json(path, res):
+    return {'file':path,
+            'fit_method':res.fit_method.name,
+            'success':bool(res.success),
+            'message':str(res.message),
+            'cost':float(res.cost),
+            'params':{name:float(val) for name,val in res.params.items()},
+            'errors':{name:float(err) for name,err in zip(res.param_names, res.errors)},
+            'covariance':np.asarray(res.covariance, dtype=float).tolist(),
+            }
+
+
+def main(argv):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    initial_values = dict(parse_assignments(args.initial, float)) or None
+    subexpressions = parse_assignments(args.define) or None
+    fit_method = FitMethod[args.method]
+    if args.backend is not None:
+        # Imported here, as it loads sympy.
+        from backend import evaluation
+        evaluation.set_default_backend(args.backend)
+
+    datasets = [(path, load_data(path)) for path in args.files]
+    results = {}
+
+    binned = [(path,data) for path,data in datasets if data.ndim == 2]
+    if binned and fit_method == FitMethod.Unbinned:
+        parser.error('--method Unbinned requires event data, but {} has {} columns'.format(
+            binned[0][0], binned[0][1].shape[1]))
+    if binned:
+        executor = 'process' if args.jobs > 1 and len(binned) > 1 else None
+        tasks = ((data[:,0], data[:,1], data[:,2] if data.shape[1] == 3 else None)
+                 for path,data in binned)
+        for i,res in fit_many(args.formula, tasks,
+                              fit_method=fit_method,
+                              subexpressions=subexpressions,
+                              initial_values=initial_values,
+                              executor=executor, max_workers=args.jobs,
+                              cache=FitCache() if args.warm_start else None):
+            results[binned[i][0]] = res
+
+    for path,data in datasets:
+        if data.ndim == 1:
+            results[path] = fit_unbinned(args.formula, data,
+                                         subexpressions=subexpressions,
+                                         initial_values=initial_values)
+
+    output = [result_to_json(path, results[path]) for path,_ in datasets]
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    return 0 if all(entry['success'] for entry in output) else 1
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -2,12 +2,24 @@
 
 import sys
 
-from PyQt4 import QtGui, QtCore
+def main(argv):
+    # Qt and matplotlib are imported here, rather than at module level,
+    #   so that they are only loaded when the GUI is actually started.
+    from PyQt4 import QtGui
 
-from gui import MainWindow
+    from gui import MainWindow
+    from backend.scatter_data_set import ScatterDataSet
 
-if __name__=='__main__':
-    app = QtGui.QApplication(sys.argv)
-    w = MainWindow()
+    app = QtGui.QApplication(argv)
+
+    # Optionally, a .npy file of shape (N,2) holding x and y columns.
+    data_set = None
+    if len(argv) > 1:
+        data_set = ScatterDataSet.from_npy(argv[1])
+
+    w = MainWindow(data_set=data_set)
     w.show()
-    sys.exit(app.exec_())
+    return app.exec_()
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv))
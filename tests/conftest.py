@@ -0,0 +1,9 @@
+import pytest
+
+from backend import model_cache
+
+@pytest.fixture(autouse=True)
+def no_model_cache(monkeypatch):
+    # Generated functions are compiled afresh, rather than read from the user's cache.
+    monkeypatch.setattr(model_cache, '_default_cache', None)
+    monkeypatch.setattr(model_cache, '_default_initialized', True)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from backend.compiled_formula import compile_formula
+from backend.fitter import fit, FitMethod
+
+@pytest.fixture
+def xdata():
+    return np.linspace(0, 1, 200)
+
+
+def test_abs_jacobian_is_generated(xdata):
+    compiled = compile_formula('a*Abs(x-b)')
+    assert compiled.has_derivatives
+    value, jacobian = compiled.value_and_jacobian(xdata, 2.0, 0.4)
+    np.testing.assert_allclose(value, 2*np.abs(xdata-0.4))
+    np.testing.assert_allclose(jacobian[:,0], np.abs(xdata-0.4))
+    np.testing.assert_allclose(jacobian[:,1], -2*np.sign(xdata-0.4))
+
+
+def test_abs_fit(xdata):
+    ydata = 2*np.abs(xdata-0.4)
+    res = fit('a*Abs(x-b)', xdata, ydata, initial_values=[1, 0.5])
+    assert res.success
+    np.testing.assert_allclose(res.values, [2, 0.4], atol=1e-6)
+
+
+def test_abs_poisson_fit(xdata):
+    # The second derivative of Abs is a DiracDelta, so the hessian is found numerically.
+    ydata = np.round(3*np.abs(xdata-0.4) + 0.5)
+    res = fit('a*Abs(x-b) + c', xdata, ydata, initial_values=[2, 0.5, 1],
+              fit_method=FitMethod.PoissonStat)
+    assert res.success
+    assert np.all(np.isfinite(res.covariance))
+
+
+def test_heaviside_uses_finite_differences(xdata):
+    compiled = compile_formula('a*Heaviside(x-b) + c')
+    assert not compiled.has_derivatives
+    function, jacobian = compiled.curve_fit_functions()
+    assert jacobian is None
+
+    value, jacobian = compiled.value_and_jacobian(xdata, 3.0, 0.5, 1.0)
+    np.testing.assert_allclose(jacobian[:,0], np.heaviside(xdata-0.5, 0.5), atol=1e-6)
+    np.testing.assert_allclose(jacobian[:,2], 1.0)
+
+
+def test_abs_of_parameter(xdata):
+    ydata = np.exp(-(xdata-0.5)**2/(2*0.04))
+    res = fit('exp(-(x-mu)**2/(2*Abs(s)))', xdata, ydata, initial_values=[0.45, 0.05])
+    np.testing.assert_allclose(res.values, [0.5, 0.04], rtol=1e-6)
+
+
+def test_lazy_jacobian(xdata):
+    compiled = compile_formula('a*exp(-b*x)')
+    function, jacobian = compiled.curve_fit_functions()
+    np.testing.assert_allclose(function(xdata, 2.0, 3.0), 2*np.exp(-3*xdata))
+    jac = jacobian(xdata, 2.0, 3.0)
+    np.testing.assert_allclose(jac[:,1], -2*xdata*np.exp(-3*xdata))
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numexpr', 'numba'])
+def test_special_functions(backend):
+    pytest.importorskip(backend)
+    import scipy.special
+    # Large enough to use the fused kernels
+    xdata = np.linspace(0, 1, 1 << 16)
+    compiled = compile_formula('a*erf(x) + gamma(x+1)', backend=backend)
+    np.testing.assert_allclose(compiled.evaluate(xdata, [2.0]),
+                               2*scipy.special.erf(xdata) + scipy.special.gamma(xdata+1))
+    value, jacobian = compiled.value_and_jacobian(xdata, 2.0)
+    np.testing.assert_allclose(jacobian[:,0], scipy.special.erf(xdata))
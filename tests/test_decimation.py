@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from backend.decimation import OccupancyPyramid
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(3)
+    x = rng.uniform(0, 100, 50000)
+    y = rng.normal(0, 1, 50000)
+    return x, y
+
+
+def pyramid(x, y):
+    return OccupancyPyramid(x, y, (x.min(), x.max()), (y.min(), y.max()),
+                            resolution=64, chunk_size=8192, scan_block_size=1024)
+
+
+def test_inverted_limits(points):
+    x, y = points
+    pyr = pyramid(x, y)
+    for xlim in [(10, 60), (0.5, 0.7)]:
+        expected = pyr.decimate(xlim, (-1, 1), 200, 100)
+        inverted = pyr.decimate(xlim[::-1], (1, -1), 200, 100)
+        assert len(expected[0]) > 0
+        np.testing.assert_array_equal(expected[0], inverted[0])
+        np.testing.assert_array_equal(expected[1], inverted[1])
+
+
+def test_scan_reads_only_overlapping_blocks(points):
+    x, y = points
+    order = np.argsort(x)
+    x, y = x[order], y[order]
+    pyr = pyramid(x, y)
+
+    # Zoomed in past the finest level
+    xlim, ylim = (40.0, 40.5), (-0.5, 0.5)
+    in_view = (x >= xlim[0]) & (x <= xlim[1]) & (y >= ylim[0]) & (y <= ylim[1])
+    x_view, y_view = pyr._scan(xlim, ylim)
+    np.testing.assert_array_equal(np.sort(x_view), np.sort(x[in_view]))
+
+    xmin, xmax, _, _ = pyr.block_bounds
+    assert np.sum((xmax >= xlim[0]) & (xmin <= xlim[1])) <= 2
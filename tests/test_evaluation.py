@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from backend import evaluation
+from backend.compiled_formula import compile_formula
+from backend.fitter import fit, FitMethod
+
+FORMULAS = [
+    'height*exp(-(x-mu)**2/(2*sigma**2)) + background',
+    'a*x**3 + b*x**2 + c*x + d',
+    'a*sqrt(x + 1)*log(x + b) / (1 + c*x)',
+    'a*sin(b*x) + c*cos(x)**2 + Abs(x - b)',
+    'a*x**-1.5 + b*tanh(c*x)',
+]
+PARAMS = [1.3, 0.7, 1.9, 0.4]
+FUSED = ['numexpr', 'numba']
+
+
+def xdata(n):
+    return np.linspace(0.5, 4, n)
+
+
+@pytest.mark.parametrize('backend', FUSED)
+@pytest.mark.parametrize('formula', FORMULAS)
+@pytest.mark.parametrize('n', [100, 2*evaluation.FUSED_THRESHOLD])
+def test_matches_numpy(backend, formula, n):
+    pytest.importorskip(backend)
+    x = xdata(n)
+    expected = compile_formula(formula, backend='numpy')
+    compiled = compile_formula(formula, backend=backend)
+    assert compiled.backend.name == backend
+    params = PARAMS[:len(compiled.free_params)]
+
+    np.testing.assert_allclose(compiled.evaluate(x, params),
+                               expected.evaluate(x, params), rtol=1e-10)
+    for actual, wanted in zip(compiled.value_jacobian_and_hessian(x, *params),
+                              expected.value_jacobian_and_hessian(x, *params)):
+        np.testing.assert_allclose(actual, wanted, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('backend', FUSED)
+def test_output_array(backend):
+    pytest.importorskip(backend)
+    x = xdata(2*evaluation.FUSED_THRESHOLD)
+    compiled = compile_formula(FORMULAS[0], backend=backend)
+    out = np.empty(len(x))
+    assert compiled.evaluate(x, PARAMS, out=out) is out
+    np.testing.assert_allclose(out, compile_formula(FORMULAS[0], backend='numpy').evaluate(x, PARAMS),
+                               rtol=1e-10)
+
+
+@pytest.mark.parametrize('backend', FUSED)
+def test_fit(backend):
+    pytest.importorskip(backend)
+    x = np.linspace(0, 10, 2*evaluation.FUSED_THRESHOLD)
+    y = 20*np.exp(-(x-5)**2/(2*1.5**2)) + 2
+    initial = {'background':1.0, 'height':15.0, 'mu':4.5, 'sigma':1.0}
+    expected = fit(compile_formula(FORMULAS[0], backend='numpy'), x, y,
+                   fit_method=FitMethod.LeastSquares, initial_values=initial)
+    res = fit(compile_formula(FORMULAS[0], backend=backend), x, y,
+              fit_method=FitMethod.LeastSquares, initial_values=initial)
+    np.testing.assert_allclose(res.values, expected.values, rtol=1e-8)
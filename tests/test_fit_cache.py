@@ -0,0 +1,88 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from backend.fit_cache import FitCache
+from backend.fitter import fit, FitMethod
+
+FORMULA = 'height*exp(-(x-mu)**2/(2*sigma**2)) + background'
+INITIAL = {'background':1.0, 'height':15.0, 'mu':4.5, 'sigma':1.0}
+
+@pytest.fixture
+def data():
+    xdata = np.linspace(0, 10, 101)
+    ydata = 20*np.exp(-(xdata-5)**2/(2*1.5**2)) + 2
+    return xdata, ydata
+
+
+def fit_with_progress(xdata, ydata, cache, initial=INITIAL):
+    # Returns the result and the parameters of each evaluation.
+    evaluations = []
+    res = fit(FORMULA, xdata, ydata, initial_values=initial, cache=cache,
+              fit_method=FitMethod.LeastSquares,
+              progress=lambda progress: evaluations.append(progress.values))
+    return res, evaluations
+
+
+def test_hit(data):
+    cache = FitCache()
+    res, evaluations = fit_with_progress(*data, cache)
+    assert evaluations
+    repeat, evaluations = fit_with_progress(*data, cache)
+    assert repeat is res
+    assert not evaluations
+
+
+def test_miss_on_changed_data(data):
+    cache = FitCache(warm_start=False)
+    xdata, ydata = data
+    res, _ = fit_with_progress(xdata, ydata, cache)
+    edited = ydata.copy()
+    edited[10] += 1
+    other, evaluations = fit_with_progress(xdata, edited, cache)
+    assert other is not res
+    assert evaluations
+    np.testing.assert_array_equal(evaluations[0], [INITIAL[name] for name in sorted(INITIAL)])
+    assert len(cache) == 2
+
+
+def test_warm_start(data):
+    cache = FitCache()
+    xdata, ydata = data
+    res, cold = fit_with_progress(xdata, ydata, cache)
+    edited = ydata.copy()
+    edited[10] += 1
+    _, warm = fit_with_progress(xdata, edited, cache)
+    np.testing.assert_array_equal(warm[0], res.values)
+    assert len(warm) < len(cold)
+
+
+def test_no_warm_start_from_other_initial_values(data):
+    cache = FitCache()
+    xdata, ydata = data
+    fit_with_progress(xdata, ydata, cache)
+    edited = ydata.copy()
+    edited[10] += 1
+    initial = dict(INITIAL, mu=6.0)
+    _, evaluations = fit_with_progress(xdata, edited, cache, initial)
+    np.testing.assert_array_equal(evaluations[0], [initial[name] for name in sorted(initial)])
+
+
+def test_least_recently_used_dropped(data):
+    cache = FitCache(max_entries=2)
+    xdata, ydata = data
+    first, _ = fit_with_progress(xdata, ydata, cache)
+    fit_with_progress(xdata, ydata + 1, cache)
+    fit_with_progress(xdata, ydata, cache)
+    fit_with_progress(xdata, ydata + 2, cache)
+    assert len(cache) == 2
+    assert fit_with_progress(xdata, ydata, cache)[0] is first
+
+
+def test_pickle_drops_entries(data):
+    cache = FitCache(max_entries=5, warm_start=False)
+    fit_with_progress(*data, cache)
+    copy = pickle.loads(pickle.dumps(cache))
+    assert len(copy) == 0
+    assert copy.max_entries == 5 and not copy.warm_start
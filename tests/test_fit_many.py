@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from backend.fitter import fit, fit_many, FitMethod
+
+FORMULA = 'height*exp(-(x-mu)**2/(2*sigma**2)) + background'
+INITIAL = {'background':1.0, 'height':15.0, 'mu':4.5, 'sigma':1.0}
+
+
+def datasets(n=6):
+    xdata = np.linspace(0, 10, 101)
+    for i in range(n):
+        mu = 3.0 + 0.5*i
+        ydata = np.round(20*np.exp(-(xdata-mu)**2/(2*1.5**2)) + 2)
+        yield xdata, ydata
+
+
+@pytest.mark.parametrize('executor', [None, 'thread', 'process'])
+@pytest.mark.parametrize('fit_method', [FitMethod.LeastSquares, FitMethod.PoissonStat])
+def test_matches_fit(executor, fit_method):
+    results = list(fit_many(FORMULA, datasets(), fit_method=fit_method,
+                            initial_values=INITIAL, executor=executor, max_workers=2))
+
+    indices = [index for index, _ in results]
+    assert sorted(indices) == list(range(6))
+    if executor is None:
+        assert indices == list(range(6))
+
+    expected = [fit(FORMULA, *dataset, fit_method=fit_method, initial_values=INITIAL)
+                for dataset in datasets()]
+    for index, res in results:
+        assert res.success
+        assert res.param_names == expected[index].param_names
+        np.testing.assert_allclose(res.values, expected[index].values, rtol=1e-5)
+        np.testing.assert_allclose(res.covariance, expected[index].covariance, rtol=1e-3, atol=1e-10)
+        assert res.params['mu'] == pytest.approx(3.0 + 0.5*index, abs=0.05)
+
+
+def test_python_function_process_pool():
+    def line(x, slope, offset):
+        return slope*x + offset
+    with pytest.raises(ValueError):
+        list(fit_many(line, [(np.arange(3.0), np.arange(3.0))], executor='process'))
+
+
+def test_python_function_thread_pool():
+    def line(x, slope, offset):
+        return slope*x + offset
+    xdata = np.linspace(0, 1, 20)
+    results = dict(fit_many(line, [(xdata, k*xdata + 1) for k in range(4)],
+                            fit_method=FitMethod.LeastSquares, initial_values=[1, 0],
+                            executor='thread', max_workers=2))
+    for k in range(4):
+        np.testing.assert_allclose(results[k].values, [k, 1], atol=1e-6)
+
+
+def test_failed_fit_is_yielded():
+    def line(x, slope, offset):
+        return slope*x + offset
+    xdata = np.arange(5.0)
+    [(index, res)] = fit_many(line, [(xdata, xdata)], fit_method=FitMethod.PoissonStat,
+                              initial_values=[1, 0], executor='thread')
+    assert index == 0
+    assert not res.success
+    assert res.param_names == ['slope', 'offset']
+    assert np.all(np.isnan(res.values))
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from backend.fitter import fit, FitMethod
+
+FORMULA = 'height*exp(-(x-mu)**2/(2*sigma**2)) + background'
+TRUTH = {'background':2.0, 'height':20.0, 'mu':5.0, 'sigma':1.5}
+INITIAL = {'background':1.0, 'height':15.0, 'mu':4.5, 'sigma':1.0}
+
+@pytest.fixture
+def data():
+    xdata = np.linspace(0, 10, 101)
+    ydata = np.round(TRUTH['height']*np.exp(-(xdata-TRUTH['mu'])**2/(2*TRUTH['sigma']**2))
+                     + TRUTH['background'])
+    return xdata, ydata
+
+METHODS = [FitMethod.LeastSquares, FitMethod.PoissonStat]
+
+
+@pytest.mark.parametrize('fit_method', METHODS)
+def test_fixed_parameter(data, fit_method):
+    res = fit(FORMULA, *data, fit_method=fit_method,
+              initial_values=dict(INITIAL, mu=5.0), fixed=['mu'])
+    assert res.success
+    assert res.params['mu'] == 5.0
+    assert res.covariance[res.param_names.index('mu')].tolist() == [0, 0, 0, 0]
+    assert res.params['height'] == pytest.approx(TRUTH['height'], rel=0.05)
+
+
+@pytest.mark.parametrize('fit_method', METHODS)
+def test_all_fixed(data, fit_method):
+    res = fit(FORMULA, *data, fit_method=fit_method,
+              initial_values=INITIAL, fixed=list(INITIAL))
+    assert res.params == INITIAL
+    assert np.all(res.covariance == 0)
+    assert res.fit_method == fit_method
+    assert np.isfinite(res.cost) and res.cost > 0
+
+
+@pytest.mark.parametrize('fit_method', METHODS)
+def test_bounds(data, fit_method):
+    res = fit(FORMULA, *data, fit_method=fit_method, initial_values=INITIAL,
+              bounds={'height':(0, 18)})
+    assert res.params['height'] == pytest.approx(18, abs=1e-3)
+    assert res.params['mu'] == pytest.approx(TRUTH['mu'], rel=0.05)
+
+
+@pytest.mark.parametrize('fit_method', METHODS)
+def test_equal_bounds_are_fixed(data, fit_method):
+    res = fit(FORMULA, *data, fit_method=fit_method, initial_values=INITIAL,
+              bounds={'sigma':(1.4, 1.4)})
+    assert res.success
+    assert res.params['sigma'] == 1.4
+
+
+def test_python_function_with_local_variable():
+    def line(x, slope, offset):
+        scaled = slope*x
+        return scaled + offset
+    xdata = np.linspace(0, 1, 20)
+    res = fit(line, xdata, 3*xdata + 1, initial_values=[1, 0])
+    assert res.param_names == ['slope', 'offset']
+    np.testing.assert_allclose(res.values, [3, 1], atol=1e-6)
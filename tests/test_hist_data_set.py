@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from backend.fit_cache import data_digest
+from backend.fitter import fit, FitMethod, iter_chunks
+from backend.hist_data_set import HistDataSet, BinCentres
+
+
+@pytest.fixture
+def data_set(tmp_path):
+    edges = np.linspace(0, 10, 102)**1.1
+    content = np.round(20*np.exp(-(edges[:-1]-5)**2/4) + 2)
+    np.save(tmp_path/'edges.npy', edges)
+    np.save(tmp_path/'content.npy', content)
+    return HistDataSet.from_npy(str(tmp_path/'edges.npy'), str(tmp_path/'content.npy'))
+
+
+def test_bin_centres(data_set):
+    edges = np.asarray(data_set.bin_edges)
+    centres = (edges[:-1] + edges[1:])/2
+    xdata = data_set.xdata
+    assert isinstance(xdata, BinCentres)
+    assert len(xdata) == len(centres) and np.shape(xdata) == centres.shape
+    np.testing.assert_array_equal(np.asarray(xdata), centres)
+    np.testing.assert_array_equal(xdata[10:20], centres[10:20])
+    np.testing.assert_array_equal(xdata[95:200], centres[95:])
+    np.testing.assert_array_equal(xdata[::3], centres[::3])
+    assert xdata[-1] == centres[-1]
+    np.testing.assert_array_equal(np.concatenate(list(iter_chunks(xdata, 7))), centres)
+    assert data_digest(xdata) == data_digest(centres)
+
+
+@pytest.mark.parametrize('fit_method', [FitMethod.LeastSquares, FitMethod.PoissonStat])
+def test_fit(data_set, fit_method):
+    formula = 'height*exp(-(x-mu)**2/4) + background'
+    initial = {'background':1.0, 'height':15.0, 'mu':4.5}
+    centres = np.asarray(data_set.xdata)
+    expected = fit(formula, centres, data_set.ydata, fit_method=fit_method, initial_values=initial)
+    res = fit(formula, data_set.xdata, data_set.ydata, fit_method=fit_method, initial_values=initial)
+    np.testing.assert_allclose(res.values, expected.values, rtol=1e-10)
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+import sympy
+
+from backend import compiled_formula, model_cache
+from backend.compiled_formula import compile_formula
+from backend.model_cache import ModelCache
+
+EXPR = sympy.sympify('a*x + b')
+
+
+def test_round_trip(tmp_path):
+    cache = ModelCache(str(tmp_path/'models'))
+    key = cache.key(EXPR, ['x', 'a', 'b'], 'value')
+    assert cache.get(key) is None
+    cache.put(key, 'source')
+    assert cache.get(key) == 'source'
+    assert os.listdir(str(tmp_path/'models')) == [key + '.py']
+
+
+def test_key(monkeypatch):
+    key = ModelCache.key(EXPR, ['x', 'a', 'b'], 'value')
+    assert key == ModelCache.key(sympy.sympify('b + a*x'), ['x', 'a', 'b'], 'value')
+    assert key != ModelCache.key(EXPR, ['x', 'b', 'a'], 'value')
+    assert key != ModelCache.key(EXPR, ['x', 'a', 'b'], 'jacobian')
+    monkeypatch.setattr(sympy, '__version__', '0.0.1')
+    assert key != ModelCache.key(EXPR, ['x', 'a', 'b'], 'value')
+
+
+def test_eviction(tmp_path):
+    cache = ModelCache(str(tmp_path), max_bytes=250)
+    for i, name in enumerate(['a', 'b', 'c']):
+        cache.put(name, name*100)
+        os.utime(cache.path(name), (1000+i, 1000+i))
+    assert sorted(os.listdir(str(tmp_path))) == ['b.py', 'c.py']
+
+    # Reading an entry marks it as recently used.
+    cache.get('b')
+    cache.put('d', 'd'*100)
+    assert sorted(os.listdir(str(tmp_path))) == ['b.py', 'd.py']
+
+
+@pytest.mark.parametrize('directory', ['', 'models'])
+def test_environment(tmp_path, monkeypatch, directory):
+    monkeypatch.setattr(model_cache, '_default_initialized', False)
+    path = str(tmp_path/directory) if directory else ''
+    monkeypatch.setenv('PYTHOTH_CACHE_DIR', path)
+    cache = model_cache.default_cache()
+    if directory:
+        assert cache.directory == path
+    else:
+        assert cache is None
+
+
+def test_compiled_formula_reads_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_cache, '_default_cache', ModelCache(str(tmp_path)))
+    compiled_formula.clear_cache()
+    xdata = np.linspace(0, 1, 5)
+    expected = compile_formula('a*x + b').evaluate(xdata, [2.0, 1.0])
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    # Compiled again from the cache, without generating the source.
+    def generate_source(*args, **kwargs):
+        raise AssertionError('Source generated despite the cache')
+    monkeypatch.setattr(compiled_formula, 'generate_source', generate_source)
+    compiled_formula.clear_cache()
+    try:
+        np.testing.assert_array_equal(compile_formula('a*x + b').evaluate(xdata, [2.0, 1.0]), expected)
+    finally:
+        compiled_formula.clear_cache()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from backend.fitter import fit, FitMethod
+
+FORMULA = 'height*exp(-(x-mu)**2/(2*sigma**2)) + background'
+TRUTH = {'background':0.5, 'height':8.0, 'mu':5.0, 'sigma':1.0}
+
+
+def poisson_data(seed=1):
+    rng = np.random.default_rng(seed)
+    xdata = np.linspace(0, 10, 101)
+    expected = TRUTH['height']*np.exp(-(xdata-TRUTH['mu'])**2/(2*TRUTH['sigma']**2)) + TRUTH['background']
+    return xdata, rng.poisson(expected).astype(float)
+
+
+def test_constant_is_mean():
+    # The maximum-likelihood estimate of a constant rate is the mean count,
+    #   with an uncertainty of sqrt(mean/n).
+    xdata = np.arange(50.0)
+    ydata = np.random.default_rng(0).poisson(3.0, 50).astype(float)
+    res = fit('rate + 0*x', xdata, ydata, fit_method=FitMethod.PoissonStat,
+              initial_values={'rate':1.0})
+    assert res.success
+    assert res.params['rate'] == pytest.approx(ydata.mean(), rel=1e-6)
+    assert res.errors[0] == pytest.approx(np.sqrt(ydata.mean()/len(ydata)), rel=1e-4)
+
+
+def test_empty_bins():
+    xdata, ydata = poisson_data()
+    assert np.any(ydata == 0)
+    res = fit(FORMULA, xdata, ydata, fit_method=FitMethod.PoissonStat,
+              initial_values={'background':1.0, 'height':5.0, 'mu':4.5, 'sigma':1.5})
+    assert res.success
+    assert res.fit_method == FitMethod.PoissonStat
+    for name, value in TRUTH.items():
+        assert abs(res.params[name] - value) < 4*res.errors[res.param_names.index(name)]
+    assert np.all(np.isfinite(res.covariance))
+    np.testing.assert_allclose(res.covariance, res.covariance.T)
+
+
+def test_auto_detect_selects_poisson():
+    xdata, ydata = poisson_data()
+    res = fit(FORMULA, xdata, ydata,
+              initial_values={'background':1.0, 'height':5.0, 'mu':4.5, 'sigma':1.5})
+    assert res.fit_method == FitMethod.PoissonStat
+
+
+def test_cost_is_half_likelihood_ratio():
+    # At the minimum, the cost is half of the Baker-Cousins chi^2,
+    #   which is zero for a model equal to the data.
+    xdata, ydata = poisson_data()
+    res = fit(FORMULA, xdata, ydata, fit_method=FitMethod.PoissonStat,
+              initial_values={'background':1.0, 'height':5.0, 'mu':4.5, 'sigma':1.5})
+    p = res.params
+    mu = p['height']*np.exp(-(xdata-p['mu'])**2/(2*p['sigma']**2)) + p['background']
+    nonzero = ydata > 0
+    chi2 = 2*np.sum(mu - ydata) + 2*np.sum(ydata[nonzero]*np.log(ydata[nonzero]/mu[nonzero]))
+    assert res.cost == pytest.approx(chi2/2, rel=1e-6)
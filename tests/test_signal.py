@@ -0,0 +1,118 @@
+import threading
+
+import pytest
+
+from backend import signal
+from backend.signal import Signal, batch, flush
+
+
+@pytest.fixture
+def dispatched():
+    # Calls scheduled by the dispatcher, run by the test in place of an event loop
+    scheduled = []
+    signal.set_dispatcher(scheduled.append)
+    yield scheduled
+    signal.set_dispatcher(None)
+
+
+def test_immediate():
+    sig = Signal()
+    calls = []
+    sig.connect(calls.append)
+    sig.emit(1)
+    sig.emit(2)
+    assert calls == [1, 2]
+    assert (sig.emit_count, sig.delivery_count, sig.dropped_count) == (2, 2, 0)
+
+
+def test_batch_coalesces():
+    first, second = Signal(), Signal()
+    calls = []
+    first.connect(lambda value: calls.append(('first', value)))
+    second.connect(lambda value: calls.append(('second', value)))
+    with batch():
+        first.emit(1)
+        second.emit(2)
+        first.emit(3)
+        with batch():
+            first.emit(4)
+        assert calls == []
+    # Ordered by first emission, with the latest arguments
+    assert calls == [('first', 4), ('second', 2)]
+    assert (first.emit_count, first.delivery_count, first.dropped_count) == (3, 1, 2)
+
+
+def test_per_args():
+    sig = Signal()
+    calls = []
+    sig.connect(calls.append, per_args=True)
+    with batch():
+        for value in [1, 2, 1, [3], [3]]:
+            sig.emit(value)
+    assert calls[:2] == [1, 2]
+    assert len(calls) == 4
+
+
+def test_disconnect_during_batch():
+    sig = Signal()
+    calls = []
+    sig.connect(calls.append)
+    with batch():
+        sig.emit(1)
+        sig.disconnect(calls.append)
+    assert calls == []
+
+
+def test_deferred_flush(dispatched):
+    sig = Signal(deferred=True)
+    calls = []
+    sig.connect(calls.append)
+    sig.emit(1)
+    sig.emit(2)
+    assert calls == []
+    assert len(dispatched) == 1
+
+    flush()
+    assert calls == [2]
+    assert sig.dropped_count == 1
+
+    # Flushing again does nothing, and the next emission is scheduled anew.
+    flush()
+    sig.emit(3)
+    assert len(dispatched) == 2
+    dispatched[-1]()
+    assert calls == [2, 3]
+
+
+def test_deferred_without_dispatcher():
+    sig = Signal(deferred=True)
+    calls = []
+    sig.connect(calls.append)
+    sig.emit(1)
+    assert calls == [1]
+
+
+def test_batches_are_per_thread(dispatched):
+    sig = Signal()
+    deferred = Signal(deferred=True)
+    calls = []
+    sig.connect(lambda value: calls.append((threading.get_ident(), value)))
+    deferred.connect(lambda value: calls.append((threading.get_ident(), value)))
+
+    def worker():
+        with batch():
+            sig.emit('worker')
+            sig.emit('worker')
+        deferred.emit('deferred')
+
+    with batch():
+        sig.emit('main')
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        # The worker's batch was delivered in the worker, while this batch is still held back.
+        # The worker does not run the dispatcher's event loop, so its deferred emission
+        #   was delivered immediately.
+        assert calls == [(thread.ident, 'worker'), (thread.ident, 'deferred')]
+    assert calls[-1] == (threading.get_ident(), 'main')
+    assert dispatched == []
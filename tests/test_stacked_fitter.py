@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from backend.fitter import fit, FitMethod, ErrorCalc
+from backend.stacked_fitter import fit_stacked
+
+FORMULA = 'height*exp(-(x-mu)**2/(2*sigma**2)) + background'
+INITIAL = {'background':1.0, 'height':15.0, 'mu':4.5, 'sigma':1.0}
+
+XDATA = np.linspace(0, 10, 51)
+
+
+def model(mu, height=20.0, sigma=1.5, background=2.0):
+    return height*np.exp(-(XDATA-mu)**2/(2*sigma**2)) + background
+
+
+@pytest.fixture
+def ydata():
+    rng = np.random.default_rng(2)
+    mus = np.linspace(4, 6, 8)
+    return np.array([model(mu) for mu in mus]) + rng.normal(0, 0.3, (8, len(XDATA)))
+
+
+def test_matches_fit(ydata):
+    res = fit_stacked(FORMULA, XDATA, ydata, initial_values=INITIAL)
+    assert len(res) == len(ydata)
+    assert res.success.all()
+    for i, y in enumerate(ydata):
+        expected = fit(FORMULA, XDATA, y, fit_method=FitMethod.LeastSquares,
+                       error_calc=ErrorCalc.AllEqualOne, initial_values=INITIAL)
+        assert res.param_names == expected.param_names
+        np.testing.assert_allclose(res.values[i], expected.values, rtol=1e-5)
+        np.testing.assert_allclose(res.errors[i], expected.errors, rtol=1e-3)
+        assert res[i].cost == pytest.approx(expected.cost, rel=1e-6)
+
+
+def test_per_dataset_initial_values(ydata):
+    initial = dict(INITIAL, mu=np.linspace(4, 6, len(ydata)))
+    res = fit_stacked(FORMULA, XDATA, ydata, initial_values=initial)
+    assert res.success.all()
+    np.testing.assert_allclose(res.params['mu'], np.linspace(4, 6, len(ydata)), atol=0.05)
+
+
+def test_convergence_mask():
+    # Started at the minimum, the first data set converges at once,
+    #   while the second is still far from it after a few iterations.
+    ydata = np.array([model(5.0), model(8.0)])
+    initial = {'background':2.0, 'height':20.0, 'mu':np.array([5.0, 6.5]), 'sigma':1.5}
+    res = fit_stacked(FORMULA, XDATA, ydata, initial_values=initial, max_iterations=3)
+    assert res.success.tolist() == [True, False]
+    assert res.iterations[0] < res.iterations[1] == 3
+    assert res[0].success and not res[1].success
+    np.testing.assert_allclose(res.values[0], [2.0, 20.0, 5.0, 1.5])
+
+    res = fit_stacked(FORMULA, XDATA, ydata, initial_values=initial)
+    assert res.success.all()
+    assert res.params['mu'][1] == pytest.approx(8.0)
@@ -0,0 +1,23 @@
+import sympy
+from sympy.parsing.sympy_parser import parse_expr
+
+from backend.substitutions import all_subs
+
+SUBEXPRESSIONS = [('linear(m,b)', 'm*x + b'), ('double(y)', '2*y'), ('width', 'sigma*2')]
+
+
+def test_functions_and_symbols():
+    expr = all_subs('double(linear(a, width))', SUBEXPRESSIONS)
+    assert expr == parse_expr('2*(a*x + 2*sigma)')
+
+
+def test_expression_keys():
+    # Keys that are not symbols are replaced as by sympy's subs.
+    subexpressions = SUBEXPRESSIONS + [('x**2', 'u'), ('a + b', 'c')]
+    assert all_subs('x**4 + linear(a, b)', subexpressions) == parse_expr('u**2 + a*x + b')
+    assert all_subs('width*(a + b)', subexpressions) == parse_expr('2*sigma*c')
+
+
+def test_nested_expansion_with_expression_key():
+    subexpressions = [('q', 'x**2 + 1'), ('x**2', 'u')]
+    assert all_subs('q', subexpressions) == sympy.Symbol('u') + 1
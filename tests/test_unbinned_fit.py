@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from backend import fitter
+from backend.compiled_formula import compile_formula
+from backend.fitter import fit_unbinned, FitMethod
+
+TAU = 2.0
+LOW, HIGH = 0.0, 10.0
+
+
+@pytest.fixture
+def events():
+    return np.random.default_rng(4).exponential(TAU, 5000)
+
+
+def test_extended(events):
+    res = fit_unbinned('n*exp(-x/tau)/tau', events, LOW, HIGH,
+                       initial_values={'n':1000, 'tau':1.0})
+    assert res.success
+    assert res.fit_method == FitMethod.Unbinned
+    n_in_range = np.sum((events >= LOW) & (events <= HIGH))
+    # The extended fit reproduces the number of events,
+    #   with the poisson uncertainty of that number.
+    expected_n = n_in_range/(1 - np.exp(-HIGH/res.params['tau']))
+    assert res.params['n'] == pytest.approx(expected_n, rel=1e-4)
+    assert res.params['tau'] == pytest.approx(TAU, abs=4*res.errors[1])
+
+
+def test_non_extended_matches_extended_shape(events):
+    extended = fit_unbinned('n*exp(-x/tau)/tau', events, LOW, HIGH,
+                            initial_values={'n':1000, 'tau':1.0})
+    shape = fit_unbinned('exp(-x/tau)', events, LOW, HIGH, extended=False,
+                         initial_values={'tau':1.0})
+    assert shape.success
+    assert shape.params['tau'] == pytest.approx(extended.params['tau'], rel=1e-5)
+    assert shape.errors[0] == pytest.approx(extended.errors[1], rel=1e-2)
+
+
+def test_chunks(events):
+    whole = fit_unbinned('exp(-x/tau)', events, LOW, HIGH, extended=False,
+                         initial_values={'tau':1.0})
+    chunked = fit_unbinned('exp(-x/tau)', events, LOW, HIGH, extended=False,
+                           initial_values={'tau':1.0}, chunk_size=333)
+    assert chunked.values == pytest.approx(whole.values, rel=1e-8)
+
+
+@pytest.mark.parametrize('formula', ['n*exp(-x/tau)/tau', 'n*(1 + a*x**2)'])
+def test_symbolic_matches_numeric_normalization(formula):
+    compiled = compile_formula(formula)
+    symbolic = fitter.make_normalization(compiled, LOW, HIGH)
+    assert isinstance(symbolic, fitter.SymbolicNormalization)
+    numeric = fitter.NumericNormalization(compiled, LOW, HIGH)
+
+    params = np.array([0.7, 1.3])
+    for expected, actual in zip(symbolic.value_jacobian_and_hessian(params),
+                                numeric.value_jacobian_and_hessian(params)):
+        np.testing.assert_allclose(actual, expected, rtol=1e-8)
+
+
+def test_numeric_normalization_fit(events, monkeypatch):
+    symbolic = fit_unbinned('n*exp(-x/tau)/tau', events, LOW, HIGH,
+                            initial_values={'n':1000, 'tau':1.0})
+    monkeypatch.setattr(fitter, 'make_normalization', fitter.NumericNormalization)
+    numeric = fit_unbinned('n*exp(-x/tau)/tau', events, LOW, HIGH,
+                           initial_values={'n':1000, 'tau':1.0})
+    np.testing.assert_allclose(numeric.values, symbolic.values, rtol=1e-6)
+    np.testing.assert_allclose(numeric.covariance, symbolic.covariance, rtol=1e-4)